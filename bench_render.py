@@ -0,0 +1,127 @@
+# bench_render.py - Micro-benchmark of keyboard/text rendering per handler call
+#
+# Compares the old per-call builders (copied below as the baseline) with the
+# prebuilt keyboards and string catalog in bot.py. Needs the bot's
+# requirements installed; no network, database or Redis access happens.
+#
+#   python bench_render.py [iterations]
+import sys
+import timeit
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import bot
+
+# ============= BASELINE (before the string catalog) =============
+def legacy_main_menu_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
+    if lang == "am":
+        buttons = [
+            [InlineKeyboardButton(text="👀 ሰዎችን ይመልከቱ", callback_data="browse")],
+            [InlineKeyboardButton(text="💌 ተመሳሳይ ሰዎች", callback_data="matches")],
+            [InlineKeyboardButton(text="⚙️ ማስተካከያዎች", callback_data="settings")],
+            [InlineKeyboardButton(text="🆘 እገዛ", callback_data="help")]
+        ]
+    else:
+        buttons = [
+            [InlineKeyboardButton(text="👀 Browse People", callback_data="browse")],
+            [InlineKeyboardButton(text="💌 My Matches", callback_data="matches")],
+            [InlineKeyboardButton(text="⚙️ Settings", callback_data="settings")],
+            [InlineKeyboardButton(text="🆘 Help", callback_data="help")]
+        ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def legacy_settings_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
+    if lang == "am":
+        buttons = [
+            [InlineKeyboardButton(text="🌍 ቋንቋ ቀይር", callback_data="change_language")],
+            [InlineKeyboardButton(text="📍 አካባቢ አዘምን", callback_data="update_location")],
+            [InlineKeyboardButton(text="👁️ ስልኬን ቀይር", callback_data="toggle_stealth")],
+            [InlineKeyboardButton(text="🔔 ማሳወቂያዎች", callback_data="notifications")],
+            [InlineKeyboardButton(text="🚫 የታገዱ", callback_data="blocked")],
+            [InlineKeyboardButton(text="↩️ ወደ ዋና ገጽ", callback_data="main_menu")]
+        ]
+    else:
+        buttons = [
+            [InlineKeyboardButton(text="🌍 Change Language", callback_data="change_language")],
+            [InlineKeyboardButton(text="📍 Update Location", callback_data="update_location")],
+            [InlineKeyboardButton(text="👁️ Toggle Stealth Mode", callback_data="toggle_stealth")],
+            [InlineKeyboardButton(text="🔔 Notifications", callback_data="notifications")],
+            [InlineKeyboardButton(text="🚫 Blocked Users", callback_data="blocked")],
+            [InlineKeyboardButton(text="↩️ Back to Main", callback_data="main_menu")]
+        ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def legacy_subcity_keyboard() -> InlineKeyboardMarkup:
+    buttons = []
+    subcities = list(bot.SUB_CITIES.keys())
+    for i in range(0, len(subcities), 2):
+        row = []
+        if i < len(subcities):
+            row.append(InlineKeyboardButton(text=subcities[i], callback_data=f"subcity_{subcities[i]}"))
+        if i + 1 < len(subcities):
+            row.append(InlineKeyboardButton(text=subcities[i+1], callback_data=f"subcity_{subcities[i+1]}"))
+        buttons.append(row)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def legacy_interests_keyboard(lang: str = "en", selected=None) -> InlineKeyboardMarkup:
+    if selected is None:
+        selected = []
+    buttons = []
+    for interest in bot.INTEREST_CATALOG.values():
+        name = interest.am if lang == "am" else interest.en
+        check = "✅ " if interest.id in selected else ""
+        buttons.append([
+            InlineKeyboardButton(text=f"{check}{name}", callback_data=f"interest_{interest.id}")
+        ])
+    buttons.append([
+        InlineKeyboardButton(
+            text="✅ Done / ተጠናቅቋል" if lang == "am" else "✅ Done",
+            callback_data="interests_done"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def legacy_settings_text(user: dict) -> str:
+    if user["language"] == "am":
+        return (
+            "⚙️ <b>ማስተካከያዎች</b>\n\n"
+            f"• ቋንቋ: {'አማርኛ' if user['language'] == 'am' else 'English'}\n"
+            f"• አካባቢ: {user['sub_city'] or 'Not set'}\n"
+            f"• ስልክ ሁነት: {'ደብቅ' if user['is_stealth'] else 'ተገልጦ'}\n"
+            f"• ማሳወቂያዎች: {'አንብ' if user['notify_matches'] else 'ጠፋ'}\n\n"
+            "ከታች ለመቀየር ይምረጡ፦"
+        )
+    return (
+        "⚙️ <b>Settings</b>\n\n"
+        f"• Language: {'Amharic' if user['language'] == 'am' else 'English'}\n"
+        f"• Location: {user['sub_city'] or 'Not set'}\n"
+        f"• Stealth Mode: {'On' if user['is_stealth'] else 'Off'}\n"
+        f"• Notifications: {'On' if user['notify_matches'] else 'Off'}\n\n"
+        "Select below to change:"
+    )
+
+# ============= CASES =============
+USER = {"language": "am", "sub_city": "Bole", "is_stealth": False, "notify_matches": True}
+SELECTED = [1, 4, 9]
+
+CASES = [
+    ("main menu", lambda: legacy_main_menu_keyboard("am"),
+     lambda: bot.get_main_menu_keyboard("am")),
+    ("settings screen", lambda: (legacy_settings_text(USER), legacy_settings_keyboard("am")),
+     lambda: (bot.settings_text(USER, "am"), bot.get_settings_keyboard("am"))),
+    ("sub-city picker", legacy_subcity_keyboard, bot.get_subcity_keyboard),
+    ("interests (none)", lambda: legacy_interests_keyboard("am"),
+     lambda: bot.get_interests_keyboard("am")),
+    ("interests (3 checked)", lambda: legacy_interests_keyboard("am", SELECTED),
+     lambda: bot.get_interests_keyboard("am", SELECTED)),
+]
+
+def main(iterations: int) -> None:
+    print(f"{'case':<24}{'before µs':>12}{'after µs':>12}{'speedup':>10}")
+    for name, before, after in CASES:
+        t_before = min(timeit.repeat(before, number=iterations, repeat=5)) / iterations * 1e6
+        t_after = min(timeit.repeat(after, number=iterations, repeat=5)) / iterations * 1e6
+        print(f"{name:<24}{t_before:>12.2f}{t_after:>12.2f}{t_before / t_after:>9.1f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
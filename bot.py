@@ -1,11 +1,21 @@
 # bot.py - Complete production-ready bot for Railway
 import asyncio
+import hashlib
+import html
 import logging
+import multiprocessing
 import os
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+import signal
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, List, Dict, Mapping, NamedTuple, Optional, Tuple
 
-from aiogram import Bot, Dispatcher, types, F, Router
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F, Router
+from aiogram.dispatcher.flags import get_flag
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.redis import RedisStorage
@@ -17,8 +27,13 @@ from aiogram.types import (
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart, Command
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+    TelegramRetryAfter, TelegramServerError
+)
 import asyncpg
 from redis.asyncio import Redis
+from redis.exceptions import LockNotOwnedError, ResponseError, WatchError
 import math
 import json
 from dotenv import load_dotenv
@@ -35,6 +50,141 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 PORT = int(os.getenv("PORT", 8080))
 
+# Runtime mode: "polling" for local development, "webhook" in production
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or os.getenv("RAILWAY_STATIC_URL", "")
+if WEBHOOK_BASE_URL and "://" not in WEBHOOK_BASE_URL:
+    WEBHOOK_BASE_URL = f"https://{WEBHOOK_BASE_URL}"
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_BASE_URL else "polling").lower()
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError(f"BOT_MODE must be 'polling' or 'webhook', got {BOT_MODE!r}")
+if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_BASE_URL or RAILWAY_STATIC_URL")
+
+# Served and registered path must match; the token stays out of URLs and logs
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "/webhook").strip("/")
+WEBHOOK_URL = f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}"
+# Sent by Telegram in X-Telegram-Bot-Api-Secret-Token; only [A-Za-z0-9_-]
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(TOKEN.encode()).hexdigest()[:32]
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+WEBHOOK_DROP_PENDING = os.getenv("WEBHOOK_DROP_PENDING", "false").lower() in ("1", "true", "yes")
+WEBHOOK_FINGERPRINT_KEY = "webhook:fingerprint"  # hash of the last settings passed to setWebhook
+# Set to false when migrations run as a separate release step
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+# Serving: WEB_CONCURRENCY > 1 forks that many webhook workers
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+# Replicas serving the same bot; bot-wide send rates are split across
+# REPLICA_COUNT * WEB_CONCURRENCY processes, so keep it in sync with scaling
+REPLICA_COUNT = int(os.getenv("REPLICA_COUNT", 1))
+WORKER_RESTART_BACKOFF_MAX = 60  # seconds between restarts of a crashing worker
+WORKER_MAX_RESTARTS = 10  # consecutive crashes before the supervisor gives up
+WORKER_STABLE_AFTER = 60  # uptime that resets a worker's crash count
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 25))  # wait for in-flight updates
+DRAIN_DELAY = float(os.getenv("DRAIN_DELAY", 3))  # readiness fails this long before closing
+USER_LOCK_TIMEOUT = 30
+USER_LOCK_WAIT = 10
+# "local" only orders updates within one process; any configured Redis
+# (several workers or replicas) gets the shared lock
+USER_LOCK_BACKEND = os.getenv("USER_LOCK_BACKEND", "redis" if os.getenv("REDIS_URL") else "local")
+UPDATE_DEDUP_TTL = 600  # Telegram stops redelivering well before this
+ACTION_ONCE_TTL = 60  # window in which a repeated tap is ignored
+
+# Database connection pool
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))  # 0 behind PgBouncer
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 10))
+
+# Geospatial search
+GEO_CELL_DEG = 0.05  # Grid cell size (~5.5 km); must match the users.geo_cell expression
+MAX_SEARCH_RADIUS_KM = int(os.getenv("MAX_SEARCH_RADIUS_KM", 50))
+
+# Seen-profile exclusion
+SEEN_BITMAP_THRESHOLD = int(os.getenv("SEEN_BITMAP_THRESHOLD", 500))  # swipes before Redis bitmap takes over
+SEEN_BITMAP_TTL = 2 * 24 * 3600
+SEEN_OVERFETCH = 3
+SEEN_MAX_PAGES = 5
+
+# Per-user candidate queue
+CANDIDATE_BATCH_SIZE = int(os.getenv("CANDIDATE_BATCH_SIZE", 50))
+CANDIDATE_LOW_WATER = int(os.getenv("CANDIDATE_LOW_WATER", 10))
+CANDIDATE_QUEUE_TTL = 3600
+CANDIDATE_REFILL_WAIT = 2.0  # seconds a cold browse waits on another worker's refill
+CANDIDATE_STALE_SKIPS = 5
+
+# Candidate ranking: nearest RANK_POOL_FACTOR * limit rows are scored
+RANK_POOL_FACTOR = 4
+RANK_POOL_MAX = int(os.getenv("RANK_POOL_MAX", 200))  # caps per-request scoring work
+RANK_WEIGHT_INTERESTS = float(os.getenv("RANK_WEIGHT_INTERESTS", 0.5))
+RANK_WEIGHT_DISTANCE = float(os.getenv("RANK_WEIGHT_DISTANCE", 0.35))
+RANK_WEIGHT_RECENCY = float(os.getenv("RANK_WEIGHT_RECENCY", 0.15))
+RANK_RECENCY_HALF_LIFE_DAYS = 14
+CANDIDATE_QUEUE_FIELDS = {
+    "latitude", "longitude", "sub_city", "search_radius",
+    "gender", "preference", "is_stealth", "is_active",
+}
+
+# Daily like quota (counted per Addis Ababa calendar day)
+DAILY_LIKE_LIMIT = int(os.getenv("DAILY_LIKE_LIMIT", 50))
+ADDIS_TZ = timezone(timedelta(hours=3))  # EAT, no DST
+LIKE_QUOTA_FLUSH_INTERVAL = int(os.getenv("LIKE_QUOTA_FLUSH_INTERVAL", 60))
+
+# Outbound message queue (Redis stream drained by rate-limited workers)
+OUTBOX_STREAM = "outbox"
+OUTBOX_GROUP = "outbox-workers"
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 25))  # msg/s, under Telegram's ~30
+OUTBOX_BULK_STREAM = "outbox:bulk"  # low-priority fan-out, drained separately
+OUTBOX_BULK_WORKERS = int(os.getenv("OUTBOX_BULK_WORKERS", 1))
+OUTBOX_BULK_RATE = float(os.getenv("OUTBOX_BULK_RATE", 5))  # msg/s cap, taken out of the global rate
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))  # msg/s per chat
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_MAXLEN = 100_000
+OUTBOX_CLAIM_IDLE_MS = 60_000  # pending this long means the consumer died
+OUTBOX_SEND_CONCURRENCY = int(os.getenv("OUTBOX_SEND_CONCURRENCY", 10))  # in-flight sends per worker
+OUTBOX_DEDUP_TTL = 3600
+OUTBOX_STATUS_TTL = 24 * 3600
+
+# "Someone new nearby" alerts
+NEARBY_ALERT_CHUNK = 500
+NEARBY_ALERT_CONCURRENCY = 20
+NEARBY_ALERT_DAILY_CAP = int(os.getenv("NEARBY_ALERT_DAILY_CAP", 3))
+
+# Match chat relay: messages are buffered in Redis and written in batches
+CHAT_PENDING_KEY = "chat:pending"
+CHAT_FLUSH_INTERVAL = float(os.getenv("CHAT_FLUSH_INTERVAL", 1))
+CHAT_FLUSH_BATCH = 500
+CHAT_HISTORY_PAGE = 10
+MATCHES_PAGE = 10
+
+# Moderation: distinct reporters that hide a profile pending review
+REPORT_HIDE_THRESHOLD = int(os.getenv("REPORT_HIDE_THRESHOLD", 3))
+MODERATION_PAGE = 5
+HIDDEN_USERS_KEY = "hidden:users"
+BLOCK_SET_TTL = 7 * 24 * 3600
+
+# Profile photos: album size and file_id health tracking
+PROFILE_MAX_PHOTOS = int(os.getenv("PROFILE_MAX_PHOTOS", 3))
+BAD_PHOTOS_KEY = "photo:bad"  # hash of file_id -> owner users.id
+PHOTO_REVALIDATE_INTERVAL = 600
+
+# Interface languages; see LOCALIZATION for the string catalog
+DEFAULT_LANGUAGE = "en"
+SUPPORTED_LANGUAGES = ("en", "am")
+
+# Pre-rendered browse cards per (profile, language)
+PROFILE_CARD_LANGUAGES = SUPPORTED_LANGUAGES
+PROFILE_CARD_VERSION = 1  # bump when the card layout changes
+PROFILE_CARD_TTL = 24 * 3600
+CHAT_MEDIA_KINDS = ("photo", "video", "animation", "document", "audio", "voice", "video_note", "sticker")
+
+# User profile cache
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_LOCAL_TTL = float(os.getenv("USER_CACHE_LOCAL_TTL", 5))  # bounds staleness across workers
+USER_CACHE_REDIS_TTL = int(os.getenv("USER_CACHE_REDIS_TTL", 600))
+
 # Ethiopian cultural interests
 CULTURAL_INTERESTS = [
     {"id": 1, "en": "Bunna (Coffee)", "am": "ቡና"},
@@ -49,6 +199,26 @@ CULTURAL_INTERESTS = [
     {"id": 10, "en": "Orthodox Christianity", "am": "ኦርቶዶክስ ክርስትና"},
 ]
 
+class Interest(NamedTuple):
+    id: int
+    en: str
+    am: str
+    bit: int  # Position in users.interest_mask
+
+# Read-only catalog shared by seeding, keyboards and scoring
+INTEREST_CATALOG: Mapping[int, Interest] = MappingProxyType({
+    item["id"]: Interest(item["id"], item["en"], item["am"], 1 << (item["id"] - 1))
+    for item in CULTURAL_INTERESTS
+})
+
+def interest_mask(interest_ids: List[int]) -> int:
+    """Bitmask of catalog interests, one bit per interest"""
+    mask = 0
+    for interest_id in interest_ids:
+        if interest_id in INTEREST_CATALOG:
+            mask |= INTEREST_CATALOG[interest_id].bit
+    return mask
+
 # Addis Ababa sub-cities with coordinates
 SUB_CITIES = {
     "Bole": (8.9806, 38.7990),
@@ -64,107 +234,1028 @@ SUB_CITIES = {
     "Gullele": (9.0800, 38.7900),
 }
 
-# ============= DATABASE SETUP =============
-async def init_db():
-    """Initialize PostgreSQL database connection"""
-    conn = await asyncpg.connect(DATABASE_URL)
-    
-    # Create tables if they don't exist
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            telegram_id BIGINT UNIQUE NOT NULL,
-            language VARCHAR(10) DEFAULT 'en',
-            full_name VARCHAR(200) NOT NULL,
-            age INTEGER,
-            gender VARCHAR(20),
-            preference VARCHAR(20) DEFAULT 'both',
-            bio TEXT,
-            latitude FLOAT,
-            longitude FLOAT,
-            sub_city VARCHAR(100),
-            search_radius INTEGER DEFAULT 10,
-            photo_ids JSONB DEFAULT '[]',
-            main_photo_id VARCHAR(300),
-            is_verified BOOLEAN DEFAULT FALSE,
-            is_active BOOLEAN DEFAULT TRUE,
-            is_stealth BOOLEAN DEFAULT FALSE,
-            is_premium BOOLEAN DEFAULT FALSE,
-            notify_matches BOOLEAN DEFAULT TRUE,
-            notify_nearby BOOLEAN DEFAULT TRUE,
-            likes_today INTEGER DEFAULT 0,
-            last_like_reset TIMESTAMP DEFAULT NOW(),
-            created_at TIMESTAMP DEFAULT NOW(),
-            updated_at TIMESTAMP DEFAULT NOW(),
-            last_seen TIMESTAMP DEFAULT NOW()
-        )
-    ''')
+# ============= SCHEMA MIGRATIONS =============
+# Migrations run once each, in version order, and are recorded in
+# schema_version. Plain migrations apply all statements in one
+# transaction. "concurrent" migrations build indexes one by one outside
+# a transaction with CREATE INDEX CONCURRENTLY so writes keep flowing,
+# and drop superseded ones with DROP INDEX CONCURRENTLY.
+# "batched" migrations repeat each statement, one short transaction per
+# MIGRATION_BATCH_SIZE rows ($1), until it touches no rows.
+MIGRATION_LOCK_ID = 8_543_856_764
+MIGRATION_TIMEOUT = 3600
+MIGRATION_BATCH_SIZE = 5000
+
+MIGRATIONS = [
+    {
+        "version": 1,
+        "name": "initial schema",
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,
+                telegram_id BIGINT UNIQUE NOT NULL,
+                language VARCHAR(10) DEFAULT 'en',
+                full_name VARCHAR(200) NOT NULL,
+                age INTEGER,
+                gender VARCHAR(20),
+                preference VARCHAR(20) DEFAULT 'both',
+                bio TEXT,
+                latitude FLOAT,
+                longitude FLOAT,
+                sub_city VARCHAR(100),
+                search_radius INTEGER DEFAULT 10,
+                photo_ids JSONB DEFAULT '[]',
+                main_photo_id VARCHAR(300),
+                is_verified BOOLEAN DEFAULT FALSE,
+                is_active BOOLEAN DEFAULT TRUE,
+                is_stealth BOOLEAN DEFAULT FALSE,
+                is_premium BOOLEAN DEFAULT FALSE,
+                notify_matches BOOLEAN DEFAULT TRUE,
+                notify_nearby BOOLEAN DEFAULT TRUE,
+                likes_today INTEGER DEFAULT 0,
+                last_like_reset TIMESTAMP DEFAULT NOW(),
+                created_at TIMESTAMP DEFAULT NOW(),
+                updated_at TIMESTAMP DEFAULT NOW(),
+                last_seen TIMESTAMP DEFAULT NOW()
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS interests (
+                id SERIAL PRIMARY KEY,
+                name_en VARCHAR(100) NOT NULL,
+                name_am VARCHAR(100) NOT NULL
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS user_interests (
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                interest_id INTEGER REFERENCES interests(id) ON DELETE CASCADE,
+                PRIMARY KEY (user_id, interest_id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS likes (
+                id SERIAL PRIMARY KEY,
+                from_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                to_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT NOW(),
+                UNIQUE(from_user_id, to_user_id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS matches (
+                id SERIAL PRIMARY KEY,
+                user1_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                user2_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                matched_at TIMESTAMP DEFAULT NOW(),
+                chat_active BOOLEAN DEFAULT TRUE
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id SERIAL PRIMARY KEY,
+                match_id INTEGER REFERENCES matches(id) ON DELETE CASCADE,
+                sender_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                message TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS reports (
+                id SERIAL PRIMARY KEY,
+                reporter_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                reported_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                reason TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+            ''',
+        ],
+    },
+    {
+        "version": 2,
+        "name": "geo grid cells and haversine",
+        "statements": [
+            # Grid cell for the bounding-box prefilter in get_nearby_users
+            '''
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS geo_cell BIGINT
+            GENERATED ALWAYS AS (
+                (floor(latitude / 0.05::float8)::bigint + 1800) * 10000
+                + (floor(longitude / 0.05::float8)::bigint + 3600)
+            ) STORED
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_users_geo_cell
+            ON users (geo_cell)
+            WHERE is_active AND NOT is_stealth
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION haversine_km(
+                lat1 float8, lon1 float8, lat2 float8, lon2 float8
+            ) RETURNS float8
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+                SELECT 2 * 6371 * asin(sqrt(LEAST(1.0,
+                    power(sin(radians(lat2 - lat1) / 2), 2)
+                    + cos(radians(lat1)) * cos(radians(lat2))
+                      * power(sin(radians(lon2 - lon1) / 2), 2)
+                )))
+            $$
+            ''',
+        ],
+    },
+    {
+        "version": 3,
+        "name": "swipes",
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS swipes (
+                user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                target_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                action VARCHAR(10) NOT NULL CHECK (action IN ('like', 'dislike', 'skip')),
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (user_id, target_id)
+            )
+            ''',
+            # Likes made before swipes existed count as seen
+            '''
+            INSERT INTO swipes (user_id, target_id, action, created_at)
+            SELECT from_user_id, to_user_id, 'like', created_at FROM likes
+            ON CONFLICT DO NOTHING
+            ''',
+        ],
+    },
+    {
+        "version": 4,
+        "name": "hot path indexes",
+        "concurrent": True,
+        "indexes": [
+            # Reverse-like lookup when checking for a match
+            ("idx_likes_to_from", "ON likes (to_user_id, from_user_id)"),
+            # Match lists from either side, newest first
+            ("idx_matches_user1", "ON matches (user1_id, matched_at DESC)"),
+            ("idx_matches_user2", "ON matches (user2_id, matched_at DESC)"),
+            # Visibility/preference filters and admin counts
+            ("idx_users_visibility", "ON users (is_active, is_stealth, gender, preference)"),
+            # Chat history per match
+            ("idx_chat_messages_match", "ON chat_messages (match_id, created_at)"),
+            # Report lookups per reported user
+            ("idx_reports_reported", "ON reports (reported_id, created_at)"),
+        ],
+    },
+    {
+        "version": 5,
+        "name": "atomic record_like",
+        "statements": [
+            # One call resolves both users, upserts the like and swipe, bumps
+            # the counter and creates the match. The pair lock makes two
+            # simultaneous likes between the same users see each other.
+            '''
+            CREATE OR REPLACE FUNCTION record_like(p_from_telegram_id BIGINT, p_to_user_id INTEGER)
+            RETURNS TABLE (
+                liker_id INTEGER,
+                target_telegram_id BIGINT,
+                target_language VARCHAR,
+                target_notify_matches BOOLEAN,
+                is_new_like BOOLEAN,
+                is_new_match BOOLEAN,
+                match_id INTEGER
+            )
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v_rows INTEGER;
+                v_low INTEGER;
+                v_high INTEGER;
+            BEGIN
+                SELECT u.id INTO liker_id FROM users u WHERE u.telegram_id = p_from_telegram_id;
+                SELECT u.telegram_id, u.language, u.notify_matches
+                  INTO target_telegram_id, target_language, target_notify_matches
+                  FROM users u WHERE u.id = p_to_user_id;
+                IF liker_id IS NULL OR target_telegram_id IS NULL OR liker_id = p_to_user_id THEN
+                    RETURN;
+                END IF;
+                
+                v_low := LEAST(liker_id, p_to_user_id);
+                v_high := GREATEST(liker_id, p_to_user_id);
+                PERFORM pg_advisory_xact_lock(v_low, v_high);
+                
+                INSERT INTO likes (from_user_id, to_user_id)
+                VALUES (liker_id, p_to_user_id)
+                ON CONFLICT (from_user_id, to_user_id) DO NOTHING;
+                GET DIAGNOSTICS v_rows = ROW_COUNT;
+                is_new_like := v_rows > 0;
+                is_new_match := FALSE;
+                
+                INSERT INTO swipes (user_id, target_id, action)
+                VALUES (liker_id, p_to_user_id, 'like')
+                ON CONFLICT (user_id, target_id) DO UPDATE
+                SET action = 'like', created_at = NOW();
+                
+                IF is_new_like THEN
+                    UPDATE users SET likes_today = likes_today + 1 WHERE id = liker_id;
+                    
+                    IF EXISTS (
+                        SELECT 1 FROM likes l
+                        WHERE l.from_user_id = p_to_user_id AND l.to_user_id = liker_id
+                    ) THEN
+                        SELECT m.id INTO match_id FROM matches m
+                        WHERE (m.user1_id = v_low AND m.user2_id = v_high)
+                           OR (m.user1_id = v_high AND m.user2_id = v_low)
+                        LIMIT 1;
+                        
+                        IF match_id IS NULL THEN
+                            INSERT INTO matches (user1_id, user2_id)
+                            VALUES (v_low, v_high)
+                            RETURNING id INTO match_id;
+                            is_new_match := TRUE;
+                        END IF;
+                    END IF;
+                END IF;
+                
+                RETURN NEXT;
+            END
+            $$
+            ''',
+        ],
+    },
+    {
+        "version": 6,
+        "name": "interest bitmask",
+        "statements": [
+            # Bit (interest_id - 1) set per interest; overlap is a popcount
+            '''
+            ALTER TABLE users ADD COLUMN IF NOT EXISTS interest_mask INTEGER NOT NULL DEFAULT 0
+            ''',
+            '''
+            UPDATE users u SET interest_mask = m.mask
+            FROM (
+                SELECT user_id, bit_or(1 << (interest_id - 1)) AS mask
+                FROM user_interests
+                GROUP BY user_id
+            ) m
+            WHERE m.user_id = u.id
+            ''',
+        ],
+    },
+    {
+        "version": 7,
+        "name": "record_like without likes_today bump",
+        "statements": [
+            # Daily like counts live in Redis; users.likes_today is written
+            # behind by flush_like_quotas
+            '''
+            CREATE OR REPLACE FUNCTION record_like(p_from_telegram_id BIGINT, p_to_user_id INTEGER)
+            RETURNS TABLE (
+                liker_id INTEGER,
+                target_telegram_id BIGINT,
+                target_language VARCHAR,
+                target_notify_matches BOOLEAN,
+                is_new_like BOOLEAN,
+                is_new_match BOOLEAN,
+                match_id INTEGER
+            )
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v_rows INTEGER;
+                v_low INTEGER;
+                v_high INTEGER;
+            BEGIN
+                SELECT u.id INTO liker_id FROM users u WHERE u.telegram_id = p_from_telegram_id;
+                SELECT u.telegram_id, u.language, u.notify_matches
+                  INTO target_telegram_id, target_language, target_notify_matches
+                  FROM users u WHERE u.id = p_to_user_id;
+                IF liker_id IS NULL OR target_telegram_id IS NULL OR liker_id = p_to_user_id THEN
+                    RETURN;
+                END IF;
+                
+                v_low := LEAST(liker_id, p_to_user_id);
+                v_high := GREATEST(liker_id, p_to_user_id);
+                PERFORM pg_advisory_xact_lock(v_low, v_high);
+                
+                INSERT INTO likes (from_user_id, to_user_id)
+                VALUES (liker_id, p_to_user_id)
+                ON CONFLICT (from_user_id, to_user_id) DO NOTHING;
+                GET DIAGNOSTICS v_rows = ROW_COUNT;
+                is_new_like := v_rows > 0;
+                is_new_match := FALSE;
+                
+                INSERT INTO swipes (user_id, target_id, action)
+                VALUES (liker_id, p_to_user_id, 'like')
+                ON CONFLICT (user_id, target_id) DO UPDATE
+                SET action = 'like', created_at = NOW();
+                
+                IF is_new_like THEN
+                    IF EXISTS (
+                        SELECT 1 FROM likes l
+                        WHERE l.from_user_id = p_to_user_id AND l.to_user_id = liker_id
+                    ) THEN
+                        SELECT m.id INTO match_id FROM matches m
+                        WHERE (m.user1_id = v_low AND m.user2_id = v_high)
+                           OR (m.user1_id = v_high AND m.user2_id = v_low)
+                        LIMIT 1;
+                        
+                        IF match_id IS NULL THEN
+                            INSERT INTO matches (user1_id, user2_id)
+                            VALUES (v_low, v_high)
+                            RETURNING id INTO match_id;
+                            is_new_match := TRUE;
+                        END IF;
+                    END IF;
+                END IF;
+                
+                RETURN NEXT;
+            END
+            $$
+            ''',
+        ],
+    },
+    {
+        "version": 8,
+        "name": "nearby alert recipients index",
+        "concurrent": True,
+        "indexes": [
+            # Opted-in recipients by grid cell, walked in id order
+            ("idx_users_notify_nearby", "ON users (geo_cell, id) WHERE notify_nearby AND is_active"),
+        ],
+    },
+    {
+        "version": 9,
+        "name": "chat message media",
+        "statements": [
+            '''
+            ALTER TABLE chat_messages
+                ADD COLUMN IF NOT EXISTS kind TEXT NOT NULL DEFAULT 'text',
+                ADD COLUMN IF NOT EXISTS file_id TEXT
+            ''',
+        ],
+    },
+    {
+        "version": 10,
+        "name": "chat history keyset index",
+        "concurrent": True,
+        "indexes": [
+            # History pages walk (match_id, id) backwards
+            ("idx_chat_messages_match_id", "ON chat_messages (match_id, id)"),
+        ],
+    },
+    {
+        "version": 11,
+        "name": "match list keyset indexes",
+        "concurrent": True,
+        "indexes": [
+            # Match pages per side, keyset on (matched_at, id)
+            ("idx_matches_user1_keyset", "ON matches (user1_id, matched_at DESC, id DESC)"),
+            ("idx_matches_user2_keyset", "ON matches (user2_id, matched_at DESC, id DESC)"),
+        ],
+    },
+    {
+        "version": 12,
+        "name": "dedup matches to one row per pair",
+        "batched": True,
+        "statements": [
+            # Older code wrote both (a,b) and (b,a). Keep the earliest row of
+            # each pair, moving chat history onto it before the rest go
+            '''
+            WITH d AS (
+                SELECT id, FIRST_VALUE(id) OVER (
+                    PARTITION BY LEAST(user1_id, user2_id), GREATEST(user1_id, user2_id)
+                    ORDER BY matched_at NULLS LAST, id
+                ) AS keep_id
+                FROM matches
+            ), batch AS (
+                SELECT c.id, d.keep_id
+                FROM chat_messages c JOIN d ON d.id = c.match_id
+                WHERE d.id <> d.keep_id
+                LIMIT $1
+            )
+            UPDATE chat_messages c SET match_id = batch.keep_id
+            FROM batch WHERE c.id = batch.id
+            ''',
+            '''
+            DELETE FROM matches WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, FIRST_VALUE(id) OVER (
+                        PARTITION BY LEAST(user1_id, user2_id), GREATEST(user1_id, user2_id)
+                        ORDER BY matched_at NULLS LAST, id
+                    ) AS keep_id
+                    FROM matches
+                ) d
+                WHERE d.id <> d.keep_id
+                LIMIT $1
+            )
+            ''',
+            '''
+            DELETE FROM matches WHERE id IN (
+                SELECT id FROM matches WHERE user1_id = user2_id LIMIT $1
+            )
+            ''',
+            '''
+            UPDATE matches SET user1_id = user2_id, user2_id = user1_id
+            WHERE id IN (
+                SELECT id FROM matches WHERE user1_id > user2_id LIMIT $1
+            )
+            ''',
+        ],
+    },
+    {
+        "version": 13,
+        "name": "match pair unique index",
+        "concurrent": True,
+        "indexes": [
+            # Built online, then attached as the pair constraint
+            ("matches_pair_key", "ON matches (user1_id, user2_id)", True),
+        ],
+    },
+    {
+        "version": 14,
+        "name": "canonical match constraints",
+        "statements": [
+            '''
+            ALTER TABLE matches
+                ADD CONSTRAINT matches_pair_key UNIQUE USING INDEX matches_pair_key
+            ''',
+            # Checked for new rows only; the scan of existing rows is
+            # migration 19, in its own transaction
+            '''
+            ALTER TABLE matches
+                ADD CONSTRAINT matches_pair_order CHECK (user1_id < user2_id) NOT VALID
+            ''',
+            # Covered by matches_pair_key and the keyset indexes
+            "DROP INDEX IF EXISTS idx_matches_user1",
+            "DROP INDEX IF EXISTS idx_matches_user2",
+            # The match insert now relies on the pair constraint
+            '''
+            CREATE OR REPLACE FUNCTION record_like(p_from_telegram_id BIGINT, p_to_user_id INTEGER)
+            RETURNS TABLE (
+                liker_id INTEGER,
+                target_telegram_id BIGINT,
+                target_language VARCHAR,
+                target_notify_matches BOOLEAN,
+                is_new_like BOOLEAN,
+                is_new_match BOOLEAN,
+                match_id INTEGER
+            )
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v_rows INTEGER;
+                v_low INTEGER;
+                v_high INTEGER;
+            BEGIN
+                SELECT u.id INTO liker_id FROM users u WHERE u.telegram_id = p_from_telegram_id;
+                SELECT u.telegram_id, u.language, u.notify_matches
+                  INTO target_telegram_id, target_language, target_notify_matches
+                  FROM users u WHERE u.id = p_to_user_id;
+                IF liker_id IS NULL OR target_telegram_id IS NULL OR liker_id = p_to_user_id THEN
+                    RETURN;
+                END IF;
+                
+                v_low := LEAST(liker_id, p_to_user_id);
+                v_high := GREATEST(liker_id, p_to_user_id);
+                PERFORM pg_advisory_xact_lock(v_low, v_high);
+                
+                INSERT INTO likes (from_user_id, to_user_id)
+                VALUES (liker_id, p_to_user_id)
+                ON CONFLICT (from_user_id, to_user_id) DO NOTHING;
+                GET DIAGNOSTICS v_rows = ROW_COUNT;
+                is_new_like := v_rows > 0;
+                is_new_match := FALSE;
+                
+                INSERT INTO swipes (user_id, target_id, action)
+                VALUES (liker_id, p_to_user_id, 'like')
+                ON CONFLICT (user_id, target_id) DO UPDATE
+                SET action = 'like', created_at = NOW();
+                
+                IF is_new_like THEN
+                    IF EXISTS (
+                        SELECT 1 FROM likes l
+                        WHERE l.from_user_id = p_to_user_id AND l.to_user_id = liker_id
+                    ) THEN
+                        INSERT INTO matches (user1_id, user2_id)
+                        VALUES (v_low, v_high)
+                        ON CONFLICT ON CONSTRAINT matches_pair_key DO NOTHING
+                        RETURNING id INTO match_id;
+                        is_new_match := match_id IS NOT NULL;
+                        
+                        IF match_id IS NULL THEN
+                            SELECT m.id INTO match_id FROM matches m
+                            WHERE m.user1_id = v_low AND m.user2_id = v_high;
+                        END IF;
+                    END IF;
+                END IF;
+                
+                RETURN NEXT;
+            END
+            $$
+            ''',
+        ],
+    },
+    {
+        "version": 15,
+        "name": "incremental analytics counters",
+        "statements": [
+            # Totals are spread over a few shards per name so concurrent
+            # writers don't queue on one row; readers sum the shards
+            '''
+            CREATE TABLE IF NOT EXISTS stats_counters (
+                name TEXT NOT NULL,
+                shard SMALLINT NOT NULL,
+                value BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (name, shard)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                day DATE NOT NULL,
+                sub_city TEXT NOT NULL DEFAULT '',
+                signups INTEGER NOT NULL DEFAULT 0,
+                likes INTEGER NOT NULL DEFAULT 0,
+                matches INTEGER NOT NULL DEFAULT 0,
+                reports INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, sub_city)
+            )
+            ''',
+            # Days follow Addis Ababa time, like the daily like quota
+            '''
+            CREATE OR REPLACE FUNCTION stats_day(ts TIMESTAMP) RETURNS DATE
+            LANGUAGE sql STABLE AS $$
+                SELECT ((ts AT TIME ZONE current_setting('TimeZone')) AT TIME ZONE 'Africa/Addis_Ababa')::date
+            $$
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION stats_bump(p_name TEXT, p_delta BIGINT) RETURNS VOID
+            LANGUAGE sql AS $$
+                INSERT INTO stats_counters (name, shard, value)
+                VALUES (p_name, pg_backend_pid() % 8, p_delta)
+                ON CONFLICT (name, shard) DO UPDATE
+                SET value = stats_counters.value + EXCLUDED.value
+            $$
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION stats_bump_daily(p_day DATE, p_sub_city TEXT, p_metric TEXT, p_delta INTEGER)
+            RETURNS VOID LANGUAGE plpgsql AS $$
+            BEGIN
+                EXECUTE format(
+                    'INSERT INTO daily_stats (day, sub_city, %1$I) VALUES ($1, $2, $3)
+                     ON CONFLICT (day, sub_city) DO UPDATE SET %1$I = daily_stats.%1$I + EXCLUDED.%1$I',
+                    p_metric
+                ) USING p_day, COALESCE(p_sub_city, ''), p_delta;
+            END
+            $$
+            ''',
+            # Signups are bucketed by registration day and current sub-city,
+            # so setting the location during registration moves the signup
+            '''
+            CREATE OR REPLACE FUNCTION stats_users_trigger() RETURNS TRIGGER
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM stats_bump('users', 1);
+                    IF NEW.is_active THEN PERFORM stats_bump('active_users', 1); END IF;
+                    IF NEW.is_verified THEN PERFORM stats_bump('verified_users', 1); END IF;
+                    IF NEW.is_stealth THEN PERFORM stats_bump('stealth_users', 1); END IF;
+                    PERFORM stats_bump_daily(stats_day(NEW.created_at), NEW.sub_city, 'signups', 1);
+                ELSIF TG_OP = 'UPDATE' THEN
+                    IF NEW.is_active IS DISTINCT FROM OLD.is_active THEN
+                        PERFORM stats_bump('active_users', CASE WHEN NEW.is_active THEN 1 ELSE -1 END);
+                    END IF;
+                    IF NEW.is_verified IS DISTINCT FROM OLD.is_verified THEN
+                        PERFORM stats_bump('verified_users', CASE WHEN NEW.is_verified THEN 1 ELSE -1 END);
+                    END IF;
+                    IF NEW.is_stealth IS DISTINCT FROM OLD.is_stealth THEN
+                        PERFORM stats_bump('stealth_users', CASE WHEN NEW.is_stealth THEN 1 ELSE -1 END);
+                    END IF;
+                    IF NEW.sub_city IS DISTINCT FROM OLD.sub_city THEN
+                        PERFORM stats_bump_daily(stats_day(OLD.created_at), OLD.sub_city, 'signups', -1);
+                        PERFORM stats_bump_daily(stats_day(NEW.created_at), NEW.sub_city, 'signups', 1);
+                    END IF;
+                ELSE
+                    PERFORM stats_bump('users', -1);
+                    IF OLD.is_active THEN PERFORM stats_bump('active_users', -1); END IF;
+                    IF OLD.is_verified THEN PERFORM stats_bump('verified_users', -1); END IF;
+                    IF OLD.is_stealth THEN PERFORM stats_bump('stealth_users', -1); END IF;
+                END IF;
+                RETURN NULL;
+            END
+            $$
+            ''',
+            # Per-sub-city events count against the liker, the lower-id
+            # side of a match and the reported user
+            '''
+            CREATE OR REPLACE FUNCTION stats_event_trigger() RETURNS TRIGGER
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v_sub_city TEXT;
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    PERFORM stats_bump(TG_TABLE_NAME, -1);
+                    RETURN NULL;
+                END IF;
+                
+                PERFORM stats_bump(TG_TABLE_NAME, 1);
+                IF TG_TABLE_NAME = 'likes' THEN
+                    SELECT u.sub_city INTO v_sub_city FROM users u WHERE u.id = NEW.from_user_id;
+                    PERFORM stats_bump_daily(stats_day(NEW.created_at), v_sub_city, 'likes', 1);
+                ELSIF TG_TABLE_NAME = 'matches' THEN
+                    SELECT u.sub_city INTO v_sub_city FROM users u WHERE u.id = NEW.user1_id;
+                    PERFORM stats_bump_daily(stats_day(NEW.matched_at), v_sub_city, 'matches', 1);
+                ELSE
+                    SELECT u.sub_city INTO v_sub_city FROM users u WHERE u.id = NEW.reported_id;
+                    PERFORM stats_bump_daily(stats_day(NEW.created_at), v_sub_city, 'reports', 1);
+                END IF;
+                RETURN NULL;
+            END
+            $$
+            ''',
+            '''
+            CREATE TRIGGER stats_users
+            AFTER INSERT OR DELETE OR UPDATE OF is_active, is_verified, is_stealth, sub_city ON users
+            FOR EACH ROW EXECUTE FUNCTION stats_users_trigger()
+            ''',
+            '''
+            CREATE TRIGGER stats_likes AFTER INSERT OR DELETE ON likes
+            FOR EACH ROW EXECUTE FUNCTION stats_event_trigger()
+            ''',
+            '''
+            CREATE TRIGGER stats_matches AFTER INSERT OR DELETE ON matches
+            FOR EACH ROW EXECUTE FUNCTION stats_event_trigger()
+            ''',
+            '''
+            CREATE TRIGGER stats_reports AFTER INSERT OR DELETE ON reports
+            FOR EACH ROW EXECUTE FUNCTION stats_event_trigger()
+            ''',
+            # One-time backfill; the triggers above hold writes until commit,
+            # so nothing is counted twice or missed
+            '''
+            INSERT INTO stats_counters (name, shard, value)
+            SELECT v.name, 0, v.value
+            FROM (
+                SELECT
+                    COUNT(*) AS total,
+                    COUNT(*) FILTER (WHERE is_active) AS active,
+                    COUNT(*) FILTER (WHERE is_verified) AS verified,
+                    COUNT(*) FILTER (WHERE is_stealth) AS stealth
+                FROM users
+            ) u,
+            LATERAL (VALUES
+                ('users', u.total),
+                ('active_users', u.active),
+                ('verified_users', u.verified),
+                ('stealth_users', u.stealth),
+                ('likes', (SELECT COUNT(*) FROM likes)),
+                ('matches', (SELECT COUNT(*) FROM matches)),
+                ('reports', (SELECT COUNT(*) FROM reports))
+            ) AS v(name, value)
+            ON CONFLICT (name, shard) DO UPDATE SET value = EXCLUDED.value
+            ''',
+            '''
+            INSERT INTO daily_stats (day, sub_city, signups, likes, matches, reports)
+            SELECT day, sub_city, SUM(signups), SUM(likes), SUM(matches), SUM(reports)
+            FROM (
+                SELECT stats_day(created_at) AS day, COALESCE(sub_city, '') AS sub_city,
+                       1 AS signups, 0 AS likes, 0 AS matches, 0 AS reports
+                FROM users
+                UNION ALL
+                SELECT stats_day(l.created_at), COALESCE(u.sub_city, ''), 0, 1, 0, 0
+                FROM likes l JOIN users u ON u.id = l.from_user_id
+                UNION ALL
+                SELECT stats_day(m.matched_at), COALESCE(u.sub_city, ''), 0, 0, 1, 0
+                FROM matches m JOIN users u ON u.id = m.user1_id
+                UNION ALL
+                SELECT stats_day(r.created_at), COALESCE(u.sub_city, ''), 0, 0, 0, 1
+                FROM reports r JOIN users u ON u.id = r.reported_id
+            ) events
+            WHERE day IS NOT NULL
+            GROUP BY day, sub_city
+            ON CONFLICT (day, sub_city) DO NOTHING
+            ''',
+        ],
+    },
+    {
+        "version": 16,
+        "name": "report moderation",
+        "statements": [
+            # One row per reported user; status is open (visible), hidden
+            # (auto-hidden at the threshold), cleared or banned
+            '''
+            CREATE TABLE IF NOT EXISTS report_summary (
+                reported_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                reporters INTEGER NOT NULL DEFAULT 0,
+                reports INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'open',
+                last_report_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                reviewed_at TIMESTAMP
+            )
+            ''',
+            # Distinct reporters since the last review
+            '''
+            CREATE TABLE IF NOT EXISTS report_reporters (
+                reported_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                reporter_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                PRIMARY KEY (reported_id, reporter_id)
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_report_summary_queue
+            ON report_summary (last_report_at DESC, reported_id DESC)
+            WHERE status IN ('open', 'hidden')
+            ''',
+            '''
+            INSERT INTO report_reporters (reported_id, reporter_id)
+            SELECT DISTINCT reported_id, reporter_id FROM reports
+            WHERE reported_id IS NOT NULL AND reporter_id IS NOT NULL
+            ON CONFLICT DO NOTHING
+            ''',
+            '''
+            INSERT INTO report_summary (reported_id, reporters, reports, last_report_at)
+            SELECT reported_id, COUNT(DISTINCT reporter_id), COUNT(*), MAX(created_at)
+            FROM reports
+            WHERE reported_id IS NOT NULL
+            GROUP BY reported_id
+            ON CONFLICT (reported_id) DO NOTHING
+            ''',
+            # Stores the report, counts distinct reporters and hides the
+            # profile once the threshold is reached, in one round trip
+            '''
+            CREATE OR REPLACE FUNCTION record_report(
+                p_reporter_id INTEGER, p_reported_id INTEGER, p_reason TEXT, p_threshold INTEGER
+            )
+            RETURNS TABLE (
+                reporters INTEGER,
+                status TEXT,
+                newly_hidden BOOLEAN,
+                reported_telegram_id BIGINT
+            )
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v_new INTEGER;
+            BEGIN
+                INSERT INTO reports (reporter_id, reported_id, reason)
+                VALUES (p_reporter_id, p_reported_id, p_reason);
+                
+                INSERT INTO report_reporters (reported_id, reporter_id)
+                VALUES (p_reported_id, p_reporter_id)
+                ON CONFLICT DO NOTHING;
+                GET DIAGNOSTICS v_new = ROW_COUNT;
+                
+                INSERT INTO report_summary AS s (reported_id, reporters, reports)
+                VALUES (p_reported_id, v_new, 1)
+                ON CONFLICT (reported_id) DO UPDATE
+                SET reporters = s.reporters + EXCLUDED.reporters,
+                    reports = s.reports + 1,
+                    last_report_at = NOW(),
+                    status = CASE WHEN s.status = 'cleared' THEN 'open' ELSE s.status END
+                RETURNING s.reporters, s.status INTO reporters, status;
+                
+                newly_hidden := status = 'open' AND reporters >= p_threshold;
+                IF newly_hidden THEN
+                    UPDATE report_summary SET status = 'hidden' WHERE reported_id = p_reported_id;
+                    UPDATE users SET is_active = FALSE, updated_at = NOW() WHERE id = p_reported_id;
+                    status := 'hidden';
+                END IF;
+                
+                SELECT u.telegram_id INTO reported_telegram_id FROM users u WHERE u.id = p_reported_id;
+                RETURN NEXT;
+            END
+            $$
+            ''',
+        ],
+    },
+    {
+        "version": 17,
+        "name": "blocks",
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS blocks (
+                blocker_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                blocked_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (blocker_id, blocked_id)
+            )
+            ''',
+            # The primary key serves "who did I block"; this one "who blocked me"
+            "CREATE INDEX IF NOT EXISTS idx_blocks_blocked ON blocks (blocked_id, blocker_id)",
+        ],
+    },
+    {
+        "version": 18,
+        "name": "photo albums",
+        "statements": [
+            # Albums live in photo_ids; main_photo_id stays its first entry
+            '''
+            UPDATE users SET photo_ids = jsonb_build_array(main_photo_id)
+            WHERE main_photo_id IS NOT NULL
+              AND (photo_ids IS NULL OR photo_ids = '[]'::jsonb)
+            ''',
+        ],
+    },
+    {
+        "version": 19,
+        "name": "validate match pair order",
+        "statements": [
+            # Separate from migration 14 so the scan runs under VALIDATE's
+            # SHARE UPDATE EXCLUSIVE lock, not ADD CONSTRAINT's exclusive one
+            "ALTER TABLE matches VALIDATE CONSTRAINT matches_pair_order",
+        ],
+    },
+    {
+        "version": 20,
+        "name": "sharded daily stats",
+        "statements": [
+            # Every like/match/report upserted the one row of its day and
+            # sub-city inside record_like's transaction; shard it like
+            # stats_counters. Readers already SUM per day / sub-city
+            "ALTER TABLE daily_stats ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+            '''
+            ALTER TABLE daily_stats
+                DROP CONSTRAINT daily_stats_pkey,
+                ADD PRIMARY KEY (day, sub_city, shard)
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION stats_bump_daily(p_day DATE, p_sub_city TEXT, p_metric TEXT, p_delta INTEGER)
+            RETURNS VOID LANGUAGE plpgsql AS $$
+            BEGIN
+                EXECUTE format(
+                    'INSERT INTO daily_stats (day, sub_city, shard, %1$I) VALUES ($1, $2, $3, $4)
+                     ON CONFLICT (day, sub_city, shard) DO UPDATE SET %1$I = daily_stats.%1$I + EXCLUDED.%1$I',
+                    p_metric
+                ) USING p_day, COALESCE(p_sub_city, ''), pg_backend_pid() % 8, p_delta;
+            END
+            $$
+            ''',
+        ],
+    },
+    {
+        "version": 21,
+        "name": "drop chat created_at index",
+        "concurrent": True,
+        # Superseded by idx_chat_messages_match_id (migration 10); nothing
+        # reads chat history by created_at any more
+        "drop_indexes": ["idx_chat_messages_match"],
+    },
+    {
+        "version": 22,
+        "name": "reject self-reports",
+        "statements": [
+            # A self-report counted as a distinct reporter towards
+            # REPORT_HIDE_THRESHOLD; take existing ones out of the count
+            '''
+            WITH removed AS (
+                DELETE FROM report_reporters
+                WHERE reporter_id = reported_id
+                RETURNING reported_id
+            )
+            UPDATE report_summary s SET reporters = s.reporters - 1
+            FROM removed r
+            WHERE s.reported_id = r.reported_id
+            ''',
+            '''
+            CREATE OR REPLACE FUNCTION record_report(
+                p_reporter_id INTEGER, p_reported_id INTEGER, p_reason TEXT, p_threshold INTEGER
+            )
+            RETURNS TABLE (
+                reporters INTEGER,
+                status TEXT,
+                newly_hidden BOOLEAN,
+                reported_telegram_id BIGINT
+            )
+            LANGUAGE plpgsql AS $$
+            DECLARE
+                v_new INTEGER;
+            BEGIN
+                IF p_reporter_id = p_reported_id THEN
+                    RAISE EXCEPTION 'users cannot report themselves'
+                        USING ERRCODE = 'check_violation';
+                END IF;
+                
+                INSERT INTO reports (reporter_id, reported_id, reason)
+                VALUES (p_reporter_id, p_reported_id, p_reason);
+                
+                INSERT INTO report_reporters (reported_id, reporter_id)
+                VALUES (p_reported_id, p_reporter_id)
+                ON CONFLICT DO NOTHING;
+                GET DIAGNOSTICS v_new = ROW_COUNT;
+                
+                INSERT INTO report_summary AS s (reported_id, reporters, reports)
+                VALUES (p_reported_id, v_new, 1)
+                ON CONFLICT (reported_id) DO UPDATE
+                SET reporters = s.reporters + EXCLUDED.reporters,
+                    reports = s.reports + 1,
+                    last_report_at = NOW(),
+                    status = CASE WHEN s.status = 'cleared' THEN 'open' ELSE s.status END
+                RETURNING s.reporters, s.status INTO reporters, status;
+                
+                newly_hidden := status = 'open' AND reporters >= p_threshold;
+                IF newly_hidden THEN
+                    UPDATE report_summary SET status = 'hidden' WHERE reported_id = p_reported_id;
+                    UPDATE users SET is_active = FALSE, updated_at = NOW() WHERE id = p_reported_id;
+                    status := 'hidden';
+                END IF;
+                
+                SELECT u.telegram_id INTO reported_telegram_id FROM users u WHERE u.id = p_reported_id;
+                RETURN NEXT;
+            END
+            $$
+            ''',
+        ],
+    },
+]
+
+async def _build_index_concurrently(conn, name: str, definition: str, unique: bool = False):
+    """CREATE INDEX CONCURRENTLY, replacing a leftover invalid build"""
+    invalid = await conn.fetchval(
+        "SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)",
+        name
+    )
+    if invalid:
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=MIGRATION_TIMEOUT)
+    await conn.execute(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} {definition}",
+        timeout=MIGRATION_TIMEOUT
+    )
+
+async def _apply_migration(conn, migration: dict):
+    """Run one migration and record its version"""
+    record = "INSERT INTO schema_version (version, name) VALUES ($1, $2)"
     
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS interests (
-            id SERIAL PRIMARY KEY,
-            name_en VARCHAR(100) NOT NULL,
-            name_am VARCHAR(100) NOT NULL
-        )
-    ''')
+    if migration.get("concurrent"):
+        # Entries are (name, definition) or (name, definition, unique)
+        for index in migration.get("indexes", []):
+            await _build_index_concurrently(conn, *index)
+        for name in migration.get("drop_indexes", []):
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}", timeout=MIGRATION_TIMEOUT)
+        await conn.execute(record, migration["version"], migration["name"])
+    elif migration.get("batched"):
+        # Statements are written to converge, so a rerun after a crash
+        # picks up where the last committed batch left off
+        for statement in migration["statements"]:
+            while True:
+                status = await conn.execute(statement, MIGRATION_BATCH_SIZE, timeout=MIGRATION_TIMEOUT)
+                if status.split()[-1] == "0":
+                    break
+        await conn.execute(record, migration["version"], migration["name"])
+    else:
+        async with conn.transaction():
+            for statement in migration["statements"]:
+                await conn.execute(statement, timeout=MIGRATION_TIMEOUT)
+            await conn.execute(record, migration["version"], migration["name"])
     
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS user_interests (
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            interest_id INTEGER REFERENCES interests(id) ON DELETE CASCADE,
-            PRIMARY KEY (user_id, interest_id)
-        )
-    ''')
-    
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS likes (
-            id SERIAL PRIMARY KEY,
-            from_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            to_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            created_at TIMESTAMP DEFAULT NOW(),
-            UNIQUE(from_user_id, to_user_id)
-        )
-    ''')
-    
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS matches (
-            id SERIAL PRIMARY KEY,
-            user1_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            user2_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            matched_at TIMESTAMP DEFAULT NOW(),
-            chat_active BOOLEAN DEFAULT TRUE
-        )
-    ''')
-    
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS chat_messages (
-            id SERIAL PRIMARY KEY,
-            match_id INTEGER REFERENCES matches(id) ON DELETE CASCADE,
-            sender_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            message TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW()
-        )
-    ''')
-    
-    await conn.execute('''
-        CREATE TABLE IF NOT EXISTS reports (
-            id SERIAL PRIMARY KEY,
-            reporter_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            reported_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            reason TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT NOW()
-        )
-    ''')
+    logger.info("Applied migration %s: %s", migration["version"], migration["name"])
+
+async def run_migrations():
+    """Apply pending migrations under an advisory lock"""
+    wanted = {migration["version"] for migration in MIGRATIONS}
+    async with get_db_connection() as conn:
+        # Fast path for an up-to-date schema: no DDL, no lock wait
+        if await conn.fetchval("SELECT to_regclass('schema_version') IS NOT NULL"):
+            applied = {
+                row["version"]
+                for row in await conn.fetch("SELECT version FROM schema_version")
+            }
+            if wanted <= applied:
+                return
+        
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+        ''')
+        
+        # Other processes wait here instead of racing the same DDL; the wait
+        # can span another process's CREATE INDEX CONCURRENTLY, so it gets
+        # the migration timeout rather than the pool's command timeout
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID, timeout=MIGRATION_TIMEOUT)
+        try:
+            applied = {
+                row["version"]
+                for row in await conn.fetch("SELECT version FROM schema_version")
+            }
+            for migration in MIGRATIONS:
+                if migration["version"] not in applied:
+                    await _apply_migration(conn, migration)
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+# ============= DATABASE SETUP =============
+async def init_db():
+    """Migrate the schema and seed reference data"""
+    if MIGRATE_ON_STARTUP:
+        await run_migrations()
     
-    # Insert cultural interests if not exists
-    for interest in CULTURAL_INTERESTS:
+    async with get_db_connection() as conn:
+        # Sync the interests table with the catalog in one statement
         await conn.execute('''
             INSERT INTO interests (id, name_en, name_am)
-            VALUES ($1, $2, $3)
-            ON CONFLICT (id) DO NOTHING
-        ''', interest["id"], interest["en"], interest["am"])
-    
-    await conn.close()
+            SELECT * FROM unnest($1::int[], $2::text[], $3::text[])
+            ON CONFLICT (id) DO UPDATE
+            SET name_en = EXCLUDED.name_en, name_am = EXCLUDED.name_am
+            WHERE (interests.name_en, interests.name_am)
+                  IS DISTINCT FROM (EXCLUDED.name_en, EXCLUDED.name_am)
+        ''',
+            [item.id for item in INTEREST_CATALOG.values()],
+            [item.en for item in INTEREST_CATALOG.values()],
+            [item.am for item in INTEREST_CATALOG.values()]
+        )
 
 # ============= UTILITIES =============
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -180,155 +1271,593 @@ def get_subcity_coordinates(subcity: str) -> Tuple[float, float]:
     """Get coordinates for Addis sub-city"""
     return SUB_CITIES.get(subcity, (9.0227, 38.7469))  # Default to Kazanchis
 
+def geo_cell_for(lat: float, lon: float) -> int:
+    """Grid cell id, same formula as the users.geo_cell column"""
+    return (math.floor(lat / GEO_CELL_DEG) + 1800) * 10000 + (math.floor(lon / GEO_CELL_DEG) + 3600)
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """Lat/lon box (min_lat, max_lat, min_lon, max_lon) enclosing a radius"""
+    dlat = radius_km / 111.32
+    dlon = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+def geo_cells_for_radius(lat: float, lon: float, radius_km: float) -> List[int]:
+    """All grid cells overlapping the bounding box of a radius"""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    lat_cells = range(math.floor(min_lat / GEO_CELL_DEG), math.floor(max_lat / GEO_CELL_DEG) + 1)
+    lon_cells = range(math.floor(min_lon / GEO_CELL_DEG), math.floor(max_lon / GEO_CELL_DEG) + 1)
+    return [(la + 1800) * 10000 + (lo + 3600) for la in lat_cells for lo in lon_cells]
+
+# ============= LOCALIZATION =============
+# One catalog per interface language; keys missing from a language fall back
+# to DEFAULT_LANGUAGE, so a new language can be shipped partially translated.
+_TEXTS: Dict[str, Dict[str, str]] = {
+    "en": {
+        "ask_name": (
+            "👤 <b>What's your name?</b>\n\n"
+            "Enter your full name:"
+        ),
+        "ask_age": (
+            "🔞 <b>How old are you?</b>\n\n"
+            "Enter your age (18+):"
+        ),
+        "invalid_age": "Please enter a valid age (18 and above)",
+        "ask_gender": "⚥ <b>What's your gender?</b>",
+        "ask_preference": "❤️ <b>Who are you interested in?</b>",
+        "ask_location": (
+            "📍 <b>Share your location</b>\n\n"
+            "For better matching, share your location.\n"
+            "Or choose your sub-city."
+        ),
+        "ask_subcity": "🏙 <b>Choose your sub-city.</b>",
+        "ask_interests": (
+            "🎯 <b>Choose your interests</b>\n\n"
+            "Select what interests you from below.\n"
+            "You can select multiple. Press 'Done' when finished."
+        ),
+        "ask_photo": (
+            "📸 <b>Send your photo</b>\n\n"
+            "Send a clear photo of yourself.\n"
+            "You can add up to {max_photos} photos."
+        ),
+        "photo_saved": "✅ Photo saved ({count}/{max_photos}). Send more or tap Done.",
+        "ask_bio": (
+            "📝 <b>Introduce yourself</b>\n\n"
+            "Write a short bio (under 500 characters).\n"
+            "What are you looking for? What makes you happy?\n\n"
+            "Example: 'Tech enthusiast, coffee lover, enjoy music and travel'"
+        ),
+        "bio_too_long": "Bio is too long. Maximum 500 characters.",
+        "registration_complete": (
+            "🎉 <b>Registration Complete!</b>\n\n"
+            "You can now browse people in your area.\n\n"
+            "Useful commands:\n"
+            "• /start - Main menu\n"
+            "• /help - Get help\n"
+            "• /safety - Safety tips\n"
+            "• /report - Report a user"
+        ),
+        "main_menu": (
+            "🏠 <b>Main Menu - Habesha Match</b>\n\n"
+            "Discover new people, match, and connect.\n\n"
+            "Choose an option below:"
+        ),
+        "daily_limit": "Daily limit reached. Try tomorrow.",
+        "register_first": "Please register first with /start",
+        "user_not_found": "User not found",
+        "report_self": "You can't report yourself",
+        "no_candidates": "No people in your area. Wait and try again.",
+        "match_found": (
+            "🎉 <b>It's a Match!</b>\n\n"
+            "You can now send messages."
+        ),
+        "match_notify": (
+            "🎉 <b>New Match!</b>\n\n"
+            "You can now send messages."
+        ),
+        "like_sent": "👍 Like sent",
+        "no_matches": (
+            "🤷‍♂️ <b>No matches yet</b>\n\n"
+            "Browse people and send likes."
+        ),
+        "matches_header": "💌 <b>Your Matches</b>\n\n",
+        "chat_unavailable": "This chat is no longer available",
+        "chat_opened": (
+            "💬 <b>Chatting with {name}</b>\n\n"
+            "Everything you send now is delivered to them. Send /end to stop."
+        ),
+        "chat_closed": "✅ Chat closed.",
+        "chat_history_empty": "No messages yet",
+        "chat_unsupported": "⚠️ This kind of message can't be sent in chat.",
+        "you": "You",
+        "blocked_toast": "🚫 Blocked",
+        "blocked_header": "🚫 <b>Blocked Users</b>\n\n",
+        "blocked_hint": "Tap to unblock.",
+        "blocked_empty": "You haven't blocked anyone.",
+        "settings": (
+            "⚙️ <b>Settings</b>\n\n"
+            "• Language: {language}\n"
+            "• Location: {location}\n"
+            "• Stealth Mode: {stealth}\n"
+            "• Notifications: {notifications}\n\n"
+            "Select below to change:"
+        ),
+        "language_name_en": "English",
+        "language_name_am": "Amharic",
+        "not_set": "Not set",
+        "stealth_on": "On",
+        "stealth_off": "Off",
+        "notify_on": "On",
+        "notify_off": "Off",
+        "language_changed": "✅ Language changed to English",
+        "stealth_toggled": "✅ Stealth Mode: {status}",
+        "update_location": (
+            "📍 <b>Update Location</b>\n\n"
+            "Share your current location or choose sub-city."
+        ),
+        "location_updated": "✅ Location updated",
+        "help": (
+            "🆘 <b>Help & Safety</b>\n\n"
+            "<b>Main Commands:</b>\n"
+            "/start - Main menu\n"
+            "/help - This message\n"
+            "/safety - Safety tips\n"
+            "/report - Report a user\n\n"
+            "<b>Safety Tips:</b>\n"
+            "1. Meet first time in public places\n"
+            "2. Don't share personal information quickly\n"
+            "3. Don't give phone number before meeting\n"
+            "4. Stop if uncomfortable\n"
+            "5. Report suspicious behavior immediately\n\n"
+            "<b>To Report:</b>\n"
+            "Click 'Report' button on any profile to report a user."
+        ),
+        "safety": (
+            "🛡️ <b>Safety Tips for Dating in Addis</b>\n\n"
+            "<b>When meeting new people in Addis Ababa:</b>\n\n"
+            "✅ <b>Do:</b>\n"
+            "• Meet first time in coffee shops or malls\n"
+            "• Ask to bring a friend along\n"
+            "• Set specific time limits\n"
+            "• Meet during daytime in well-lit areas\n\n"
+            "❌ <b>Don't:</b>\n"
+            "• Give out home address\n"
+            "• Carry large amounts of money on first date\n"
+            "• Go to remote locations\n"
+            "• Engage if drugs or weapons are involved\n\n"
+            "🔔 <b>Remember:</b>\n"
+            "Report any suspicious behavior immediately."
+        ),
+        "report_prompt": (
+            "⚠️ <b>Report User</b>\n\n"
+            "Why are you reporting this user?\n\n"
+            "Options:\n"
+            "1. Offensive or abusive language\n"
+            "2. False information\n"
+            "3. Suspicious behavior\n"
+            "4. Harassment\n"
+            "5. Other\n\n"
+            "Write the reason:"
+        ),
+        "report_submitted": "✅ Report submitted. Thank you.",
+        "nearby_alert": (
+            "👋 <b>Someone new joined near you!</b>\n\n"
+            "Browse people to see who."
+        ),
+        "btn_male": "Male 👨",
+        "btn_female": "Female 👩",
+        "btn_other": "Other 🏳️‍🌈",
+        "btn_pref_male": "Men 🧑‍🤝‍🧑",
+        "btn_pref_female": "Women 👭",
+        "btn_pref_both": "Both 🤝",
+        "btn_share_location": "📍 Share Current Location",
+        "btn_choose_subcity": "🏙 Choose Sub-City",
+        "btn_interests_done": "✅ Done",
+        "btn_photos_done": "✅ Done",
+        "btn_browse": "👀 Browse People",
+        "btn_matches": "💌 My Matches",
+        "btn_settings": "⚙️ Settings",
+        "btn_help": "🆘 Help",
+        "btn_like": "👍 Like",
+        "btn_dislike": "👎 Dislike",
+        "btn_skip": "⏭ Skip",
+        "btn_report": "⚠️ Report",
+        "btn_block": "🚫 Block",
+        "btn_change_language": "🌍 Change Language",
+        "btn_update_location": "📍 Update Location",
+        "btn_toggle_stealth": "👁️ Toggle Stealth Mode",
+        "btn_notifications": "🔔 Notifications",
+        "btn_blocked": "🚫 Blocked Users",
+        "btn_back_main": "↩️ Back to Main",
+        "btn_back_settings": "↩️ Back to Settings",
+        "btn_help_back": "↩️ Back to Main",
+        "btn_chat_history": "📜 History",
+        "btn_older": "⬆️ Older",
+        "btn_end_chat": "❌ End Chat",
+        "btn_reply": "💬 Reply",
+    },
+    "am": {
+        "ask_name": (
+            "👤 <b>ስምህ ምን ይባላል?</b>\n\n"
+            "ሙሉ ስምህን አስገባ:"
+        ),
+        "ask_age": (
+            "🔞 <b>ዕድሜህ ስንት ነው?</b>\n\n"
+            "ዕድሜህን በቁጥር አስገባ (18+):"
+        ),
+        "invalid_age": "እባክህ ትክክለኛ ዕድሜ አስገባ (18 እና ከዚያ በላይ)",
+        "ask_gender": "⚥ <b>ጾታህ ምንድነው?</b>",
+        "ask_preference": "❤️ <b>በማን ላይ ፍላጎት አለህ?</b>",
+        "ask_location": (
+            "📍 <b>አካባቢህን አሳውቀኝ</b>\n\n"
+            "ለተሻለ ተመሳሳይነት አካባቢህን ሼር አርግ።\n"
+            "ወይም ንኡስ ከተማህን ምረጥ።"
+        ),
+        "ask_subcity": "🏙 <b>ንኡስ ከተማህን ምረጥ።</b>",
+        "ask_interests": (
+            "🎯 <b>ፍላጎቶችህን ምረጥ</b>\n\n"
+            "በታች ካሉት ውስጥ የሚያስደስትህን ምረጥ።\n"
+            "ብዙ ማረግ ትችላለህ። ሲጨርስ 'ተጠናቅቋል' የሚለውን ይጫኑ።"
+        ),
+        "ask_photo": (
+            "📸 <b>ፎቶህን ላክ</b>\n\n"
+            "ለመልክህ ጥሩ ፎቶ ላክ።\n"
+            "እስከ {max_photos} ፎቶዎች መላክ ትችላለህ።"
+        ),
+        "photo_saved": "✅ ፎቶ ተቀምጧል ({count}/{max_photos})። ተጨማሪ ላክ ወይም ጨርሻለሁ ን ተጫን።",
+        "ask_bio": (
+            "📝 <b>ራስህን አስተዋውቅ</b>\n\n"
+            "አጭር መግለጫ ፅፍ (ከ 500 ፊደላት በታች)።\n"
+            "ምን ይፈልጋሉ? ምን ያስደስትዎታል?\n\n"
+            "ለምሳሌ: 'የቴክ ተንኮለኛ፣ ቡና አፍቃሪ፣ ሙዚቃ እና ጉዞ ወዳድ'"
+        ),
+        "bio_too_long": "መግለጫው በጣም ረጅም ነው። 500 ፊደላት ብቻ።",
+        "registration_complete": (
+            "🎉 <b>ምዝገባው ተጠናቅቋል!</b>\n\n"
+            "አሁን በአካባቢህ ያሉ ሰዎችን ማየት ትችላለህ።\n\n"
+            "ጠቃሚ ማስታወሻዎች፦\n"
+            "• /start - ዋና ገጽ\n"
+            "• /help - እገዛ\n"
+            "• /safety - ደህንነት ምክሮች\n"
+            "• /report - ሰውን ሪፖርት ማድረግ"
+        ),
+        "main_menu": (
+            "🏠 <b>ዋና ገጽ - ሀበሻ ማች</b>\n\n"
+            "አዲስ ሰዎችን ያግኙ፣ ያግኙ እና ይተዋወቁ።\n\n"
+            "ከታች ያለውን ይምረጡ፦"
+        ),
+        "daily_limit": "የዛሬው ገደብ አልቋል። ነገ ይሞክሩ።",
+        "register_first": "እባክዎ መጀመሪያ በ /start ይመዝገቡ",
+        "user_not_found": "ተጠቃሚው አልተገኘም",
+        "report_self": "ራስዎን ሪፖርት ማድረግ አይችሉም",
+        "no_candidates": "በአካባቢህ ምንም ሰዎች የሉም። ቆየት እና እንደገና ሞክር።",
+        "match_found": (
+            "🎉 <b>ተመሳሳይነት ተገኘ!</b>\n\n"
+            "አሁን መልዕክት መላክ ትችላላችሁ።"
+        ),
+        "match_notify": (
+            "🎉 <b>አዲስ ተመሳሳይነት!</b>\n\n"
+            "አሁን መልዕክት መላክ ትችላላችሁ።"
+        ),
+        "like_sent": "👍 አስተያየት ተልኳል",
+        "no_matches": (
+            "🤷‍♂️ <b>እስካሁን ምንም ተመሳሳይነት የለም</b>\n\n"
+            "ሰዎችን ይመልከቱ እና አስተያየት ይስጡ።"
+        ),
+        "matches_header": "💌 <b>ተመሳሳይነቶችህ</b>\n\n",
+        "chat_unavailable": "ይህ ውይይት አሁን አይገኝም",
+        "chat_opened": (
+            "💬 <b>ከ{name} ጋር ውይይት</b>\n\n"
+            "አሁን የምትልኩት መልዕክት ሁሉ ይደርሳቸዋል። ለማቆም /end ይላኩ።"
+        ),
+        "chat_closed": "✅ ውይይቱ ተዘግቷል።",
+        "chat_history_empty": "ምንም መልዕክት የለም",
+        "chat_unsupported": "⚠️ ይህ አይነት መልዕክት በውይይት ሊላክ አይችልም።",
+        "you": "እርስዎ",
+        "blocked_toast": "🚫 ታግዷል",
+        "blocked_header": "🚫 <b>የታገዱ ሰዎች</b>\n\n",
+        "blocked_hint": "ለማንሳት ይጫኑ።",
+        "blocked_empty": "ማንንም አላገዱም።",
+        "settings": (
+            "⚙️ <b>ማስተካከያዎች</b>\n\n"
+            "• ቋንቋ: {language}\n"
+            "• አካባቢ: {location}\n"
+            "• ስልክ ሁነት: {stealth}\n"
+            "• ማሳወቂያዎች: {notifications}\n\n"
+            "ከታች ለመቀየር ይምረጡ፦"
+        ),
+        "language_name_en": "English",
+        "language_name_am": "አማርኛ",
+        "stealth_on": "ደብቅ",
+        "stealth_off": "ተገልጦ",
+        "notify_on": "አንብ",
+        "notify_off": "ጠፋ",
+        "language_changed": "✅ ቋንቋ ወደ አማርኛ ተቀይሯል",
+        "stealth_toggled": "✅ ስልክ ሁነት: {status}",
+        "update_location": (
+            "📍 <b>አዲስ አካባቢ አስገባ</b>\n\n"
+            "አሁን አካባቢህን ላክ ወይም ንኡስ ከተማ ምረጥ።"
+        ),
+        "location_updated": "✅ አካባቢ ተዘምኗል",
+        "help": (
+            "🆘 <b>እገዛ እና ደህንነት</b>\n\n"
+            "<b>ዋና ትዕዛዞች፦</b>\n"
+            "/start - ዋና ገጽ\n"
+            "/help - ይህን መልዕክት\n"
+            "/safety - ደህንነት ምክሮች\n"
+            "/report - ሰውን ሪፖርት ማድረግ\n\n"
+            "<b>ደህንነት ምክሮች፦</b>\n"
+            "1. ለመጀመሪያ ጊዜ በህዝባዊ ቦታ ተገናኝ\n"
+            "2. የራስህን መረጃ አላማጭ\n"
+            "3. አስቀድመህ ስልክ ቁጥር አትስጥ\n"
+            "4. አለመስማማት ከተገኘ ወዲያ አቁም\n"
+            "5. ጠያቂ ከሆነ ወዲያ ሪፖርት አርግ\n\n"
+            "<b>ለሪፖርት፦</b>\n"
+            "አንድን ሰው ለሪፖርት ማድረግ ከፈለጉ በመገለጫው ላይ 'ሪፖርት' የሚለውን ይጫኑ።"
+        ),
+        "safety": (
+            "🛡️ <b>ደህንነት ምክሮች</b>\n\n"
+            "<b>በአዲስ አበባ ሰዎችን ሲገናኙ፦</b>\n\n"
+            "✅ <b>የሚያደርጉት፦</b>\n"
+            "• ለመጀመሪያ ጊዜ በቡና ቤት ወይም ማል ውስጥ ተገናኝ\n"
+            "• አጋር ወዳጅ ይዘው መምጣትን ይጠይቁ\n"
+            "• የተወሰነ የጊዜ ገደብ ያዘጋጁ\n"
+            "• በቀን እና በብሩህ ቦታ ተገናኝ\n\n"
+            "❌ <b>የማትደርጉት፦</b>\n"
+            "• የቤት አድራሻ አትስጡ\n"
+            "• በመጀመሪያ ቀን ብዙ ገንዘብ አትውሰዱ\n"
+            "• ወደ ሰላሳ ቦታዎች አትሂዱ\n"
+            "• ጠመንጃ ወይም መድሃኒት ተሳትፎ ካለ ወዲያ ይቅረቡ\n\n"
+            "🔔 <b>ማስታወሻ፦</b>\n"
+            "ማንኛውም ጠያቂ ባህሪ ወዲያውኑ ሪፖርት ያድርጉ።"
+        ),
+        "report_prompt": (
+            "⚠️ <b>ሪፖርት ማድረግ</b>\n\n"
+            "ለምን ይህን ሰው ሪፖርት ማድረግ ትፈልጋለህ?\n\n"
+            "ምርጫዎች፦\n"
+            "1. ጠቃሚ ወይም አስጸያፊ ቋንቋ\n"
+            "2. ሐሰተኛ መረጃ\n"
+            "3. ጠያቂ ባህሪ\n"
+            "4. አለመስማማት\n"
+            "5. ሌላ\n\n"
+            "ምክንያቱን ፅፍ፦"
+        ),
+        "report_submitted": "✅ ሪፖርት ቀርቧል። እናመሰግናለን።",
+        "nearby_alert": (
+            "👋 <b>በአቅራቢያህ አዲስ ሰው ተቀላቅሏል!</b>\n\n"
+            "ለማየት ሰዎችን ይመልከቱ።"
+        ),
+        "btn_male": "ወንድ 👨",
+        "btn_female": "ሴት 👩",
+        "btn_other": "ሌላ 🏳️‍🌈",
+        "btn_pref_male": "ወንዶች 🧑‍🤝‍🧑",
+        "btn_pref_female": "ሴቶች 👭",
+        "btn_pref_both": "ሁለቱም 🤝",
+        "btn_share_location": "📍 አሁን አካባቢ ላክ",
+        "btn_choose_subcity": "🏙 ንኡስ ከተማ ምረጥ",
+        "btn_interests_done": "✅ Done / ተጠናቅቋል",
+        "btn_photos_done": "✅ ጨርሻለሁ",
+        "btn_browse": "👀 ሰዎችን ይመልከቱ",
+        "btn_matches": "💌 ተመሳሳይ ሰዎች",
+        "btn_settings": "⚙️ ማስተካከያዎች",
+        "btn_help": "🆘 እገዛ",
+        "btn_like": "👍 አስተያየት",
+        "btn_dislike": "👎 አልወደውም",
+        "btn_skip": "⏭ ዝለል",
+        "btn_report": "⚠️ ሪፖርት",
+        "btn_block": "🚫 አግድ",
+        "btn_change_language": "🌍 ቋንቋ ቀይር",
+        "btn_update_location": "📍 አካባቢ አዘምን",
+        "btn_toggle_stealth": "👁️ ስልኬን ቀይር",
+        "btn_notifications": "🔔 ማሳወቂያዎች",
+        "btn_blocked": "🚫 የታገዱ",
+        "btn_back_main": "↩️ ወደ ዋና ገጽ",
+        "btn_back_settings": "↩️ ወደ ማስተካከያዎች",
+        "btn_help_back": "↩️ ወደ ዋና",
+        "btn_chat_history": "📜 ታሪክ",
+        "btn_older": "⬆️ የቆዩ",
+        "btn_end_chat": "❌ ውይይት ዝጋ",
+        "btn_reply": "💬 መልስ ስጥ",
+    },
+}
+# Frozen at import: handlers only ever read from it
+TEXTS: Mapping[str, Mapping[str, str]] = MappingProxyType({
+    lang: MappingProxyType(texts) for lang, texts in _TEXTS.items()
+})
+
+def t(lang: str, key: str, **kwargs: Any) -> str:
+    """Catalog string for lang, formatted only when placeholders are passed"""
+    text = TEXTS.get(lang, TEXTS[DEFAULT_LANGUAGE]).get(key)
+    if text is None:
+        text = TEXTS[DEFAULT_LANGUAGE][key]
+    return text.format(**kwargs) if kwargs else text
+
 # ============= KEYBOARDS =============
+def _button(lang: str, key: str, **kwargs: Any) -> InlineKeyboardButton:
+    """Inline button labelled from the catalog"""
+    return InlineKeyboardButton(text=t(lang, key), **kwargs)
+
+def _build_static_keyboards(lang: str) -> Dict[str, InlineKeyboardMarkup]:
+    """Keyboards that only depend on the interface language"""
+    return {
+        "gender": InlineKeyboardMarkup(inline_keyboard=[
+            [_button(lang, "btn_male", callback_data="gender_male")],
+            [_button(lang, "btn_female", callback_data="gender_female")],
+            [_button(lang, "btn_other", callback_data="gender_other")]
+        ]),
+        "preference": InlineKeyboardMarkup(inline_keyboard=[
+            [_button(lang, "btn_pref_male", callback_data="pref_male")],
+            [_button(lang, "btn_pref_female", callback_data="pref_female")],
+            [_button(lang, "btn_pref_both", callback_data="pref_both")]
+        ]),
+        "location_options": InlineKeyboardMarkup(inline_keyboard=[
+            [_button(lang, "btn_share_location", request_location=True)],
+            [_button(lang, "btn_choose_subcity", callback_data="choose_subcity")]
+        ]),
+        "interests": InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=getattr(interest, lang, interest.en),
+                                  callback_data=f"interest_{interest.id}")]
+            for interest in INTEREST_CATALOG.values()
+        ] + [
+            [_button(lang, "btn_interests_done", callback_data="interests_done")]
+        ]),
+        "main_menu": InlineKeyboardMarkup(inline_keyboard=[
+            [_button(lang, "btn_browse", callback_data="browse")],
+            [_button(lang, "btn_matches", callback_data="matches")],
+            [_button(lang, "btn_settings", callback_data="settings")],
+            [_button(lang, "btn_help", callback_data="help")]
+        ]),
+        "photos_done": InlineKeyboardMarkup(inline_keyboard=[
+            [_button(lang, "btn_photos_done", callback_data="photos_done")]
+        ]),
+        "settings": InlineKeyboardMarkup(inline_keyboard=[
+            [_button(lang, "btn_change_language", callback_data="change_language")],
+            [_button(lang, "btn_update_location", callback_data="update_location")],
+            [_button(lang, "btn_toggle_stealth", callback_data="toggle_stealth")],
+            [_button(lang, "btn_notifications", callback_data="notifications")],
+            [_button(lang, "btn_blocked", callback_data="blocked")],
+            [_button(lang, "btn_back_main", callback_data="main_menu")]
+        ]),
+        "help": InlineKeyboardMarkup(inline_keyboard=[
+            [_button(lang, "btn_help_back", callback_data="main_menu")]
+        ]),
+    }
+
+# Shared keyboards are validated once at import and kept as tuples of rows.
+# Markups and buttons are mutable, so callers only ever get shallow copies
+# of the buttons (their fields are all immutable); nothing a handler does to
+# a returned keyboard reaches the next call.
+FrozenRow = Tuple[InlineKeyboardButton, ...]
+FrozenKeyboard = Tuple[FrozenRow, ...]
+
+def _freeze(markup: InlineKeyboardMarkup) -> FrozenKeyboard:
+    """Tuple rows of a keyboard built at import"""
+    return tuple(tuple(row) for row in markup.inline_keyboard)
+
+def _thaw_row(row: FrozenRow) -> List[InlineKeyboardButton]:
+    """Fresh buttons for a shared row, skipping re-validation"""
+    return [button.model_copy() for button in row]
+
+def _thaw(rows) -> InlineKeyboardMarkup:
+    """Fresh markup for shared rows"""
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=[_thaw_row(row) for row in rows])
+
+KEYBOARDS: Mapping[str, Mapping[str, FrozenKeyboard]] = MappingProxyType({
+    lang: MappingProxyType({
+        name: _freeze(markup) for name, markup in _build_static_keyboards(lang).items()
+    })
+    for lang in SUPPORTED_LANGUAGES
+})
+
+# Checked variant of each interest row, swapped in for the selected ones
+_CHECKED_INTEREST_ROWS: Mapping[str, Mapping[int, FrozenRow]] = MappingProxyType({
+    lang: MappingProxyType({
+        interest.id: (InlineKeyboardButton(text=f"✅ {getattr(interest, lang, interest.en)}",
+                                           callback_data=f"interest_{interest.id}"),)
+        for interest in INTEREST_CATALOG.values()
+    })
+    for lang in SUPPORTED_LANGUAGES
+})
+
+_subcity_names = list(SUB_CITIES)
+LANGUAGE_KEYBOARD: FrozenKeyboard = _freeze(InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="English 🇺🇸", callback_data="lang_en")],
+    [InlineKeyboardButton(text="አማርኛ 🇪🇹", callback_data="lang_am")]
+]))
+SUBCITY_KEYBOARD: FrozenKeyboard = _freeze(InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=name, callback_data=f"subcity_{name}") for name in _subcity_names[i:i + 2]]
+    for i in range(0, len(_subcity_names), 2)
+]))
+
+def _keyboard(lang: str, name: str) -> InlineKeyboardMarkup:
+    """Prebuilt keyboard for lang, falling back to the default language"""
+    return _thaw(KEYBOARDS.get(lang, KEYBOARDS[DEFAULT_LANGUAGE])[name])
+
 def get_language_keyboard() -> InlineKeyboardMarkup:
     """Language selection keyboard"""
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="English 🇺🇸", callback_data="lang_en")],
-        [InlineKeyboardButton(text="አማርኛ 🇪🇹", callback_data="lang_am")]
-    ])
+    return _thaw(LANGUAGE_KEYBOARD)
 
 def get_gender_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
     """Gender selection keyboard"""
-    if lang == "am":
-        buttons = [
-            [InlineKeyboardButton(text="ወንድ 👨", callback_data="gender_male")],
-            [InlineKeyboardButton(text="ሴት 👩", callback_data="gender_female")],
-            [InlineKeyboardButton(text="ሌላ 🏳️‍🌈", callback_data="gender_other")]
-        ]
-    else:
-        buttons = [
-            [InlineKeyboardButton(text="Male 👨", callback_data="gender_male")],
-            [InlineKeyboardButton(text="Female 👩", callback_data="gender_female")],
-            [InlineKeyboardButton(text="Other 🏳️‍🌈", callback_data="gender_other")]
-        ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return _keyboard(lang, "gender")
 
 def get_preference_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
     """Preference selection keyboard"""
-    if lang == "am":
-        buttons = [
-            [InlineKeyboardButton(text="ወንዶች 🧑‍🤝‍🧑", callback_data="pref_male")],
-            [InlineKeyboardButton(text="ሴቶች 👭", callback_data="pref_female")],
-            [InlineKeyboardButton(text="ሁለቱም 🤝", callback_data="pref_both")]
-        ]
-    else:
-        buttons = [
-            [InlineKeyboardButton(text="Men 🧑‍🤝‍🧑", callback_data="pref_male")],
-            [InlineKeyboardButton(text="Women 👭", callback_data="pref_female")],
-            [InlineKeyboardButton(text="Both 🤝", callback_data="pref_both")]
-        ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return _keyboard(lang, "preference")
 
 def get_location_options_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
     """Location sharing options keyboard"""
-    if lang == "am":
-        buttons = [
-            [InlineKeyboardButton(text="📍 አሁን አካባቢ ላክ", request_location=True)],
-            [InlineKeyboardButton(text="🏙 ንኡስ ከተማ ምረጥ", callback_data="choose_subcity")]
-        ]
-    else:
-        buttons = [
-            [InlineKeyboardButton(text="📍 Share Current Location", request_location=True)],
-            [InlineKeyboardButton(text="🏙 Choose Sub-City", callback_data="choose_subcity")]
-        ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return _keyboard(lang, "location_options")
 
 def get_subcity_keyboard() -> InlineKeyboardMarkup:
     """Addis Ababa sub-cities keyboard"""
-    buttons = []
-    subcities = list(SUB_CITIES.keys())
-    for i in range(0, len(subcities), 2):
-        row = []
-        if i < len(subcities):
-            row.append(InlineKeyboardButton(text=subcities[i], callback_data=f"subcity_{subcities[i]}"))
-        if i + 1 < len(subcities):
-            row.append(InlineKeyboardButton(text=subcities[i+1], callback_data=f"subcity_{subcities[i+1]}"))
-        buttons.append(row)
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return _thaw(SUBCITY_KEYBOARD)
 
 def get_interests_keyboard(lang: str = "en", selected: List[int] = None) -> InlineKeyboardMarkup:
     """Interests selection keyboard"""
-    if selected is None:
-        selected = []
+    if lang not in KEYBOARDS:
+        lang = DEFAULT_LANGUAGE
+    rows = KEYBOARDS[lang]["interests"]
+    if not selected:
+        return _thaw(rows)
     
-    buttons = []
-    for interest in CULTURAL_INTERESTS:
-        name = interest["am"] if lang == "am" else interest["en"]
-        check = "✅ " if interest["id"] in selected else ""
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"{check}{name}",
-                callback_data=f"interest_{interest['id']}"
-            )
-        ])
-    
-    buttons.append([
-        InlineKeyboardButton(
-            text="✅ Done / ተጠናቅቋል" if lang == "am" else "✅ Done",
-            callback_data="interests_done"
-        )
-    ])
-    
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    checked = _CHECKED_INTEREST_ROWS[lang]
+    selected = set(selected)
+    return _thaw([
+        checked[interest_id] if interest_id in selected else row
+        for interest_id, row in zip(INTEREST_CATALOG, rows)
+    ] + [rows[-1]])
 
 def get_main_menu_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
     """Main menu keyboard"""
-    if lang == "am":
-        buttons = [
-            [InlineKeyboardButton(text="👀 ሰዎችን ይመልከቱ", callback_data="browse")],
-            [InlineKeyboardButton(text="💌 ተመሳሳይ ሰዎች", callback_data="matches")],
-            [InlineKeyboardButton(text="⚙️ ማስተካከያዎች", callback_data="settings")],
-            [InlineKeyboardButton(text="🆘 እገዛ", callback_data="help")]
-        ]
-    else:
-        buttons = [
-            [InlineKeyboardButton(text="👀 Browse People", callback_data="browse")],
-            [InlineKeyboardButton(text="💌 My Matches", callback_data="matches")],
-            [InlineKeyboardButton(text="⚙️ Settings", callback_data="settings")],
-            [InlineKeyboardButton(text="🆘 Help", callback_data="help")]
-        ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return _keyboard(lang, "main_menu")
 
-def get_profile_action_keyboard(profile_id: int, lang: str = "en") -> InlineKeyboardMarkup:
-    """Like/Dislike/Report buttons for profiles"""
-    if lang == "am":
-        buttons = [
-            [
-                InlineKeyboardButton(text="👍 አስተያየት", callback_data=f"like_{profile_id}"),
-                InlineKeyboardButton(text="👎 አልወደውም", callback_data=f"dislike_{profile_id}")
-            ],
-            [InlineKeyboardButton(text="⚠️ ሪፖርት", callback_data=f"report_{profile_id}")]
-        ]
-    else:
-        buttons = [
-            [
-                InlineKeyboardButton(text="👍 Like", callback_data=f"like_{profile_id}"),
-                InlineKeyboardButton(text="👎 Dislike", callback_data=f"dislike_{profile_id}")
-            ],
-            [InlineKeyboardButton(text="⚠️ Report", callback_data=f"report_{profile_id}")]
+def get_profile_action_keyboard(profile_id: int, lang: str = "en",
+                                photo_count: int = 1) -> InlineKeyboardMarkup:
+    """Like/Dislike/Skip/Report buttons for profiles"""
+    buttons = [
+        [
+            _button(lang, "btn_like", callback_data=f"like_{profile_id}"),
+            _button(lang, "btn_dislike", callback_data=f"dislike_{profile_id}")
+        ],
+        [
+            _button(lang, "btn_skip", callback_data=f"skip_{profile_id}"),
+            _button(lang, "btn_report", callback_data=f"report_{profile_id}"),
+            _button(lang, "btn_block", callback_data=f"block_{profile_id}")
         ]
+    ]
+    if photo_count > 1:
+        buttons.insert(0, [InlineKeyboardButton(
+            text=f"📷 +{photo_count - 1}", callback_data=f"album_{profile_id}"
+        )])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+def get_photos_done_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
+    """Finish the photo step of registration"""
+    return _keyboard(lang, "photos_done")
+
 def get_settings_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
     """Settings menu keyboard"""
-    if lang == "am":
-        buttons = [
-            [InlineKeyboardButton(text="🌍 ቋንቋ ቀይር", callback_data="change_language")],
-            [InlineKeyboardButton(text="📍 አካባቢ አዘምን", callback_data="update_location")],
-            [InlineKeyboardButton(text="👁️ ስልኬን ቀይር", callback_data="toggle_stealth")],
-            [InlineKeyboardButton(text="🔔 ማሳወቂያዎች", callback_data="notifications")],
-            [InlineKeyboardButton(text="↩️ ወደ ዋና ገጽ", callback_data="main_menu")]
-        ]
-    else:
-        buttons = [
-            [InlineKeyboardButton(text="🌍 Change Language", callback_data="change_language")],
-            [InlineKeyboardButton(text="📍 Update Location", callback_data="update_location")],
-            [InlineKeyboardButton(text="👁️ Toggle Stealth Mode", callback_data="toggle_stealth")],
-            [InlineKeyboardButton(text="🔔 Notifications", callback_data="notifications")],
-            [InlineKeyboardButton(text="↩️ Back to Main", callback_data="main_menu")]
-        ]
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return _keyboard(lang, "settings")
+
+def get_help_keyboard(lang: str = "en") -> InlineKeyboardMarkup:
+    """Back-to-main button under help"""
+    return _keyboard(lang, "help")
+
+def get_chat_keyboard(match_id: int, peer_id: int, lang: str = "en") -> InlineKeyboardMarkup:
+    """History/End/Block buttons shown while chatting"""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        _button(lang, "btn_chat_history", callback_data=f"chathist_{match_id}_0"),
+        _button(lang, "btn_end_chat", callback_data="chatend")
+    ], [
+        _button(lang, "btn_block", callback_data=f"block_{peer_id}")
+    ]])
+
+def get_chat_reply_keyboard(match_id: int, lang: str = "en") -> InlineKeyboardMarkup:
+    """Button attached to relayed messages and match notices"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [_button(lang, "btn_reply", callback_data=f"chat_{match_id}")]
+    ])
 
 # ============= FSM STATES =============
 class RegistrationStates(StatesGroup):
@@ -346,6 +1875,12 @@ class SettingsStates(StatesGroup):
     location = State()
     bio = State()
 
+class ChatStates(StatesGroup):
+    chatting = State()
+
+class ReportStates(StatesGroup):
+    reason = State()
+
 # ============= BOT INITIALIZATION =============
 bot = Bot(
     token=TOKEN,
@@ -358,175 +1893,1778 @@ dp = Dispatcher(storage=storage)
 router = Router()
 dp.include_router(router)
 
-# ============= DATABASE FUNCTIONS =============
-async def get_db_connection():
-    """Get database connection"""
-    return await asyncpg.connect(DATABASE_URL)
-
-async def get_user(telegram_id: int):
-    """Get user from database"""
-    conn = await get_db_connection()
-    user = await conn.fetchrow(
-        "SELECT * FROM users WHERE telegram_id = $1",
-        telegram_id
+logger = logging.getLogger(__name__)
+
+# ============= BACKGROUND TASKS =============
+_background_tasks = set()
+
+def _log_task_result(task: asyncio.Task):
+    """Drop a finished task and log it if it failed"""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Background task failed", exc_info=task.exception())
+
+def spawn(coro) -> asyncio.Task:
+    """Run a coroutine in the background without losing its reference"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_log_task_result)
+    return task
+
+async def stop_background_tasks():
+    """Cancel outstanding background work and wait for it to unwind"""
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# ============= METRICS =============
+METRICS: Dict[str, float] = defaultdict(float)
+
+def metric_inc(name: str, value: float = 1):
+    """Increment a process-local counter"""
+    METRICS[name] += value
+
+def metric_max(name: str, value: float):
+    """Keep the highest value seen for a gauge"""
+    if value > METRICS[name]:
+        METRICS[name] = value
+
+def get_metrics() -> Dict[str, float]:
+    """Snapshot of counters plus live pool gauges"""
+    snapshot = dict(METRICS)
+    if db_pool is not None:
+        snapshot["db_pool_size"] = db_pool.get_size()
+        snapshot["db_pool_idle"] = db_pool.get_idle_size()
+        snapshot["db_pool_max_size"] = db_pool.get_max_size()
+    return snapshot
+
+# ============= DATABASE POOL =============
+db_pool: Optional[asyncpg.Pool] = None
+
+async def _init_connection(conn):
+    """Per-connection setup: JSONB columns map to Python objects"""
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
+
+async def init_db_pool():
+    """Create the process-wide connection pool"""
+    global db_pool
+    if db_pool is not None:
+        return
+    db_pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        init=_init_connection,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        command_timeout=DB_COMMAND_TIMEOUT,
     )
-    await conn.close()
+
+async def close_db_pool():
+    """Close the pool, waiting for connections to be released"""
+    global db_pool
+    if db_pool is None:
+        return
+    pool, db_pool = db_pool, None
+    await pool.close()
+
+@asynccontextmanager
+async def get_db_connection():
+    """Borrow a connection from the shared pool"""
+    if db_pool is None:
+        raise RuntimeError("Database pool is not initialized")
+    
+    if db_pool.get_idle_size() == 0 and db_pool.get_size() >= db_pool.get_max_size():
+        metric_inc("db_pool_saturated_total")
+    
+    pool = db_pool
+    started = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        metric_inc("db_pool_acquire_timeouts_total")
+        raise
+    
+    waited = time.perf_counter() - started
+    metric_inc("db_pool_acquire_total")
+    metric_inc("db_pool_wait_seconds_total", waited)
+    metric_max("db_pool_wait_seconds_max", waited)
+    
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+# ============= USER PROFILE CACHE =============
+class LocalTTLCache:
+    """Bounded in-process LRU whose entries expire after a TTL"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+    
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def pop(self, key):
+        self._data.pop(key, None)
+
+_user_cache = LocalTTLCache(USER_CACHE_SIZE, USER_CACHE_LOCAL_TTL)
+_USER_TIMESTAMP_FIELDS = {"last_like_reset", "created_at", "updated_at", "last_seen"}
+
+def user_cache_key(telegram_id: int) -> str:
+    """Redis hash holding a cached users row"""
+    return f"user:{telegram_id}"
+
+def _encode_user(user: dict) -> Dict[str, str]:
+    """users row -> Redis hash fields (JSON per column)"""
+    return {
+        key: json.dumps(value.isoformat() if isinstance(value, datetime) else value)
+        for key, value in user.items()
+    }
+
+def _decode_user(fields: dict) -> dict:
+    """Redis hash fields -> users row dict"""
+    user = {}
+    for key, raw in fields.items():
+        key = key.decode() if isinstance(key, bytes) else key
+        value = json.loads(raw)
+        if key in _USER_TIMESTAMP_FIELDS and value is not None:
+            value = datetime.fromisoformat(value)
+        user[key] = value
+    return user
+
+async def invalidate_user_cache(telegram_id: int):
+    """Drop a cached profile from both tiers after a write"""
+    memo = _update_memo.get()
+    if memo is not None:
+        memo.pop(telegram_id, None)
+    _user_cache.pop(telegram_id)
+    key = user_cache_key(telegram_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.delete(key)
+    pipe.incr(f"{key}:gen")
+    await pipe.execute()
+
+# ============= REQUEST CONTEXT =============
+# Per-update memo of telegram_id -> user row; None outside an update
+_update_memo: ContextVar[Optional[Dict[int, Optional[dict]]]] = ContextVar("update_memo", default=None)
+
+class UserContextMiddleware(BaseMiddleware):
+    """Resolve the caller's profile once and inject it as `user`"""
+    
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = _update_memo.set({})
+        try:
+            from_user = data.get("event_from_user")
+            data["user"] = await get_user(from_user.id) if from_user else None
+            return await handler(event, data)
+        finally:
+            _update_memo.reset(token)
+
+router.message.middleware(UserContextMiddleware())
+router.callback_query.middleware(UserContextMiddleware())
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """Drop redelivered updates and repeated callback queries.
+    
+    The markers are released when handling fails or is cancelled (e.g.
+    at SHUTDOWN_TIMEOUT), so Telegram's retry of that update is processed.
+    """
+    
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        keys = [f"seen:update:{event.update_id}"]
+        if event.callback_query:
+            keys.append(f"seen:callback:{event.callback_query.id}")
+        
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(key, 1, nx=True, ex=UPDATE_DEDUP_TTL)
+            fresh = await pipe.execute()
+        if not all(fresh):
+            metric_inc("updates_duplicate_total")
+            # Undo markers this attempt just set, keep the original ones
+            claimed = [key for key, ok in zip(keys, fresh) if ok]
+            if claimed:
+                await redis.delete(*claimed)
+            return None
+        
+        done = False
+        try:
+            result = await handler(event, data)
+            done = True
+            return result
+        finally:
+            if not done:
+                await redis.delete(*keys)
+
+class UserLockMiddleware(BaseMiddleware):
+    """Handle one update per user at a time.
+    
+    Uses a Redis lock when several processes share the webhook (see
+    USER_LOCK_BACKEND), otherwise an in-process lock per user that is
+    dropped when idle.
+    """
+    
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiters: Dict[int, int] = defaultdict(int)
+    
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        if from_user is None:
+            return await handler(event, data)
+        
+        if USER_LOCK_BACKEND == "redis":
+            lock = redis.lock(
+                f"lock:user:{from_user.id}",
+                timeout=USER_LOCK_TIMEOUT,
+                blocking_timeout=USER_LOCK_WAIT
+            )
+            if not await lock.acquire():
+                # The user's previous update is still running. Fail this one
+                # so UpdateDedupMiddleware releases its marker and Telegram
+                # redelivers it, instead of losing it silently
+                metric_inc("user_lock_timeouts_total")
+                raise RuntimeError(f"User lock busy for {from_user.id}")
+            try:
+                return await handler(event, data)
+            finally:
+                try:
+                    await lock.release()
+                except LockNotOwnedError:
+                    # The handler outlived USER_LOCK_TIMEOUT; the result stands
+                    metric_inc("user_lock_expired_total")
+        
+        user_id = from_user.id
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._waiters[user_id] += 1
+        try:
+            async with lock:
+                return await handler(event, data)
+        finally:
+            self._waiters[user_id] -= 1
+            if not self._waiters[user_id]:
+                del self._waiters[user_id]
+                self._locks.pop(user_id, None)
+
+class ActionOnceMiddleware(BaseMiddleware):
+    """Run handlers flagged ``once`` a single time per button.
+    
+    A double tap sends two callback queries with different ids for the
+    same button on the same message; only the first one is handled.
+    """
+    
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not get_flag(data, "once") or not event.message:
+            return await handler(event, data)
+        
+        key = f"once:{event.from_user.id}:{event.message.message_id}:{event.data}"
+        if not await redis.set(key, 1, nx=True, ex=ACTION_ONCE_TTL):
+            metric_inc("actions_duplicate_total")
+            await event.answer()
+            return None
+        done = False
+        try:
+            result = await handler(event, data)
+            done = True
+            return result
+        finally:
+            if not done:
+                await redis.delete(key)
+
+dp.update.outer_middleware(UpdateDedupMiddleware())
+dp.update.outer_middleware(UserLockMiddleware())
+router.callback_query.middleware(ActionOnceMiddleware())
+
+# ============= DATABASE FUNCTIONS =============
+async def get_user(telegram_id: int) -> Optional[dict]:
+    """Get user, memoized per update and read through the profile caches"""
+    memo = _update_memo.get()
+    if memo is not None and telegram_id in memo:
+        metric_inc("user_memo_hits_total")
+        return memo[telegram_id]
+    
+    user = await _load_user(telegram_id)
+    if memo is not None:
+        memo[telegram_id] = user
+    return user
+
+async def _load_user(telegram_id: int) -> Optional[dict]:
+    """Local LRU, then Redis hash, then Postgres"""
+    user = _user_cache.get(telegram_id)
+    if user is not None:
+        metric_inc("user_cache_local_hits_total")
+        return user
+    
+    key = user_cache_key(telegram_id)
+    fields = await redis.hgetall(key)
+    if fields:
+        metric_inc("user_cache_redis_hits_total")
+        user = _decode_user(fields)
+        _user_cache.set(telegram_id, user)
+        return user
+    
+    metric_inc("user_cache_misses_total")
+    generation = await redis.get(f"{key}:gen")
+    async with get_db_connection() as conn:
+        row = await conn.fetchrow(
+            "SELECT * FROM users WHERE telegram_id = $1",
+            telegram_id
+        )
+    if row is None:
+        return None
+    
+    user = dict(row)
+    # Skip the Redis fill if a write invalidated the profile meanwhile
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            await pipe.watch(f"{key}:gen")
+            if await pipe.get(f"{key}:gen") == generation:
+                pipe.multi()
+                pipe.hset(key, mapping=_encode_user(user))
+                pipe.expire(key, USER_CACHE_REDIS_TTL)
+                await pipe.execute()
+                _user_cache.set(telegram_id, user)
+    except WatchError:
+        pass
     return user
 
 async def create_user(telegram_id: int, language: str, full_name: str):
     """Create new user"""
-    conn = await get_db_connection()
-    await conn.execute(
-        """INSERT INTO users (telegram_id, language, full_name, created_at, last_seen)
-           VALUES ($1, $2, $3, NOW(), NOW())""",
-        telegram_id, language, full_name
-    )
-    await conn.close()
+    async with get_db_connection() as conn:
+        await conn.execute(
+            """INSERT INTO users (telegram_id, language, full_name, created_at, last_seen)
+               VALUES ($1, $2, $3, NOW(), NOW())""",
+            telegram_id, language, full_name
+        )
+    
+    await invalidate_user_cache(telegram_id)
 
 async def update_user(telegram_id: int, **kwargs):
     """Update user fields"""
     if not kwargs:
         return
     
-    conn = await get_db_connection()
     set_clause = ", ".join([f"{key} = ${i+2}" for i, key in enumerate(kwargs.keys())])
     values = list(kwargs.values())
     
-    await conn.execute(
-        f"UPDATE users SET {set_clause}, updated_at = NOW() WHERE telegram_id = $1",
-        telegram_id, *values
-    )
-    await conn.close()
+    async with get_db_connection() as conn:
+        user_id = await conn.fetchval(
+            f"UPDATE users SET {set_clause}, updated_at = NOW() WHERE telegram_id = $1 RETURNING id",
+            telegram_id, *values
+        )
+    
+    await invalidate_user_cache(telegram_id)
+    if user_id is not None:
+        await invalidate_profile_cards(user_id)
+    if CANDIDATE_QUEUE_FIELDS.intersection(kwargs):
+        await invalidate_candidate_queue(telegram_id)
+
+async def add_user_interests(telegram_id: int, interest_ids: List[int]):
+    """Replace a user's interests with one set-based statement"""
+    wanted = sorted({i for i in interest_ids if i in INTEREST_CATALOG})
+    
+    # A single statement is atomic: rows outside the new set are deleted,
+    # new ones inserted, and unchanged rows are left alone
+    async with get_db_connection() as conn:
+        await conn.execute("""
+            WITH target AS (
+                SELECT id FROM users WHERE telegram_id = $1
+            ), removed AS (
+                DELETE FROM user_interests ui
+                USING target
+                WHERE ui.user_id = target.id
+                  AND ui.interest_id <> ALL($2::int[])
+            ), mask AS (
+                UPDATE users u SET interest_mask = $3
+                FROM target
+                WHERE u.id = target.id
+            )
+            INSERT INTO user_interests (user_id, interest_id)
+            SELECT target.id, wanted.interest_id
+            FROM target, unnest($2::int[]) AS wanted(interest_id)
+            ON CONFLICT DO NOTHING
+        """, telegram_id, wanted, interest_mask(wanted))
+    
+    await invalidate_user_cache(telegram_id)
+
+async def _fetch_nearby(user, limit: int, exclude_swiped: bool = True,
+                        after: Optional[Tuple[float, int]] = None,
+                        exclude_ids: Optional[List[int]] = None):
+    """Distance-ordered candidate page for a viewer row"""
+    lat, lon = user["latitude"], user["longitude"]
+    radius = min(user["search_radius"] or 10, MAX_SEARCH_RADIUS_KM)
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+    
+    # Composite PK on swipes turns this into one index probe per candidate
+    seen_clause = """
+          AND NOT EXISTS (
+            SELECT 1 FROM swipes s
+            WHERE s.user_id = $1 AND s.target_id = u.id
+          )""" if exclude_swiped else ""
+    
+    # Grid cells hit the partial geo_cell index, the box trims cell edges,
+    # and exact haversine distance ranks what is left
+    query = f"""
+        SELECT u.*,
+               haversine_km($2, $3, u.latitude, u.longitude) AS distance_km
+        FROM users u
+        WHERE u.geo_cell = ANY($4::bigint[])
+          AND u.latitude BETWEEN $5 AND $6
+          AND u.longitude BETWEEN $7 AND $8
+          AND u.id != $1
+          AND u.is_active AND NOT u.is_stealth
+          AND (
+            u.preference = 'both' OR
+            (u.preference = 'male' AND $9 = 'male') OR
+            (u.preference = 'female' AND $9 = 'female')
+          )
+          AND ($10 = 'both' OR 
+               ($10 = 'male' AND u.gender = 'male') OR
+               ($10 = 'female' AND u.gender = 'female'))
+          AND haversine_km($2, $3, u.latitude, u.longitude) <= $11
+          AND ($13::float8 IS NULL
+               OR (haversine_km($2, $3, u.latitude, u.longitude), u.id) > ($13, $14))
+          AND u.id <> ALL($15::int[]){seen_clause}
+        ORDER BY distance_km, u.id
+        LIMIT $12
+    """
+    
+    async with get_db_connection() as conn:
+        return await conn.fetch(
+            query,
+            user["id"],
+            lat,
+            lon,
+            geo_cells_for_radius(lat, lon, radius),
+            min_lat,
+            max_lat,
+            min_lon,
+            max_lon,
+            user["gender"],
+            user["preference"],
+            float(radius),
+            limit,
+            after[0] if after else None,
+            after[1] if after else None,
+            exclude_ids or []
+        )
+
+async def _fetch_unseen_via_bitmap(user, limit: int, exclude_ids: Optional[List[int]] = None):
+    """Page through nearby users, dropping ids set in the seen bitmap"""
+    key = seen_bitmap_key(user["id"])
+    page_size = limit * SEEN_OVERFETCH
+    results = []
+    after = None
+    
+    for _ in range(SEEN_MAX_PAGES):
+        batch = await _fetch_nearby(user, page_size, exclude_swiped=False, after=after,
+                                    exclude_ids=exclude_ids)
+        if not batch:
+            return results
+        
+        pipe = redis.pipeline(transaction=False)
+        for candidate in batch:
+            pipe.getbit(key, candidate["id"])
+        seen_flags = await pipe.execute()
+        
+        results.extend(c for c, seen in zip(batch, seen_flags) if not seen)
+        if len(results) >= limit or len(batch) < page_size:
+            return results[:limit]
+        after = (batch[-1]["distance_km"], batch[-1]["id"])
+    
+    # Nearest pages are all seen; let the anti-join skip them in one query
+    return await _fetch_nearby(user, limit, exclude_ids=exclude_ids)
+
+def rank_candidates(viewer, candidates, limit: int):
+    """Order candidates by shared interests, distance and recency.
+    
+    Interest overlap is the Jaccard index of the two interest bitmasks,
+    so each candidate costs two popcounts. The pool is bounded by
+    RANK_POOL_MAX, which keeps this pass within a fixed budget.
+    """
+    started = time.perf_counter()
+    viewer_mask = viewer.get("interest_mask") or 0
+    radius = float(min(viewer["search_radius"] or 10, MAX_SEARCH_RADIUS_KM))
+    now = datetime.now()
+    
+    scored = []
+    for candidate in candidates:
+        mask = candidate["interest_mask"] or 0
+        union = (viewer_mask | mask).bit_count()
+        overlap = (viewer_mask & mask).bit_count() / union if union else 0.0
+        proximity = 1.0 - min(candidate["distance_km"] / radius, 1.0)
+        active_at = candidate["last_seen"] or candidate["created_at"] or now
+        age_days = max((now - active_at).total_seconds(), 0) / 86400
+        recency = 0.5 ** (age_days / RANK_RECENCY_HALF_LIFE_DAYS)
+        score = (
+            RANK_WEIGHT_INTERESTS * overlap
+            + RANK_WEIGHT_DISTANCE * proximity
+            + RANK_WEIGHT_RECENCY * recency
+        )
+        scored.append((score, candidate))
+    
+    scored.sort(key=lambda item: item[0], reverse=True)
+    metric_max("rank_seconds_max", time.perf_counter() - started)
+    return [candidate for _, candidate in scored[:limit]]
+
+async def get_nearby_users(telegram_id: int, limit: int = 20,
+                           exclude_ids: Optional[List[int]] = None):
+    """Get unseen nearby users within search_radius, best match first"""
+    user = await get_user(telegram_id)
+    if not user or user["latitude"] is None or user["longitude"] is None:
+        return []
+    
+    pool_size = min(limit * RANK_POOL_FACTOR, max(RANK_POOL_MAX, limit))
+    if await redis.exists(seen_ready_key(user["id"])):
+        metric_inc("seen_exclusion_bitmap_total")
+        candidates = await _fetch_unseen_via_bitmap(user, pool_size, exclude_ids)
+    else:
+        metric_inc("seen_exclusion_sql_total")
+        candidates = await _fetch_nearby(user, pool_size, exclude_ids=exclude_ids)
+    
+    return rank_candidates(user, candidates, limit)
+
+async def create_like(from_telegram_id: int, to_user_id: int):
+    """Record a like and detect a mutual match in one round trip.
+    
+    Returns None if either user is missing, otherwise a row with the
+    liker's id, whether the like and match are new, and the target's
+    telegram_id, language and notify_matches for the notification.
+    """
+    async with get_db_connection() as conn:
+        return await conn.fetchrow(
+            "SELECT * FROM record_like($1, $2)",
+            from_telegram_id, to_user_id
+        )
+
+_CURSOR_EPOCH = datetime(1970, 1, 1)
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    """Compact (timestamp, id) keyset cursor for callback_data"""
+    return f"{(ts - _CURSOR_EPOCH) // timedelta(microseconds=1)}_{row_id}"
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_cursor"""
+    micros, row_id = cursor.split("_")
+    return _CURSOR_EPOCH + timedelta(microseconds=int(micros)), int(row_id)
+
+async def get_matches_page(user_id: int, cursor: Optional[Tuple[datetime, int]] = None,
+                           newer: bool = False, limit: int = MATCHES_PAGE,
+                           blocked_ids: Optional[List[int]] = None):
+    """One page of matches, newest first, keyset on (matched_at, match_id).
+    
+    Without newer, returns matches older than the cursor; with newer,
+    the ones just above it. Each side of the match is read from its own
+    index, so the cost does not grow with the number of matches.
+    """
+    if newer:
+        compare, order = ">", "ASC"
+    else:
+        compare, order = "<", "DESC"
+    after, after_id = cursor if cursor else (None, None)
+    
+    async with get_db_connection() as conn:
+        rows = await conn.fetch(f"""
+            SELECT m.match_id, m.matched_at, u.full_name, u.age, u.sub_city
+            FROM (
+                (SELECT id AS match_id, matched_at, user2_id AS other_id
+                 FROM matches
+                 WHERE user1_id = $1
+                   AND user2_id <> ALL($5::int[])
+                   AND ($2::timestamp IS NULL OR (matched_at, id) {compare} ($2, $3))
+                 ORDER BY matched_at {order}, id {order}
+                 LIMIT $4)
+                UNION ALL
+                (SELECT id, matched_at, user1_id
+                 FROM matches
+                 WHERE user2_id = $1
+                   AND user1_id <> ALL($5::int[])
+                   AND ($2::timestamp IS NULL OR (matched_at, id) {compare} ($2, $3))
+                 ORDER BY matched_at {order}, id {order}
+                 LIMIT $4)
+            ) m
+            JOIN users u ON u.id = m.other_id
+            ORDER BY m.matched_at {order}, m.match_id {order}
+            LIMIT $4
+        """, user_id, after, after_id, limit, blocked_ids or [])
+    return list(reversed(rows)) if newer else rows
+
+# ============= SWIPES =============
+def seen_bitmap_key(user_id: int) -> str:
+    """Redis bitmap of profile ids a user has swiped on"""
+    return f"seen:{user_id}"
+
+def seen_ready_key(user_id: int) -> str:
+    """Marker set once the seen bitmap mirrors the swipes table"""
+    return f"seen:{user_id}:ready"
+
+async def record_swipe(user_id: int, target_id: int, action: str):
+    """Persist a like/dislike/skip; a like is never downgraded"""
+    async with get_db_connection() as conn:
+        await conn.execute("""
+            INSERT INTO swipes (user_id, target_id, action)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (user_id, target_id) DO UPDATE
+            SET action = CASE WHEN swipes.action = 'like' THEN 'like' ELSE EXCLUDED.action END,
+                created_at = NOW()
+        """, user_id, target_id, action)
+    
+    await mark_seen(user_id, target_id)
+
+async def mark_seen(user_id: int, target_id: int):
+    """Mirror a swipe into the bitmap; promote heavy swipers to it"""
+    key = seen_bitmap_key(user_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.setbit(key, target_id, 1)
+    pipe.expire(key, SEEN_BITMAP_TTL)
+    pipe.bitcount(key)
+    pipe.exists(seen_ready_key(user_id))
+    _, _, seen_count, ready = await pipe.execute()
+    
+    if not ready and seen_count >= SEEN_BITMAP_THRESHOLD:
+        await rebuild_seen_bitmap(user_id)
+
+async def rebuild_seen_bitmap(user_id: int):
+    """Load every swipe of a user into the bitmap and mark it ready"""
+    async with get_db_connection() as conn:
+        rows = await conn.fetch(
+            "SELECT target_id FROM swipes WHERE user_id = $1",
+            user_id
+        )
+    
+    # Bits are only ever set, so concurrent swipes cannot be lost here
+    key = seen_bitmap_key(user_id)
+    pipe = redis.pipeline(transaction=True)
+    for row in rows:
+        pipe.setbit(key, row["target_id"], 1)
+    pipe.expire(key, SEEN_BITMAP_TTL)
+    # Expires before the bitmap, so a lost bitmap is rebuilt rather than trusted
+    pipe.set(seen_ready_key(user_id), 1, ex=SEEN_BITMAP_TTL // 2)
+    await pipe.execute()
+
+# ============= BLOCKS =============
+# Each user has a Redis set of ids blocked in either direction, so
+# exclusion is one SISMEMBER wherever two users could meet.
+def block_set_key(user_id: int) -> str:
+    """Ids a user has blocked or been blocked by"""
+    return f"blocks:{user_id}"
+
+def block_ready_key(user_id: int) -> str:
+    """Marker set once the block set mirrors the blocks table"""
+    return f"blocks:{user_id}:ready"
+
+async def load_block_set(user_id: int):
+    """Rebuild a user's block set from Postgres and mark it ready"""
+    key = block_set_key(user_id)
+    try:
+        async with redis.pipeline(transaction=True) as pipe:
+            # A block/unblock landing mid-load aborts it; it is retried on
+            # the next check instead of writing a stale set
+            await pipe.watch(key)
+            async with get_db_connection() as conn:
+                rows = await conn.fetch("""
+                    SELECT blocked_id AS other_id FROM blocks WHERE blocker_id = $1
+                    UNION
+                    SELECT blocker_id FROM blocks WHERE blocked_id = $1
+                """, user_id)
+            pipe.multi()
+            pipe.delete(key)
+            if rows:
+                pipe.sadd(key, *[row["other_id"] for row in rows])
+                pipe.expire(key, BLOCK_SET_TTL)
+            # Expires before the set, so a lost set is rebuilt rather than trusted
+            pipe.set(block_ready_key(user_id), 1, ex=BLOCK_SET_TTL // 2)
+            await pipe.execute()
+    except WatchError:
+        metric_inc("block_set_load_conflicts_total")
+
+async def get_blocked_ids(user_id: int) -> List[int]:
+    """Everyone hidden from this user by a block in either direction"""
+    if not await redis.exists(block_ready_key(user_id)):
+        await load_block_set(user_id)
+    return [int(other_id) for other_id in await redis.smembers(block_set_key(user_id))]
+
+async def is_blocked_between(user_id: int, other_id: int) -> bool:
+    """True if either user blocked the other"""
+    pipe = redis.pipeline(transaction=False)
+    pipe.exists(block_ready_key(user_id))
+    pipe.sismember(block_set_key(user_id), other_id)
+    ready, blocked = await pipe.execute()
+    if not ready:
+        await load_block_set(user_id)
+        blocked = await redis.sismember(block_set_key(user_id), other_id)
+    return bool(blocked)
+
+async def block_user(blocker_id: int, blocked_id: int):
+    """Block someone; both sides stop seeing each other immediately"""
+    async with get_db_connection() as conn:
+        await conn.execute("""
+            INSERT INTO blocks (blocker_id, blocked_id) VALUES ($1, $2)
+            ON CONFLICT DO NOTHING
+        """, blocker_id, blocked_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.sadd(block_set_key(blocker_id), blocked_id)
+    pipe.sadd(block_set_key(blocked_id), blocker_id)
+    await pipe.execute()
+
+async def unblock_user(blocker_id: int, blocked_id: int):
+    """Lift a block unless the other side still blocks back"""
+    async with get_db_connection() as conn:
+        still_blocked = await conn.fetchval("""
+            WITH removed AS (
+                DELETE FROM blocks WHERE blocker_id = $1 AND blocked_id = $2
+            )
+            SELECT EXISTS (SELECT 1 FROM blocks WHERE blocker_id = $2 AND blocked_id = $1)
+        """, blocker_id, blocked_id)
+    if not still_blocked:
+        pipe = redis.pipeline(transaction=False)
+        pipe.srem(block_set_key(blocker_id), blocked_id)
+        pipe.srem(block_set_key(blocked_id), blocker_id)
+        await pipe.execute()
+
+async def get_blocked_users(user_id: int, limit: int = 20):
+    """Profiles this user blocked, newest first"""
+    async with get_db_connection() as conn:
+        return await conn.fetch("""
+            SELECT u.id, u.full_name
+            FROM blocks b
+            JOIN users u ON u.id = b.blocked_id
+            WHERE b.blocker_id = $1
+            ORDER BY b.created_at DESC
+            LIMIT $2
+        """, user_id, limit)
+
+# ============= PHOTOS =============
+# file_ids that failed to send are remembered with their owner, skipped
+# on later sends and re-checked with getFile in the background.
+async def usable_photos(photo_ids: List[str]) -> List[str]:
+    """Drop file_ids known to be bad, keeping album order"""
+    if not photo_ids:
+        return []
+    bad = await redis.hmget(BAD_PHOTOS_KEY, photo_ids)
+    return [photo_id for photo_id, owner in zip(photo_ids, bad) if owner is None]
+
+# Only these BadRequest messages mean the file_id itself is dead
+BAD_FILE_ERRORS = ("wrong file identifier", "wrong remote file identifier")
+
+def is_bad_file_error(error: TelegramBadRequest) -> bool:
+    """Whether Telegram rejected a send because of the file_id"""
+    message = str(error).lower()
+    return any(marker in message for marker in BAD_FILE_ERRORS)
+
+async def mark_photo_bad(photo_id: str, owner_id: int):
+    """Remember a file_id Telegram rejected"""
+    await redis.hset(BAD_PHOTOS_KEY, photo_id, owner_id)
+    await invalidate_profile_cards(owner_id)
+    metric_inc("photos_marked_bad_total")
+
+async def remove_profile_photo(owner_id: int, photo_id: str):
+    """Remove a dead file_id from a profile, promoting the next photo"""
+    async with get_db_connection() as conn:
+        telegram_id = await conn.fetchval("""
+            UPDATE users
+            SET photo_ids = photo_ids - $2::text,
+                main_photo_id = CASE WHEN main_photo_id = $2
+                                     THEN (photo_ids - $2::text)->>0
+                                     ELSE main_photo_id END,
+                updated_at = NOW()
+            WHERE id = $1
+            RETURNING telegram_id
+        """, owner_id, photo_id)
+    if telegram_id:
+        await invalidate_user_cache(telegram_id)
+    await invalidate_profile_cards(owner_id)
+
+async def revalidate_bad_photos():
+    """getFile each suspect file_id; clear false alarms, purge dead ones"""
+    cursor = 0
+    while True:
+        cursor, entries = await redis.hscan(BAD_PHOTOS_KEY, cursor, count=100)
+        for photo_id, owner_id in entries.items():
+            photo_id = photo_id.decode() if isinstance(photo_id, bytes) else photo_id
+            await _outbox_bulk_bucket.acquire()
+            try:
+                await bot.get_file(photo_id)
+            except TelegramBadRequest as e:
+                # Anything else (e.g. "file is too big") means the id still works
+                if is_bad_file_error(e):
+                    await remove_profile_photo(int(owner_id), photo_id)
+                    metric_inc("photos_purged_total")
+            except TelegramRetryAfter as e:
+                # Flood-wait is bot-wide: hold back the outbox too, and
+                # leave this photo for the next round
+                pause_outbox(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError):
+                continue  # try again next round
+            await redis.hdel(BAD_PHOTOS_KEY, photo_id)
+            # A false alarm puts the photo back on the cards
+            await invalidate_profile_cards(int(owner_id))
+        if not cursor:
+            break
+
+async def photo_revalidator():
+    """Periodic background check of bad file_ids"""
+    while True:
+        await asyncio.sleep(PHOTO_REVALIDATE_INTERVAL)
+        try:
+            await revalidate_bad_photos()
+        except Exception:
+            logger.exception("Photo revalidation failed")
+
+# ============= PROFILE CARDS =============
+# Everything browse shows about a profile except the viewer-specific
+# distance, rendered once per language and shared by all viewers.
+# Misses are rendered from the users table, never from a viewer's queue
+# entry, and a per-profile generation bumped by every invalidation keeps
+# a render that raced an update from being cached.
+_SET_PROFILE_CARDS_SCRIPT = """
+local stored = 0
+for i = 1, #KEYS, 2 do
+    local gen = redis.call('GET', KEYS[i]) or ''
+    if gen == ARGV[i + 1] then
+        redis.call('SET', KEYS[i + 1], ARGV[i + 2], 'EX', ARGV[1])
+        stored = stored + 1
+    end
+end
+return stored
+"""
+_set_profile_cards = redis.register_script(_SET_PROFILE_CARDS_SCRIPT)
+
+def profile_card_key(user_id: int, lang: str) -> str:
+    """Redis key of a rendered card"""
+    return f"card:v{PROFILE_CARD_VERSION}:{user_id}:{lang}"
+
+def profile_card_gen_key(user_id: int) -> str:
+    """Redis counter bumped whenever a profile's cards are invalidated"""
+    return f"card:gen:{user_id}"
+
+async def render_profile_cards(profiles, lang: str) -> Dict[int, dict]:
+    """Render cards for candidate rows/entries, one bad-photo lookup in all"""
+    albums = {
+        profile["id"]: profile.get("photo_ids")
+        or ([profile["main_photo_id"]] if profile.get("main_photo_id") else [])
+        for profile in profiles
+    }
+    all_photos = [photo_id for album in albums.values() for photo_id in album]
+    bad = set()
+    if all_photos:
+        owners = await redis.hmget(BAD_PHOTOS_KEY, all_photos)
+        bad = {photo_id for photo_id, owner in zip(all_photos, owners) if owner is not None}
+    
+    cards = {}
+    for profile in profiles:
+        photos = [photo_id for photo_id in albums[profile["id"]] if photo_id not in bad]
+        title = f"👤 <b>{html.escape(profile['full_name'])}</b>"
+        if profile["age"]:
+            title += f", {profile['age']}"
+        bio = profile["bio"] or ""
+        if len(bio) > 100:
+            bio = bio[:100] + "..."
+        cards[profile["id"]] = {
+            "title": title,
+            "sub_city": profile["sub_city"],
+            "bio": html.escape(bio),
+            "photo_id": photos[0] if photos else None,
+            "reply_markup": get_profile_action_keyboard(
+                profile["id"], lang, len(photos)
+            ).model_dump(exclude_none=True),
+        }
+    return cards
+
+async def build_profile_cards(user_ids: List[int], lang: str) -> Dict[int, dict]:
+    """Render cards from current profile rows and cache them.
+    
+    The generations are read before the rows, so a card whose profile is
+    invalidated in between is returned but not cached.
+    """
+    gen_keys = [profile_card_gen_key(user_id) for user_id in user_ids]
+    generations = await redis.mget(gen_keys)
+    async with get_db_connection() as conn:
+        rows = await conn.fetch("""
+            SELECT id, full_name, age, sub_city, bio, main_photo_id, photo_ids
+            FROM users
+            WHERE id = ANY($1::int[]) AND is_active
+        """, user_ids)
+    cards = await render_profile_cards(rows, lang)
+    if not cards:
+        return cards
+    
+    keys, args = [], [PROFILE_CARD_TTL]
+    for gen_key, user_id, generation in zip(gen_keys, user_ids, generations):
+        if user_id not in cards:
+            continue
+        if isinstance(generation, bytes):
+            generation = generation.decode()
+        keys += [gen_key, profile_card_key(user_id, lang)]
+        args += [generation or "", json.dumps(cards[user_id])]
+    stored = await _set_profile_cards(keys=keys, args=args)
+    metric_inc("profile_cards_rendered_total", stored)
+    return cards
+
+async def prefetch_profile_cards(profiles, lang: str):
+    """Render and cache cards missing for a candidate batch"""
+    if not profiles:
+        return
+    keys = [profile_card_key(profile["id"], lang) for profile in profiles]
+    cached = await redis.mget(keys)
+    missing = [profile["id"] for profile, card in zip(profiles, cached) if card is None]
+    if missing:
+        await build_profile_cards(missing, lang)
+
+async def get_profile_card(profile: dict, lang: str) -> dict:
+    """Cached card for a candidate entry, rendered on a miss"""
+    raw = await redis.get(profile_card_key(profile["id"], lang))
+    if raw is not None:
+        metric_inc("profile_card_hits_total")
+        return json.loads(raw)
+    metric_inc("profile_card_misses_total")
+    cards = await build_profile_cards([profile["id"]], lang)
+    if profile["id"] in cards:
+        return cards[profile["id"]]
+    # Deactivated since it was queued: show what the viewer already has
+    return (await render_profile_cards([profile], lang))[profile["id"]]
+
+def card_caption(card: dict, distance_km: Optional[float]) -> str:
+    """Card text with the viewer's distance filled in"""
+    lines = [card["title"]]
+    location_parts = [card["sub_city"]] if card["sub_city"] else []
+    if distance_km is not None:
+        location_parts.append(f"{distance_km:.1f} km")
+    if location_parts:
+        lines.append(f"📍 {' · '.join(location_parts)}")
+    if card["bio"]:
+        lines.append(f"\n{card['bio']}")
+    return "\n".join(lines)
+
+async def invalidate_profile_cards(user_id: int):
+    """Drop a profile's cards after its data or photos change"""
+    gen_key = profile_card_gen_key(user_id)
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.delete(*[profile_card_key(user_id, lang) for lang in PROFILE_CARD_LANGUAGES])
+        pipe.incr(gen_key)
+        pipe.expire(gen_key, PROFILE_CARD_TTL)
+        await pipe.execute()
+
+# ============= LIKE QUOTA =============
+# Likes are counted in Redis under a key per Addis calendar day that
+# expires at local midnight, so the reset needs no job. A dirty set per
+# day lets flush_like_quotas copy counts into users.likes_today.
+_CONSUME_LIKE_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+if ARGV[3] == '0' and used >= tonumber(ARGV[1]) then
+    return -1
+end
+used = redis.call('INCR', KEYS[1])
+redis.call('EXPIREAT', KEYS[1], ARGV[2])
+redis.call('SADD', KEYS[2], ARGV[4])
+redis.call('EXPIREAT', KEYS[2], tonumber(ARGV[2]) + 86400)
+return used
+"""
+_consume_like = redis.register_script(_CONSUME_LIKE_SCRIPT)
+
+# Never creates the counter or takes it below zero: a release after
+# midnight or after expiry is a no-op instead of a free like
+_RELEASE_LIKE_SCRIPT = """
+local used = tonumber(redis.call('GET', KEYS[1]) or '0')
+if used <= 0 then
+    return 0
+end
+used = redis.call('DECR', KEYS[1])
+redis.call('EXPIREAT', KEYS[1], ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('EXPIREAT', KEYS[2], tonumber(ARGV[1]) + 86400)
+return used
+"""
+_release_like = redis.register_script(_RELEASE_LIKE_SCRIPT)
+
+def quota_day(now: Optional[datetime] = None) -> datetime:
+    """Start of the current Addis Ababa calendar day"""
+    now = now or datetime.now(ADDIS_TZ)
+    return now.astimezone(ADDIS_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def like_quota_key(user_id: int, day: datetime) -> str:
+    """Redis counter of likes a user sent on a given day"""
+    return f"likes:{day:%Y%m%d}:{user_id}"
+
+def like_quota_dirty_key(day: datetime) -> str:
+    """Redis set of user ids whose counter changed on a given day"""
+    return f"likes:{day:%Y%m%d}:dirty"
+
+async def consume_like_quota(user) -> bool:
+    """Atomically count one like; False if the daily limit is used up"""
+    day = quota_day()
+    midnight = int((day + timedelta(days=1)).timestamp())
+    used = await _consume_like(
+        keys=[like_quota_key(user["id"], day), like_quota_dirty_key(day)],
+        args=[DAILY_LIKE_LIMIT, midnight, int(bool(user["is_premium"])), user["id"]]
+    )
+    return used != -1
+
+async def release_like_quota(user):
+    """Give back a like that turned out to be a duplicate"""
+    day = quota_day()
+    midnight = int((day + timedelta(days=1)).timestamp())
+    await _release_like(
+        keys=[like_quota_key(user["id"], day), like_quota_dirty_key(day)],
+        args=[midnight, user["id"]]
+    )
+
+async def likes_used_today(user) -> int:
+    """Likes a user has sent since local midnight"""
+    return int(await redis.get(like_quota_key(user["id"], quota_day())) or 0)
+
+async def like_quota_exhausted(user) -> bool:
+    """Whether a non-premium user has hit today's limit"""
+    return not user["is_premium"] and await likes_used_today(user) >= DAILY_LIKE_LIMIT
+
+async def flush_like_quotas():
+    """Write changed counters to users.likes_today / last_like_reset"""
+    today = quota_day()
+    # Yesterday first, so late flushes never overwrite today's count
+    for day in (today - timedelta(days=1), today):
+        dirty_key = like_quota_dirty_key(day)
+        while True:
+            user_ids = [int(uid) for uid in await redis.spop(dirty_key, 500) or []]
+            if not user_ids:
+                break
+            try:
+                counts = await redis.mget([like_quota_key(uid, day) for uid in user_ids])
+                async with get_db_connection() as conn:
+                    await conn.execute("""
+                        UPDATE users u
+                        SET likes_today = v.likes, last_like_reset = $3
+                        FROM unnest($1::int[], $2::int[]) AS v(id, likes)
+                        WHERE u.id = v.id AND u.last_like_reset < $3::timestamp + INTERVAL '1 day'
+                    """, user_ids, [int(c or 0) for c in counts], day.replace(tzinfo=None))
+            except Exception:
+                # Put the batch back so the next flush retries it
+                pipe = redis.pipeline(transaction=False)
+                pipe.sadd(dirty_key, *user_ids)
+                pipe.expireat(dirty_key, int((day + timedelta(days=2)).timestamp()))
+                await pipe.execute()
+                raise
+
+async def like_quota_flusher():
+    """Periodic write-behind of like counters"""
+    while True:
+        await asyncio.sleep(LIKE_QUOTA_FLUSH_INTERVAL)
+        try:
+            await flush_like_quotas()
+        except Exception:
+            logger.exception("Like quota flush failed")
+
+# ============= CANDIDATE QUEUE =============
+def candidate_queue_key(telegram_id: int) -> str:
+    """Redis list of prefetched candidates for a viewer"""
+    return f"cand:{telegram_id}"
+
+def _candidate_entry(row) -> str:
+    """Serialize the fields browse needs from a candidate row"""
+    return json.dumps({
+        "id": row["id"],
+        "telegram_id": row["telegram_id"],
+        "full_name": row["full_name"],
+        "age": row["age"],
+        "sub_city": row["sub_city"],
+        "bio": row["bio"],
+        "main_photo_id": row["main_photo_id"],
+        "photo_ids": row["photo_ids"] or [],
+        "distance_km": row["distance_km"],
+        "interest_mask": row["interest_mask"],
+    })
+
+async def refill_candidate_queue(telegram_id: int) -> bool:
+    """Append the next batch of unseen candidates to a viewer's queue.
+    
+    Returns False without doing anything when another refill holds the lock.
+    """
+    key = candidate_queue_key(telegram_id)
+    lock_key = f"{key}:refill"
+    gen_key = f"{key}:gen"
+    if not await redis.set(lock_key, 1, nx=True, ex=30):
+        return False
+    
+    try:
+        generation = await redis.get(gen_key)
+        queued_ids = [json.loads(entry)["id"] for entry in await redis.lrange(key, 0, -1)]
+        user = await get_user(telegram_id)
+        blocked_ids = await get_blocked_ids(user["id"]) if user else []
+        batch = await get_nearby_users(
+            telegram_id,
+            limit=CANDIDATE_BATCH_SIZE,
+            exclude_ids=queued_ids + blocked_ids
+        )
+        if not batch:
+            return True
+        
+        # Drop the batch if the queue was invalidated while we queried
+        async with redis.pipeline(transaction=True) as pipe:
+            await pipe.watch(gen_key)
+            if await pipe.get(gen_key) != generation:
+                return True
+            pipe.multi()
+            pipe.rpush(key, *[_candidate_entry(row) for row in batch])
+            pipe.expire(key, CANDIDATE_QUEUE_TTL)
+            await pipe.execute()
+        metric_inc("candidate_queue_refills_total")
+        await prefetch_profile_cards(batch, user["language"])
+    except WatchError:
+        pass
+    finally:
+        await redis.delete(lock_key)
+    return True
+
+async def _wait_for_refill(telegram_id: int):
+    """Wait up to CANDIDATE_REFILL_WAIT for a concurrent refill to finish"""
+    lock_key = f"{candidate_queue_key(telegram_id)}:refill"
+    deadline = time.monotonic() + CANDIDATE_REFILL_WAIT
+    while time.monotonic() < deadline and await redis.exists(lock_key):
+        await asyncio.sleep(0.1)
+
+async def _candidate_visible(user, candidate: dict) -> bool:
+    """False for candidates seen, hidden by moderation or blocked since queuing"""
+    pipe = redis.pipeline(transaction=False)
+    pipe.getbit(seen_bitmap_key(user["id"]), candidate["id"])
+    pipe.sismember(HIDDEN_USERS_KEY, candidate["id"])
+    pipe.exists(block_ready_key(user["id"]))
+    pipe.sismember(block_set_key(user["id"]), candidate["id"])
+    seen, hidden, blocks_ready, blocked = await pipe.execute()
+    if not blocks_ready:
+        blocked = await is_blocked_between(user["id"], candidate["id"])
+    return not seen and not hidden and not blocked
+
+async def _direct_candidate(user) -> Optional[dict]:
+    """Query the next candidate without going through the queue"""
+    blocked_ids = await get_blocked_ids(user["id"])
+    rows = await get_nearby_users(
+        user["telegram_id"], limit=CANDIDATE_STALE_SKIPS, exclude_ids=blocked_ids
+    )
+    for row in rows:
+        candidate = json.loads(_candidate_entry(row))
+        if await _candidate_visible(user, candidate):
+            return candidate
+    return None
+
+async def next_candidate(user) -> Optional[dict]:
+    """Pop the next unseen candidate, refilling below the low-water mark"""
+    key = candidate_queue_key(user["telegram_id"])
+    
+    for attempt in range(CANDIDATE_STALE_SKIPS):  # bounded skip over stale entries
+        pipe = redis.pipeline(transaction=False)
+        pipe.lpop(key)
+        pipe.llen(key)
+        entry, remaining = await pipe.execute()
+        
+        if remaining < CANDIDATE_LOW_WATER:
+            if entry is None and attempt == 0:
+                # Cold queue: this one refill is on the request path
+                metric_inc("candidate_queue_cold_total")
+                if await refill_candidate_queue(user["telegram_id"]):
+                    entry = await redis.lpop(key)
+                    if entry is None:
+                        return None  # our own refill found nobody
+                else:
+                    # Another worker is refilling; give it a moment
+                    await _wait_for_refill(user["telegram_id"])
+                    entry = await redis.lpop(key)
+            else:
+                spawn(refill_candidate_queue(user["telegram_id"]))
+        
+        if entry is None:
+            break
+        
+        candidate = json.loads(entry)
+        # Entries queued before a swipe on another device, a block, or the
+        # profile being hidden by moderation are skipped here
+        if await _candidate_visible(user, candidate):
+            metric_inc("candidate_queue_pops_total")
+            return candidate
+    
+    # Lost the refill race or ran out of skips on stale entries
+    metric_inc("candidate_queue_fallback_total")
+    return await _direct_candidate(user)
 
-async def add_user_interests(telegram_id: int, interest_ids: List[int]):
-    """Add interests for user"""
-    conn = await get_db_connection()
-    user = await get_user(telegram_id)
+async def invalidate_candidate_queue(telegram_id: int):
+    """Forget queued candidates after the viewer's filters change"""
+    key = candidate_queue_key(telegram_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.delete(key)
+    pipe.incr(f"{key}:gen")
+    await pipe.execute()
+
+# ============= OUTBOUND QUEUE =============
+# Handlers enqueue and return; workers deliver under a global and a
+# per-chat token bucket, honor retry_after, retry transient failures
+# with backoff and record the final state in outbox:status:<id>.
+OUTBOX_METHODS = {"send_message", "copy_message", "send_photo"}
+
+class TokenBucket:
+    """Async token bucket refilled at `rate` tokens per second"""
     
-    # Clear existing interests
-    await conn.execute(
-        "DELETE FROM user_interests WHERE user_id = $1",
-        user["id"]
-    )
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
     
-    # Add new interests
-    for interest_id in interest_ids:
-        await conn.execute(
-            "INSERT INTO user_interests (user_id, interest_id) VALUES ($1, $2)",
-            user["id"], interest_id
-        )
+    def pause(self, seconds: float):
+        """Hold every caller back, e.g. for Telegram's retry_after"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
     
-    await conn.close()
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
 
-async def get_nearby_users(telegram_id: int, limit: int = 20):
-    """Get nearby users for browsing"""
-    user = await get_user(telegram_id)
-    if not user or not user["latitude"]:
-        return []
-    
-    conn = await get_db_connection()
+# Each worker process of each replica gets an equal share of the bot-wide rate
+_outbox_global_bucket = TokenBucket(OUTBOX_GLOBAL_RATE / (WEB_CONCURRENCY * REPLICA_COUNT))
+_outbox_bulk_bucket = TokenBucket(OUTBOX_BULK_RATE / (WEB_CONCURRENCY * REPLICA_COUNT))
+_outbox_chat_buckets = LocalTTLCache(10_000, 60)
+
+def _chat_bucket(chat_id: int) -> TokenBucket:
+    """Per-chat bucket, kept while the chat is active"""
+    bucket = _outbox_chat_buckets.get(chat_id)
+    if bucket is None:
+        bucket = TokenBucket(OUTBOX_CHAT_RATE)
+    _outbox_chat_buckets.set(chat_id, bucket)
+    return bucket
+
+def pause_outbox(seconds: float):
+    """Flood control is bot-wide: hold back every stream, not just one"""
+    _outbox_global_bucket.pause(seconds)
+    _outbox_bulk_bucket.pause(seconds)
+
+def outbox_status_key(status_id: str) -> str:
+    """Redis hash with the state (queued, retrying, sent, failed) of one outbound message"""
+    return f"outbox:status:{status_id}"
+
+async def enqueue_message(chat_id: int, text: Optional[str] = None, *,
+                          method: str = "send_message",
+                          dedup_key: Optional[str] = None,
+                          stream: str = OUTBOX_STREAM,
+                          **params) -> Optional[str]:
+    """Queue a Bot API call for delivery; returns its status id.
     
-    # Query for nearby users with same preference
-    query = """
-        SELECT u.*, 
-               ARRAY_AGG(ui.interest_id) as interest_ids
-        FROM users u
-        LEFT JOIN user_interests ui ON u.id = ui.user_id
-        WHERE u.telegram_id != $1
-          AND u.is_active = TRUE
-          AND u.is_stealth = FALSE
-          AND (
-            u.preference = 'both' OR
-            (u.preference = 'male' AND $2 = 'male') OR
-            (u.preference = 'female' AND $2 = 'female')
-          )
-          AND ($3 = 'both' OR 
-               ($3 = 'male' AND u.gender = 'male') OR
-               ($3 = 'female' AND u.gender = 'female'))
-        GROUP BY u.id
-        ORDER BY u.created_at DESC
-        LIMIT $4
+    With a dedup_key, repeats within OUTBOX_DEDUP_TTL are dropped and
+    None is returned.
     """
+    if method not in OUTBOX_METHODS:
+        raise ValueError(f"Unsupported outbox method: {method}")
+    if dedup_key and not await redis.set(f"outbox:dedup:{dedup_key}", 1, nx=True, ex=OUTBOX_DEDUP_TTL):
+        metric_inc("outbox_deduplicated_total")
+        return None
     
-    users = await conn.fetch(
-        query,
-        telegram_id,
-        user["gender"],
-        user["preference"],
-        limit
+    params["chat_id"] = chat_id
+    if text is not None:
+        params["text"] = text
+    if hasattr(params.get("reply_markup"), "model_dump"):
+        params["reply_markup"] = params["reply_markup"].model_dump(exclude_none=True)
+    payload = {"method": method, "params": params, "attempt": 0}
+    message_id = await _outbox_add(stream, payload)
+    metric_inc("outbox_enqueued_total")
+    return message_id
+
+async def _outbox_add(stream: str, payload: dict) -> str:
+    """Append a payload to the stream and mark it queued"""
+    message_id = await redis.xadd(
+        stream, {"payload": json.dumps(payload)},
+        maxlen=OUTBOX_MAXLEN, approximate=True
     )
-    
-    await conn.close()
-    return users
+    message_id = message_id.decode() if isinstance(message_id, bytes) else message_id
+    status_id = payload.setdefault("status_id", message_id)
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(outbox_status_key(status_id), mapping={"state": "queued", "attempt": payload["attempt"]})
+    pipe.hdel(outbox_status_key(status_id), "retry_at")
+    pipe.expire(outbox_status_key(status_id), OUTBOX_STATUS_TTL)
+    await pipe.execute()
+    return status_id
 
-async def create_like(from_user_id: int, to_user_id: int) -> bool:
-    """Create a like and check for match"""
-    from_user = await get_user(from_user_id)
-    to_user = await get_user(to_user_id)
-    
-    if not from_user or not to_user:
-        return False
+async def _outbox_finish(stream: str, message_id, status_id: str, state: str, error: str = ""):
+    """Record the final state and drop the entry from the stream"""
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(outbox_status_key(status_id), mapping={"state": state, "error": error})
+    pipe.expire(outbox_status_key(status_id), OUTBOX_STATUS_TTL)
+    pipe.xack(stream, OUTBOX_GROUP, message_id)
+    pipe.xdel(stream, message_id)
+    await pipe.execute()
+    metric_inc(f"outbox_{state}_total")
+
+async def _outbox_retry_later(stream: str, consumer: str, message_id, payload: dict, delay: float):
+    """Re-append after a delay; the original stays pending until then.
     
-    conn = await get_db_connection()
+    The pending entry is re-claimed while we wait so its idle time stays
+    under OUTBOX_CLAIM_IDLE_MS and XAUTOCLAIM on another worker does not
+    deliver it a second time. If this process dies, it is reclaimed.
+    """
+    status_key = outbox_status_key(payload["status_id"])
+    pipe = redis.pipeline(transaction=False)
+    pipe.hset(status_key, mapping={
+        "state": "retrying", "attempt": payload["attempt"], "retry_at": int(time.time() + delay)
+    })
+    pipe.expire(status_key, OUTBOX_STATUS_TTL)
+    await pipe.execute()
     
-    # Check if already liked
-    existing = await conn.fetchrow(
-        "SELECT * FROM likes WHERE from_user_id = $1 AND to_user_id = $2",
-        to_user["id"], from_user["id"]
+    heartbeat = OUTBOX_CLAIM_IDLE_MS / 3000
+    deadline = time.monotonic() + delay
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(deadline - time.monotonic(), heartbeat))
+        await redis.xclaim(stream, OUTBOX_GROUP, consumer, 0, [message_id], justid=True)
+    # Back to queued under the same status id
+    await _outbox_add(stream, payload)
+    pipe = redis.pipeline(transaction=False)
+    pipe.xack(stream, OUTBOX_GROUP, message_id)
+    pipe.xdel(stream, message_id)
+    await pipe.execute()
+
+async def deliver_outbox_message(stream: str, consumer: str, message_id, fields: dict,
+                                 buckets: Tuple[TokenBucket, ...]):
+    """Send one queued call, then ack, retry or fail it"""
+    payload = json.loads(fields[b"payload"])
+    status_id = payload.get("status_id") or (
+        message_id.decode() if isinstance(message_id, bytes) else message_id
     )
+    payload["status_id"] = status_id
+    params = payload["params"]
     
-    # Add like
-    await conn.execute(
-        "INSERT INTO likes (from_user_id, to_user_id) VALUES ($1, $2)",
-        from_user["id"], to_user["id"]
-    )
+    for bucket in buckets:
+        await bucket.acquire()
+    await _chat_bucket(params["chat_id"]).acquire()
+    try:
+        await getattr(bot, payload["method"])(**params)
+    except TelegramRetryAfter as e:
+        # Flood control: pause everyone, then retry without using an attempt
+        metric_inc("outbox_retry_after_total")
+        pause_outbox(e.retry_after)
+        spawn(_outbox_retry_later(stream, consumer, message_id, payload, e.retry_after))
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # Blocked bot, deleted chat, bad payload: retrying will not help
+        await _outbox_finish(stream, message_id, status_id, "failed", str(e))
+    except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+        payload["attempt"] += 1
+        if payload["attempt"] >= OUTBOX_MAX_ATTEMPTS:
+            await _outbox_finish(stream, message_id, status_id, "failed", str(e))
+        else:
+            metric_inc("outbox_retries_total")
+            spawn(_outbox_retry_later(stream, consumer, message_id, payload, 2 ** payload["attempt"]))
+    except Exception as e:
+        logger.exception("Outbox delivery %s failed", status_id)
+        await _outbox_finish(stream, message_id, status_id, "failed", str(e))
+    else:
+        await _outbox_finish(stream, message_id, status_id, "sent")
+
+async def _deliver_chat_entries(stream: str, consumer: str, entries: list,
+                                buckets: Tuple[TokenBucket, ...], slots: asyncio.Semaphore):
+    """Deliver one chat's entries in stream order"""
+    for message_id, fields in entries:
+        async with slots:
+            await deliver_outbox_message(stream, consumer, message_id, fields, buckets)
+
+async def outbox_worker(stream: str, consumer: str, buckets: Tuple[TokenBucket, ...]):
+    """Drain the stream, also reclaiming entries left by dead consumers.
     
-    # Update likes count
-    await conn.execute(
-        "UPDATE users SET likes_today = likes_today + 1 WHERE id = $1",
-        from_user["id"]
-    )
+    Chats in a batch are delivered concurrently, so one busy chat waiting
+    on its bucket does not hold up the rest; each chat keeps its order.
+    """
+    slots = asyncio.Semaphore(OUTBOX_SEND_CONCURRENCY)
+    while True:
+        try:
+            response = await redis.xreadgroup(
+                OUTBOX_GROUP, consumer, {stream: ">"}, count=10, block=5000
+            )
+            entries = [entry for _, batch in response or [] for entry in batch]
+            if not entries:
+                claimed = await redis.xautoclaim(
+                    stream, OUTBOX_GROUP, consumer,
+                    min_idle_time=OUTBOX_CLAIM_IDLE_MS, start_id="0-0", count=10
+                )
+                entries = claimed[1]
+            by_chat = defaultdict(list)
+            for message_id, fields in entries:
+                if fields:  # Deleted entries come back empty from XAUTOCLAIM
+                    chat_id = json.loads(fields[b"payload"])["params"]["chat_id"]
+                    by_chat[chat_id].append((message_id, fields))
+            await asyncio.gather(*(
+                _deliver_chat_entries(stream, consumer, chat_entries, buckets, slots)
+                for chat_entries in by_chat.values()
+            ))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Outbox worker %s failed", consumer)
+            await asyncio.sleep(1)
+
+async def start_outbox_workers():
+    """Create the consumer groups and start both worker pools"""
+    for stream in (OUTBOX_STREAM, OUTBOX_BULK_STREAM):
+        try:
+            await redis.xgroup_create(stream, OUTBOX_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+    for i in range(OUTBOX_WORKERS):
+        spawn(outbox_worker(OUTBOX_STREAM, f"{os.getpid()}-{i}", (_outbox_global_bucket,)))
+    # Bulk traffic is capped by its own bucket and also spends global
+    # tokens, so together the streams never exceed OUTBOX_GLOBAL_RATE
+    bulk_buckets = (_outbox_bulk_bucket, _outbox_global_bucket)
+    for i in range(OUTBOX_BULK_WORKERS):
+        spawn(outbox_worker(OUTBOX_BULK_STREAM, f"{os.getpid()}-bulk-{i}", bulk_buckets))
+
+# ============= NEARBY ALERTS =============
+async def _nearby_alert_recipients(new_user, after_id: int):
+    """Next chunk of opted-in, compatible users whose radius covers new_user"""
+    lat, lon = new_user["latitude"], new_user["longitude"]
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, MAX_SEARCH_RADIUS_KM)
     
-    is_match = False
-    if existing:
-        # Create match
-        await conn.execute(
-            """INSERT INTO matches (user1_id, user2_id) 
-               VALUES ($1, $2), ($2, $1)
-               ON CONFLICT DO NOTHING""",
-            min(from_user["id"], to_user["id"]),
-            max(from_user["id"], to_user["id"])
+    async with get_db_connection() as conn:
+        return await conn.fetch("""
+            SELECT u.id, u.telegram_id, u.language
+            FROM users u
+            WHERE u.geo_cell = ANY($1::bigint[])
+              AND u.notify_nearby AND u.is_active
+              AND u.id > $2
+              AND u.id != $3
+              AND u.latitude BETWEEN $4 AND $5
+              AND u.longitude BETWEEN $6 AND $7
+              AND haversine_km($8, $9, u.latitude, u.longitude)
+                  <= LEAST(COALESCE(u.search_radius, 10), $10)
+              AND (u.preference = 'both' OR u.preference = $11)
+              AND ($12 = 'both' OR u.gender = $12)
+            ORDER BY u.id
+            LIMIT $13
+        """,
+            geo_cells_for_radius(lat, lon, MAX_SEARCH_RADIUS_KM),
+            after_id,
+            new_user["id"],
+            min_lat, max_lat, min_lon, max_lon,
+            lat, lon,
+            MAX_SEARCH_RADIUS_KM,
+            new_user["gender"],
+            new_user["preference"],
+            NEARBY_ALERT_CHUNK
         )
-        is_match = True
-    
-    await conn.close()
-    return is_match
 
-async def get_user_matches(telegram_id: int):
-    """Get user's matches"""
-    user = await get_user(telegram_id)
-    if not user:
-        return []
+async def _under_nearby_cap(recipients) -> list:
+    """Count today's alert per recipient; keep those within the daily cap"""
+    day = quota_day()
+    midnight = int((day + timedelta(days=1)).timestamp())
+    pipe = redis.pipeline(transaction=False)
+    for recipient in recipients:
+        key = f"nearby:{day:%Y%m%d}:{recipient['id']}"
+        pipe.incr(key)
+        pipe.expireat(key, midnight)
+    counts = (await pipe.execute())[::2]
+    return [r for r, count in zip(recipients, counts) if count <= NEARBY_ALERT_DAILY_CAP]
+
+async def fan_out_nearby_alert(telegram_id: int):
+    """Tell nearby opted-in users that someone new joined"""
+    new_user = await get_user(telegram_id)
+    if not new_user or new_user["latitude"] is None or new_user["is_stealth"]:
+        return
+    
+    semaphore = asyncio.Semaphore(NEARBY_ALERT_CONCURRENCY)
+    
+    async def alert(recipient):
+        text = t(recipient["language"], "nearby_alert")
+        button = t(recipient["language"], "btn_browse")
+        async with semaphore:
+            await enqueue_message(
+                recipient["telegram_id"],
+                text,
+                stream=OUTBOX_BULK_STREAM,
+                dedup_key=f"nearby:{new_user['id']}:{recipient['id']}",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text=button, callback_data="browse")]
+                ])
+            )
     
-    conn = await get_db_connection()
+    after_id = 0
+    sent = 0
+    while True:
+        recipients = await _nearby_alert_recipients(new_user, after_id)
+        if not recipients:
+            break
+        after_id = recipients[-1]["id"]
+        allowed = await _under_nearby_cap(recipients)
+        await asyncio.gather(*(alert(r) for r in allowed))
+        sent += len(allowed)
+        if len(recipients) < NEARBY_ALERT_CHUNK:
+            break
     
-    matches = await conn.fetch("""
-        SELECT u.* FROM matches m
-        JOIN users u ON (m.user2_id = u.id AND m.user1_id = $1)
-                      OR (m.user1_id = u.id AND m.user2_id = $1)
-        WHERE u.id != $1
-        ORDER BY m.matched_at DESC
-    """, user["id"])
+    metric_inc("nearby_alerts_total", sent)
+
+# ============= CHAT RELAY =============
+async def get_chat_peer(user_id: int, match_id: int):
+    """The other side of an active match the user belongs to"""
+    async with get_db_connection() as conn:
+        return await conn.fetchrow("""
+            SELECT u.id, u.telegram_id, u.full_name, u.language
+            FROM matches m
+            JOIN users u ON u.id = CASE WHEN m.user1_id = $1 THEN m.user2_id ELSE m.user1_id END
+            WHERE m.id = $2 AND m.chat_active AND $1 IN (m.user1_id, m.user2_id)
+        """, user_id, match_id)
+
+def chat_message_fields(message: Message) -> Optional[Tuple[str, str, Optional[str]]]:
+    """(kind, text, file_id) of a relayable message, None if unsupported"""
+    if message.text:
+        return "text", message.text, None
+    for kind in CHAT_MEDIA_KINDS:
+        media = getattr(message, kind)
+        if media:
+            if kind == "photo":
+                media = media[-1]
+            return kind, message.caption or "", media.file_id
+    return None
+
+async def queue_chat_message(match_id: int, sender_id: int, kind: str,
+                             text: str, file_id: Optional[str]):
+    """Buffer a relayed message for the next batch insert"""
+    await redis.rpush(CHAT_PENDING_KEY, json.dumps({
+        "match_id": match_id,
+        "sender_id": sender_id,
+        "kind": kind,
+        "message": text,
+        "file_id": file_id,
+    }))
+
+async def flush_chat_messages():
+    """Move buffered messages into chat_messages in arrival order"""
+    # One flusher at a time, so ids follow arrival order across workers
+    lock = redis.lock("lock:chat:flush", timeout=30, blocking_timeout=0)
+    if not await lock.acquire():
+        return
+    try:
+        while True:
+            # Renew per batch; if the lock already expired another flusher
+            # may be running, so stop rather than interleave with it
+            try:
+                await lock.reacquire()
+            except LockNotOwnedError:
+                metric_inc("chat_flush_lock_lost_total")
+                return
+            raw = await redis.lpop(CHAT_PENDING_KEY, CHAT_FLUSH_BATCH)
+            if not raw:
+                break
+            rows = [json.loads(item) for item in raw]
+            try:
+                async with get_db_connection() as conn:
+                    # created_at comes from the column default, like other tables
+                    await conn.execute("""
+                        INSERT INTO chat_messages (match_id, sender_id, kind, message, file_id)
+                        SELECT match_id, sender_id, kind, message, file_id
+                        FROM unnest($1::int[], $2::int[], $3::text[], $4::text[], $5::text[])
+                             WITH ORDINALITY AS v(match_id, sender_id, kind, message, file_id, ord)
+                        ORDER BY ord
+                    """,
+                        [row["match_id"] for row in rows],
+                        [row["sender_id"] for row in rows],
+                        [row["kind"] for row in rows],
+                        [row["message"] for row in rows],
+                        [row["file_id"] for row in rows]
+                    )
+            except Exception:
+                # Back to the head of the buffer, order preserved
+                await redis.lpush(CHAT_PENDING_KEY, *reversed(raw))
+                raise
+            metric_inc("chat_messages_flushed_total", len(rows))
+    finally:
+        try:
+            await lock.release()
+        except LockNotOwnedError:
+            pass
+
+async def chat_message_flusher():
+    """Periodic write-behind of relayed chat messages"""
+    while True:
+        await asyncio.sleep(CHAT_FLUSH_INTERVAL)
+        try:
+            await flush_chat_messages()
+        except Exception:
+            logger.exception("Chat message flush failed")
+
+async def get_chat_history(match_id: int, before_id: Optional[int] = None,
+                           limit: int = CHAT_HISTORY_PAGE):
+    """Newest-first page of a match's messages older than before_id"""
+    async with get_db_connection() as conn:
+        return await conn.fetch("""
+            SELECT id, sender_id, kind, message, created_at
+            FROM chat_messages
+            WHERE match_id = $1 AND ($2::int IS NULL OR id < $2)
+            ORDER BY id DESC
+            LIMIT $3
+        """, match_id, before_id, limit)
+
+# ============= MODERATION =============
+async def hide_from_browse(user_id: int, telegram_id: Optional[int]):
+    """Take a profile out of every queued candidate list right away"""
+    await redis.sadd(HIDDEN_USERS_KEY, user_id)
+    if telegram_id:
+        await invalidate_user_cache(telegram_id)
+
+async def unhide_from_browse(user_id: int, telegram_id: Optional[int]):
+    """Undo hide_from_browse after a review clears the profile"""
+    await redis.srem(HIDDEN_USERS_KEY, user_id)
+    if telegram_id:
+        await invalidate_user_cache(telegram_id)
+
+async def submit_report(reporter_id: int, reported_id: int, reason: str):
+    """Store a report; hides the profile at REPORT_HIDE_THRESHOLD reporters"""
+    if reporter_id == reported_id:
+        raise ValueError("Users cannot report themselves")
+    async with get_db_connection() as conn:
+        result = await conn.fetchrow(
+            "SELECT * FROM record_report($1, $2, $3, $4)",
+            reporter_id, reported_id, reason, REPORT_HIDE_THRESHOLD
+        )
+    if result["newly_hidden"]:
+        metric_inc("moderation_auto_hidden_total")
+        await hide_from_browse(reported_id, result["reported_telegram_id"])
+    return result
+
+async def get_review_queue(cursor: Optional[Tuple[datetime, int]] = None,
+                           limit: int = MODERATION_PAGE):
+    """Reported profiles awaiting review, most recently reported first"""
+    after, after_id = cursor if cursor else (None, None)
+    async with get_db_connection() as conn:
+        return await conn.fetch("""
+            SELECT s.reported_id, s.reporters, s.reports, s.status, s.last_report_at,
+                   u.full_name, u.telegram_id, r.reasons
+            FROM report_summary s
+            JOIN users u ON u.id = s.reported_id
+            CROSS JOIN LATERAL (
+                SELECT array_agg(reason) AS reasons FROM (
+                    SELECT reason FROM reports
+                    WHERE reported_id = s.reported_id
+                    ORDER BY created_at DESC
+                    LIMIT 3
+                ) latest
+            ) r
+            WHERE s.status IN ('open', 'hidden')
+              AND ($1::timestamp IS NULL OR (s.last_report_at, s.reported_id) < ($1, $2))
+            ORDER BY s.last_report_at DESC, s.reported_id DESC
+            LIMIT $3
+        """, after, after_id, limit)
+
+async def review_report(reported_id: int, ban: bool):
+    """Close a review: ban the profile, or clear it and restore visibility"""
+    async with get_db_connection() as conn:
+        async with conn.transaction():
+            telegram_id = await conn.fetchval("""
+                UPDATE users SET is_active = $2, updated_at = NOW()
+                WHERE id = $1
+                RETURNING telegram_id
+            """, reported_id, not ban)
+            await conn.execute("""
+                UPDATE report_summary
+                SET status = $2, reviewed_at = NOW(),
+                    reporters = CASE WHEN $2 = 'cleared' THEN 0 ELSE reporters END
+                WHERE reported_id = $1
+            """, reported_id, "banned" if ban else "cleared")
+            if ban:
+                await conn.execute("""
+                    UPDATE matches SET chat_active = FALSE
+                    WHERE (user1_id = $1 OR user2_id = $1) AND chat_active
+                """, reported_id)
+            else:
+                # Later reports count towards a fresh threshold
+                await conn.execute("DELETE FROM report_reporters WHERE reported_id = $1", reported_id)
     
-    await conn.close()
-    return matches
+    if ban:
+        await hide_from_browse(reported_id, telegram_id)
+    else:
+        await unhide_from_browse(reported_id, telegram_id)
+
+# ============= ANALYTICS =============
+# Counters and daily rollups are maintained by triggers (migrations 15
+# and 20). Both are sharded, so reads SUM over the shards; they touch a
+# bounded number of rows whatever the table sizes.
+STATS_SERIES_DAYS = 7
+
+async def get_stat_counters() -> Dict[str, int]:
+    """Running totals, summed over their shards"""
+    async with get_db_connection() as conn:
+        rows = await conn.fetch("SELECT name, SUM(value) AS value FROM stats_counters GROUP BY name")
+    return {row["name"]: int(row["value"]) for row in rows}
+
+async def get_daily_series(days: int = STATS_SERIES_DAYS):
+    """Per-day signups/likes/matches/reports for the last `days` days"""
+    since = quota_day().date() - timedelta(days=days - 1)
+    async with get_db_connection() as conn:
+        return await conn.fetch("""
+            SELECT day, SUM(signups) AS signups, SUM(likes) AS likes,
+                   SUM(matches) AS matches, SUM(reports) AS reports
+            FROM daily_stats
+            WHERE day >= $1
+            GROUP BY day
+            ORDER BY day
+        """, since)
+
+async def get_sub_city_breakdown(days: int = STATS_SERIES_DAYS, limit: int = 10):
+    """Busiest sub-cities over the last `days` days"""
+    since = quota_day().date() - timedelta(days=days - 1)
+    async with get_db_connection() as conn:
+        return await conn.fetch("""
+            SELECT sub_city, SUM(signups) AS signups, SUM(likes) AS likes,
+                   SUM(matches) AS matches, SUM(reports) AS reports
+            FROM daily_stats
+            WHERE day >= $1
+            GROUP BY sub_city
+            ORDER BY SUM(signups) + SUM(likes) DESC
+            LIMIT $2
+        """, since, limit)
 
 # ============= HANDLERS =============
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, user: Optional[dict]):
     """Start command handler - Language first approach"""
-    user = await get_user(message.from_user.id)
-    
     if user:
         # User exists, show main menu
         await show_main_menu(message, user["language"])
@@ -547,10 +3685,7 @@ async def process_language(callback: CallbackQuery, state: FSMContext):
     
     await state.update_data(language=language)
     
-    if language == "am":
-        text = "👤 <b>ስምህ ምን ይባላል?</b>\n\nሙሉ ስምህን አስገባ:"
-    else:
-        text = "👤 <b>What's your name?</b>\n\nEnter your full name:"
+    text = t(language, "ask_name")
     
     await callback.message.edit_text(text)
     await state.set_state(RegistrationStates.name)
@@ -562,10 +3697,7 @@ async def process_name(message: Message, state: FSMContext):
     await state.update_data(full_name=message.text)
     data = await state.get_data()
     
-    if data["language"] == "am":
-        text = "🔞 <b>ዕድሜህ ስንት ነው?</b>\n\nዕድሜህን በቁጥር አስገባ (18+):"
-    else:
-        text = "🔞 <b>How old are you?</b>\n\nEnter your age (18+):"
+    text = t(data["language"], "ask_age")
     
     await message.answer(text)
     await state.set_state(RegistrationStates.age)
@@ -581,10 +3713,7 @@ async def process_age(message: Message, state: FSMContext):
         await state.update_data(age=age)
         data = await state.get_data()
         
-        if data["language"] == "am":
-            text = "⚥ <b>ጾታህ ምንድነው?</b>"
-        else:
-            text = "⚥ <b>What's your gender?</b>"
+        text = t(data["language"], "ask_gender")
         
         await message.answer(
             text,
@@ -593,10 +3722,7 @@ async def process_age(message: Message, state: FSMContext):
         await state.set_state(RegistrationStates.gender)
         
     except ValueError:
-        if data["language"] == "am":
-            error_msg = "እባክህ ትክክለኛ ዕድሜ አስገባ (18 እና ከዚያ በላይ)"
-        else:
-            error_msg = "Please enter a valid age (18 and above)"
+        error_msg = t(data["language"], "invalid_age")
         await message.answer(error_msg)
 
 @router.callback_query(F.data.startswith("gender_"))
@@ -606,10 +3732,7 @@ async def process_gender(callback: CallbackQuery, state: FSMContext):
     await state.update_data(gender=gender)
     data = await state.get_data()
     
-    if data["language"] == "am":
-        text = "❤️ <b>በማን ላይ ፍላጎት አለህ?</b>"
-    else:
-        text = "❤️ <b>Who are you interested in?</b>"
+    text = t(data["language"], "ask_preference")
     
     await callback.message.edit_text(
         text,
@@ -625,18 +3748,7 @@ async def process_preference(callback: CallbackQuery, state: FSMContext):
     await state.update_data(preference=preference)
     data = await state.get_data()
     
-    if data["language"] == "am":
-        text = (
-            "📍 <b>አካባቢህን አሳውቀኝ</b>\n\n"
-            "ለተሻለ ተመሳሳይነት አካባቢህን ሼር አርግ።\n"
-            "ወይም ንኡስ ከተማህን ምረጥ።"
-        )
-    else:
-        text = (
-            "📍 <b>Share your location</b>\n\n"
-            "For better matching, share your location.\n"
-            "Or choose your sub-city."
-        )
+    text = t(data["language"], "ask_location")
     
     await callback.message.edit_text(
         text,
@@ -665,10 +3777,7 @@ async def choose_subcity_callback(callback: CallbackQuery, state: FSMContext):
     """Handle sub-city selection"""
     data = await state.get_data()
     
-    if data["language"] == "am":
-        text = "🏙 <b>ንኡስ ከተማህን ምረጥ።</b>"
-    else:
-        text = "🏙 <b>Choose your sub-city.</b>"
+    text = t(data["language"], "ask_subcity")
     
     await callback.message.edit_text(
         text,
@@ -694,18 +3803,7 @@ async def process_subcity(callback: CallbackQuery, state: FSMContext):
 
 async def process_location_next_step(message: Message, data: dict):
     """Proceed to interests after location"""
-    if data["language"] == "am":
-        text = (
-            "🎯 <b>ፍላጎቶችህን ምረጥ</b>\n\n"
-            "በታች ካሉት ውስጥ የሚያስደስትህን ምረጥ።\n"
-            "ብዙ ማረግ ትችላለህ። ሲጨርስ 'ተጠናቅቋል' የሚለውን ይጫኑ።"
-        )
-    else:
-        text = (
-            "🎯 <b>Choose your interests</b>\n\n"
-            "Select what interests you from below.\n"
-            "You can select multiple. Press 'Done' when finished."
-        )
+    text = t(data["language"], "ask_interests")
     
     if isinstance(message, Message):
         await message.answer(
@@ -748,18 +3846,7 @@ async def process_interests_done(callback: CallbackQuery, state: FSMContext):
     """Finish interests selection"""
     data = await state.get_data()
     
-    if data["language"] == "am":
-        text = (
-            "📸 <b>ፎቶህን ላክ</b>\n\n"
-            "ለመልክህ ጥሩ ፎቶ ላክ።\n"
-            "አንድ ፎቶ በቂ ነው።"
-        )
-    else:
-        text = (
-            "📸 <b>Send your photo</b>\n\n"
-            "Send a clear photo of yourself.\n"
-            "One photo is enough for now."
-        )
+    text = t(data["language"], "ask_photo", max_photos=PROFILE_MAX_PHOTOS)
     
     await callback.message.edit_text(text)
     await state.set_state(RegistrationStates.photo)
@@ -767,39 +3854,46 @@ async def process_interests_done(callback: CallbackQuery, state: FSMContext):
 
 @router.message(RegistrationStates.photo, F.photo)
 async def process_photo(message: Message, state: FSMContext):
-    """Handle photo upload"""
-    photo = message.photo[-1]
-    photo_id = photo.file_id
-    
-    await state.update_data(photo_id=photo_id)
+    """Collect up to PROFILE_MAX_PHOTOS photos"""
     data = await state.get_data()
+    photo_ids = data.get("photo_ids", [])
+    if len(photo_ids) >= PROFILE_MAX_PHOTOS:
+        return
+    photo_ids.append(message.photo[-1].file_id)
+    await state.update_data(photo_ids=photo_ids, last_media_group=message.media_group_id)
     
-    if data["language"] == "am":
-        text = (
-            "📝 <b>ራስህን አስተዋውቅ</b>\n\n"
-            "አጭር መግለጫ ፅፍ (ከ 500 ፊደላት በታች)።\n"
-            "ምን ይፈልጋሉ? ምን ያስደስትዎታል?\n\n"
-            "ለምሳሌ: 'የቴክ ተንኮለኛ፣ ቡና አፍቃሪ፣ ሙዚቃ እና ጉዞ ወዳድ'"
-        )
-    else:
-        text = (
-            "📝 <b>Introduce yourself</b>\n\n"
-            "Write a short bio (under 500 characters).\n"
-            "What are you looking for? What makes you happy?\n\n"
-            "Example: 'Tech enthusiast, coffee lover, enjoy music and travel'"
-        )
+    if len(photo_ids) >= PROFILE_MAX_PHOTOS:
+        await ask_bio(message, state, data["language"])
+        return
+    # An album arrives as one update per photo; prompt once per album
+    if message.media_group_id and message.media_group_id == data.get("last_media_group"):
+        return
+    
+    text = t(data["language"], "photo_saved", count=len(photo_ids), max_photos=PROFILE_MAX_PHOTOS)
+    await message.answer(text, reply_markup=get_photos_done_keyboard(data["language"]))
+
+@router.callback_query(RegistrationStates.photo, F.data == "photos_done")
+async def process_photos_done(callback: CallbackQuery, state: FSMContext):
+    """Finish the photo step"""
+    data = await state.get_data()
+    await ask_bio(callback.message, state, data["language"])
+    await callback.answer()
+
+async def ask_bio(message: Message, state: FSMContext, language: str):
+    """Move registration on to the bio step"""
+    text = t(language, "ask_bio")
     
     await message.answer(text)
     await state.set_state(RegistrationStates.bio)
 
-@router.message(RegistrationStates.bio)
+# Album photos past PROFILE_MAX_PHOTOS arrive after the state moved to
+# bio; without F.text they would land here
+@router.message(RegistrationStates.bio, F.text)
 async def process_bio(message: Message, state: FSMContext):
     """Handle bio input and complete registration"""
     if len(message.text) > 500:
-        if data["language"] == "am":
-            await message.answer("መግለጫው በጣም ረጅም ነው። 500 ፊደላት ብቻ።")
-        else:
-            await message.answer("Bio is too long. Maximum 500 characters.")
+        data = await state.get_data()
+        await message.answer(t(data["language"], "bio_too_long"))
         return
     
     await state.update_data(bio=message.text)
@@ -820,7 +3914,8 @@ async def process_bio(message: Message, state: FSMContext):
         "latitude": data.get("latitude"),
         "longitude": data.get("longitude"),
         "sub_city": data.get("sub_city"),
-        "main_photo_id": data.get("photo_id"),
+        "photo_ids": data.get("photo_ids", []),
+        "main_photo_id": (data.get("photo_ids") or [None])[0],
         "bio": data.get("bio")
     }
     
@@ -830,27 +3925,10 @@ async def process_bio(message: Message, state: FSMContext):
     if "interests" in data:
         await add_user_interests(message.from_user.id, data["interests"])
     
+    spawn(fan_out_nearby_alert(message.from_user.id))
+    
     # Send welcome message
-    if data["language"] == "am":
-        text = (
-            "🎉 <b>ምዝገባው ተጠናቅቋል!</b>\n\n"
-            "አሁን በአካባቢህ ያሉ ሰዎችን ማየት ትችላለህ።\n\n"
-            "ጠቃሚ ማስታወሻዎች፦\n"
-            "• /start - ዋና ገጽ\n"
-            "• /help - እገዛ\n"
-            "• /safety - ደህንነት ምክሮች\n"
-            "• /report - ሰውን ሪፖርት ማድረግ"
-        )
-    else:
-        text = (
-            "🎉 <b>Registration Complete!</b>\n\n"
-            "You can now browse people in your area.\n\n"
-            "Useful commands:\n"
-            "• /start - Main menu\n"
-            "• /help - Get help\n"
-            "• /safety - Safety tips\n"
-            "• /report - Report a user"
-        )
+    text = t(data["language"], "registration_complete")
     
     await message.answer(
         text,
@@ -861,18 +3939,7 @@ async def process_bio(message: Message, state: FSMContext):
 # ============= MAIN MENU HANDLERS =============
 async def show_main_menu(message: Message, language: str = "en"):
     """Show main menu"""
-    if language == "am":
-        text = (
-            "🏠 <b>ዋና ገጽ - ሀበሻ ማች</b>\n\n"
-            "አዲስ ሰዎችን ያግኙ፣ ያግኙ እና ይተዋወቁ።\n\n"
-            "ከታች ያለውን ይምረጡ፦"
-        )
-    else:
-        text = (
-            "🏠 <b>Main Menu - Habesha Match</b>\n\n"
-            "Discover new people, match, and connect.\n\n"
-            "Choose an option below:"
-        )
+    text = t(language, "main_menu")
     
     await message.answer(
         text,
@@ -880,219 +3947,425 @@ async def show_main_menu(message: Message, language: str = "en"):
     )
 
 @router.callback_query(F.data == "main_menu")
-async def back_to_main(callback: CallbackQuery):
+async def back_to_main(callback: CallbackQuery, user: Optional[dict]):
     """Return to main menu"""
-    user = await get_user(callback.from_user.id)
     lang = user["language"] if user else "en"
     await show_main_menu(callback.message, lang)
     await callback.answer()
 
 @router.callback_query(F.data == "browse")
-async def browse_profiles(callback: CallbackQuery):
+async def browse_profiles(callback: CallbackQuery, user: Optional[dict] = None):
     """Browse nearby profiles"""
-    user = await get_user(callback.from_user.id)
+    if user is None:
+        user = await get_user(callback.from_user.id)
     if not user:
-        await callback.answer("Please register first with /start")
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
         return
     
     # Check rate limiting
-    if user["likes_today"] >= 50 and not user["is_premium"]:
-        if user["language"] == "am":
-            await callback.answer("የዛሬው ገደብ አልቋል። ነገ ይሞክሩ።")
-        else:
-            await callback.answer("Daily limit reached. Try tomorrow.")
+    if await like_quota_exhausted(user):
+        await callback.answer(t(user["language"], "daily_limit"))
         return
     
-    nearby_users = await get_nearby_users(callback.from_user.id, limit=1)
+    profile = await next_candidate(user)
     
-    if not nearby_users:
-        if user["language"] == "am":
-            await callback.message.answer("በአካባቢህ ምንም ሰዎች የሉም። ቆየት እና እንደገና ሞክር።")
-        else:
-            await callback.message.answer("No people in your area. Wait and try again.")
+    if not profile:
+        await callback.message.answer(t(user["language"], "no_candidates"))
         await callback.answer()
         return
     
-    profile = nearby_users[0]
+    card = await get_profile_card(profile, user["language"])
+    caption = card_caption(card, profile.get("distance_km"))
+    keyboard = InlineKeyboardMarkup.model_validate(card["reply_markup"])
     
-    # Create profile display
-    caption_parts = []
+    sent = False
+    if card["photo_id"]:
+        try:
+            await callback.message.answer_photo(photo=card["photo_id"], caption=caption, reply_markup=keyboard)
+            sent = True
+        except TelegramBadRequest as e:
+            # Stale file_id: remember it so nobody pays this round trip again
+            if is_bad_file_error(e):
+                await mark_photo_bad(card["photo_id"], profile["id"])
+            else:
+                logger.warning("Profile photo of %s not sent: %s", profile["id"], e)
+    if not sent:
+        await callback.message.answer(caption, reply_markup=keyboard)
     
-    # Name and age
-    if profile["age"]:
-        caption_parts.append(f"👤 <b>{profile['full_name']}</b>, {profile['age']}")
-    else:
-        caption_parts.append(f"👤 <b>{profile['full_name']}</b>")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("album_"))
+async def show_album(callback: CallbackQuery, user: Optional[dict]):
+    """Send a profile's remaining photos as one media group"""
+    profile_id = int(callback.data.split("_")[1])
+    if not user:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+        return
+    if await is_blocked_between(user["id"], profile_id):
+        await callback.answer()
+        return
     
-    # Location
-    if profile["sub_city"]:
-        caption_parts.append(f"📍 {profile['sub_city']}")
+    async with get_db_connection() as conn:
+        photo_ids = await conn.fetchval(
+            "SELECT photo_ids FROM users WHERE id = $1 AND is_active", profile_id
+        )
+    photos = (await usable_photos(photo_ids or []))[1:]
+    if not photos:
+        await callback.answer()
+        return
     
-    # Bio
-    if profile["bio"] and len(profile["bio"]) > 0:
-        bio_preview = profile["bio"][:100] + "..." if len(profile["bio"]) > 100 else profile["bio"]
-        caption_parts.append(f"\n{bio_preview}")
+    try:
+        if len(photos) == 1:
+            await callback.message.answer_photo(photo=photos[0])
+        else:
+            await callback.message.answer_media_group(
+                media=[InputMediaPhoto(media=photo_id) for photo_id in photos]
+            )
+    except TelegramBadRequest as e:
+        if not is_bad_file_error(e):
+            logger.warning("Album of %s not sent: %s", profile_id, e)
+        else:
+            # Telegram doesn't say which one failed; the revalidator clears
+            # the good ones again
+            for photo_id in photos:
+                await mark_photo_bad(photo_id, profile_id)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("like_"), flags={"once": True})
+async def handle_like(callback: CallbackQuery, user: Optional[dict]):
+    """Handle profile like"""
+    profile_id = int(callback.data.split("_")[1])
     
-    caption = "\n".join(caption_parts)
+    if not user:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+        return
     
-    # Send profile with photo if available
-    if profile["main_photo_id"]:
-        try:
-            await callback.message.answer_photo(
-                photo=profile["main_photo_id"],
-                caption=caption,
-                reply_markup=get_profile_action_keyboard(profile["id"], user["language"])
-            )
-        except:
-            await callback.message.answer(
-                caption,
-                reply_markup=get_profile_action_keyboard(profile["id"], user["language"])
-            )
-    else:
+    if await is_blocked_between(user["id"], profile_id):
+        await callback.answer()
+        await browse_profiles(callback, user)
+        return
+    
+    # Count against today's quota before writing anything
+    if not await consume_like_quota(user):
+        await callback.answer(t(user["language"], "daily_limit"))
+        return
+    
+    # Like, swipe and match in a single database call
+    result = await create_like(callback.from_user.id, profile_id)
+    
+    if not result or not result["is_new_like"]:
+        await release_like_quota(user)
+    if not result:
+        await callback.answer(t(user["language"], "user_not_found"))
+        return
+    
+    await mark_seen(user["id"], profile_id)
+    
+    if result["is_new_match"]:
+        # It's a match!
+        match_text = t(user["language"], "match_found")
         await callback.message.answer(
-            caption,
-            reply_markup=get_profile_action_keyboard(profile["id"], user["language"])
+            match_text,
+            reply_markup=get_chat_reply_keyboard(result["match_id"], user["language"])
         )
+        
+        # Notify the other user
+        if result["target_notify_matches"]:
+            notify_text = t(result["target_language"], "match_notify")
+            
+            await enqueue_message(
+                result["target_telegram_id"],
+                notify_text,
+                dedup_key=f"match:{result['match_id']}",
+                reply_markup=get_chat_reply_keyboard(result["match_id"], result["target_language"])
+            )
+    else:
+        await callback.answer(t(user["language"], "like_sent"))
     
-    await callback.answer()
+    # Show next profile
+    await browse_profiles(callback, user)
 
-@router.callback_query(F.data.startswith("like_"))
-async def handle_like(callback: CallbackQuery):
-    """Handle profile like"""
+@router.callback_query(F.data.startswith("dislike_"), flags={"once": True})
+async def handle_dislike(callback: CallbackQuery, user: Optional[dict]):
+    """Handle profile dislike - record it and show next"""
+    profile_id = int(callback.data.split("_")[1])
+    if user:
+        await record_swipe(user["id"], profile_id, "dislike")
+        await browse_profiles(callback, user)
+    else:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+
+@router.callback_query(F.data.startswith("skip_"), flags={"once": True})
+async def handle_skip(callback: CallbackQuery, user: Optional[dict]):
+    """Handle profile skip - hide it without a verdict and show next"""
     profile_id = int(callback.data.split("_")[1])
-    user = await get_user(callback.from_user.id)
+    if user:
+        await record_swipe(user["id"], profile_id, "skip")
+        await browse_profiles(callback, user)
+    else:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+
+@router.callback_query(F.data == "matches")
+@router.callback_query(F.data.startswith("mpage_"))
+async def show_matches(callback: CallbackQuery, user: Optional[dict]):
+    """Show one page of the user's matches"""
+    if not user:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+        return
+    
+    # callback_data: "matches" for the first page, else mpage_{o|n}_{cursor}
+    cursor, newer = None, False
+    if callback.data.startswith("mpage_"):
+        _, direction, encoded = callback.data.split("_", 2)
+        cursor, newer = decode_cursor(encoded), direction == "n"
+    
+    rows = await get_matches_page(
+        user["id"], cursor, newer, MATCHES_PAGE + 1,
+        blocked_ids=await get_blocked_ids(user["id"])
+    )
+    # The extra row only tells whether there is a page beyond this one
+    has_beyond = len(rows) > MATCHES_PAGE
+    if newer:
+        matches = rows[-MATCHES_PAGE:]
+        has_newer, has_older = has_beyond, True
+    else:
+        matches = rows[:MATCHES_PAGE]
+        has_newer, has_older = cursor is not None, has_beyond
+    
+    if not matches:
+        await callback.message.answer(t(user["language"], "no_matches"))
+        await callback.answer()
+        return
+    
+    text = t(user["language"], "matches_header")
+    
+    buttons = []
+    for match in matches:
+        text += f"• <b>{html.escape(match['full_name'])}</b>"
+        if match["age"]:
+            text += f", {match['age']}"
+        if match["sub_city"]:
+            text += f" - {match['sub_city']}"
+        text += "\n"
+        buttons.append([InlineKeyboardButton(
+            text=f"💬 {match['full_name']}", callback_data=f"chat_{match['match_id']}"
+        )])
+    
+    nav = []
+    if has_newer:
+        first = matches[0]
+        nav.append(InlineKeyboardButton(
+            text="⬅️", callback_data=f"mpage_n_{encode_cursor(first['matched_at'], first['match_id'])}"
+        ))
+    if has_older:
+        last = matches[-1]
+        nav.append(InlineKeyboardButton(
+            text="➡️", callback_data=f"mpage_o_{encode_cursor(last['matched_at'], last['match_id'])}"
+        ))
+    if nav:
+        buttons.append(nav)
+    markup = InlineKeyboardMarkup(inline_keyboard=buttons)
+    
+    if cursor is None:
+        await callback.message.answer(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+# ============= CHAT HANDLERS =============
+# Registered before the free-text report handler, which takes any text
+@router.callback_query(F.data.startswith("chat_"))
+async def open_chat(callback: CallbackQuery, state: FSMContext, user: Optional[dict]):
+    """Start relaying this user's messages to a match"""
+    if not user:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+        return
     
+    match_id = int(callback.data.split("_")[1])
+    peer = await get_chat_peer(user["id"], match_id)
+    if not peer or await is_blocked_between(user["id"], peer["id"]):
+        await callback.answer(t(user["language"], "chat_unavailable"))
+        return
+    
+    await state.set_state(ChatStates.chatting)
+    await state.set_data({
+        "match_id": match_id,
+        "peer_id": peer["id"],
+        "peer_telegram_id": peer["telegram_id"],
+        "peer_language": peer["language"]
+    })
+    
+    name = html.escape(peer["full_name"])
+    text = t(user["language"], "chat_opened", name=name)
+    await callback.message.answer(text, reply_markup=get_chat_keyboard(match_id, peer["id"], user["language"]))
+    await callback.answer()
+
+async def close_chat(message: Message, state: FSMContext, language: str):
+    """Leave chat mode and return to the main menu"""
+    await state.clear()
+    await message.answer(t(language, "chat_closed"))
+    await show_main_menu(message, language)
+
+@router.message(ChatStates.chatting, Command("end"))
+async def end_chat_command(message: Message, state: FSMContext, user: Optional[dict]):
+    """Leave chat mode with /end"""
+    await close_chat(message, state, user["language"] if user else "en")
+
+@router.callback_query(F.data == "chatend")
+async def end_chat(callback: CallbackQuery, state: FSMContext, user: Optional[dict]):
+    """Leave chat mode from the button"""
+    await close_chat(callback.message, state, user["language"] if user else "en")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("chathist_"))
+async def show_chat_history(callback: CallbackQuery, user: Optional[dict]):
+    """Show one page of history; the cursor is the oldest id shown"""
     if not user:
-        await callback.answer("Please register first")
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+        return
+    
+    _, match_id, before_id = callback.data.split("_")
+    match_id, before_id = int(match_id), int(before_id) or None
+    peer = await get_chat_peer(user["id"], match_id)
+    if not peer:
+        await callback.answer()
         return
     
-    # Get target user telegram_id
-    conn = await get_db_connection()
-    target_user = await conn.fetchrow(
-        "SELECT telegram_id FROM users WHERE id = $1",
-        profile_id
-    )
-    await conn.close()
+    if before_id is None:
+        # The newest messages may still be in the write buffer
+        await flush_chat_messages()
+    rows = await get_chat_history(match_id, before_id, CHAT_HISTORY_PAGE + 1)
+    has_more = len(rows) > CHAT_HISTORY_PAGE
+    rows = rows[:CHAT_HISTORY_PAGE]
     
-    if not target_user:
-        await callback.answer("User not found")
+    if not rows:
+        await callback.answer(t(user["language"], "chat_history_empty"))
         return
     
-    # Create like and check for match
-    is_match = await create_like(callback.from_user.id, target_user["telegram_id"])
-    
-    if is_match:
-        # It's a match!
-        if user["language"] == "am":
-            match_text = "🎉 <b>ተመሳሳይነት ተገኘ!</b>\n\nአሁን መልዕክት መላክ ትችላላችሁ።"
-            await callback.message.answer(match_text)
-            
-            # Notify the other user
-            other_user = await get_user(target_user["telegram_id"])
-            if other_user and other_user["notify_matches"]:
-                if other_user["language"] == "am":
-                    notify_text = "🎉 <b>አዲስ ተመሳሳይነት!</b>\n\nአሁን መልዕክት መላክ ትችላላችሁ።"
-                else:
-                    notify_text = "🎉 <b>New Match!</b>\n\nYou can now send messages."
-                
-                try:
-                    await bot.send_message(
-                        chat_id=target_user["telegram_id"],
-                        text=notify_text
-                    )
-                except:
-                    pass
-        else:
-            match_text = "🎉 <b>It's a Match!</b>\n\nYou can now send messages."
-            await callback.message.answer(match_text)
-            
-            # Notify the other user
-            other_user = await get_user(target_user["telegram_id"])
-            if other_user and other_user["notify_matches"]:
-                try:
-                    await bot.send_message(
-                        chat_id=target_user["telegram_id"],
-                        text="🎉 <b>New Match!</b>\n\nYou can now send messages."
-                    )
-                except:
-                    pass
-    else:
-        if user["language"] == "am":
-            await callback.answer("👍 አስተያየት ተልኳል")
-        else:
-            await callback.answer("👍 Like sent")
+    you = t(user["language"], "you")
+    lines = []
+    for row in reversed(rows):
+        sender = you if row["sender_id"] == user["id"] else html.escape(peer["full_name"])
+        body = html.escape(row["message"]) if row["kind"] == "text" else f"[{row['kind']}] {html.escape(row['message'])}"
+        lines.append(f"<b>{sender}</b> · {row['created_at']:%d/%m %H:%M}\n{body}")
     
-    # Show next profile
-    await browse_profiles(callback)
+    buttons = []
+    if has_more:
+        older = t(user["language"], "btn_older")
+        buttons.append([InlineKeyboardButton(
+            text=older, callback_data=f"chathist_{match_id}_{rows[-1]['id']}"
+        )])
+    await callback.message.answer(
+        "\n\n".join(lines),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
+    )
+    await callback.answer()
 
-@router.callback_query(F.data.startswith("dislike_"))
-async def handle_dislike(callback: CallbackQuery):
-    """Handle profile dislike - just show next"""
-    if await get_user(callback.from_user.id):
-        await browse_profiles(callback)
+@router.message(ChatStates.chatting, ~F.text.startswith("/"))
+async def relay_chat_message(message: Message, state: FSMContext, user: Optional[dict]):
+    """Forward a message to the match and buffer it for chat_messages"""
+    fields = chat_message_fields(message)
+    if not user or not fields:
+        await message.answer(t(user["language"] if user else DEFAULT_LANGUAGE, "chat_unsupported"))
+        return
+    
+    data = await state.get_data()
+    if await is_blocked_between(user["id"], data["peer_id"]):
+        await close_chat(message, state, user["language"])
+        return
+    
+    kind, text, file_id = fields
+    markup = get_chat_reply_keyboard(data["match_id"], data["peer_language"])
+    if kind == "text":
+        await enqueue_message(
+            data["peer_telegram_id"],
+            f"💬 <b>{html.escape(user['full_name'])}</b>\n{html.escape(text)}",
+            reply_markup=markup
+        )
     else:
-        await callback.answer("Please register first")
+        await enqueue_message(
+            data["peer_telegram_id"],
+            method="copy_message",
+            from_chat_id=message.chat.id,
+            message_id=message.message_id,
+            reply_markup=markup
+        )
+    await queue_chat_message(data["match_id"], user["id"], kind, text, file_id)
 
-@router.callback_query(F.data == "matches")
-async def show_matches(callback: CallbackQuery):
-    """Show user's matches"""
-    user = await get_user(callback.from_user.id)
+# ============= BLOCK HANDLERS =============
+@router.callback_query(F.data.startswith("block_"), flags={"once": True})
+async def handle_block(callback: CallbackQuery, state: FSMContext, user: Optional[dict]):
+    """Block a profile from a browse card or an open chat"""
     if not user:
-        await callback.answer("Please register first")
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
         return
     
-    matches = await get_user_matches(callback.from_user.id)
-    
-    if not matches:
-        if user["language"] == "am":
-            await callback.message.answer("🤷‍♂️ <b>እስካሁን ምንም ተመሳሳይነት የለም</b>\n\nሰዎችን ይመልከቱ እና አስተያየት ይስጡ።")
-        else:
-            await callback.message.answer("🤷‍♂️ <b>No matches yet</b>\n\nBrowse people and send likes.")
+    blocked_id = int(callback.data.split("_")[1])
+    if blocked_id == user["id"]:
         await callback.answer()
         return
+    await block_user(user["id"], blocked_id)
     
-    if user["language"] == "am":
-        text = "💌 <b>ተመሳሳይነቶችህ</b>\n\n"
+    await callback.answer(t(user["language"], "blocked_toast"))
+    data = await state.get_data()
+    if data.get("peer_id") == blocked_id:
+        await close_chat(callback.message, state, user["language"])
     else:
-        text = "💌 <b>Your Matches</b>\n\n"
-    
-    for i, match in enumerate(matches[:10], 1):  # Show first 10 matches
-        text += f"{i}. <b>{match['full_name']}</b>"
-        if match["age"]:
-            text += f", {match['age']}"
-        if match["sub_city"]:
-            text += f" - {match['sub_city']}"
-        text += "\n"
-    
-    await callback.message.answer(text)
+        await browse_profiles(callback, user)
+
+async def render_blocked_list(user: dict):
+    """Text and unblock buttons for the user's block list"""
+    rows = await get_blocked_users(user["id"])
+    text = t(user["language"], "blocked_header") + t(user["language"], "blocked_hint" if rows else "blocked_empty")
+    buttons = [
+        [InlineKeyboardButton(text=f"↩️ {row['full_name']}", callback_data=f"unblock_{row['id']}")]
+        for row in rows
+    ]
+    buttons.append([InlineKeyboardButton(
+        text=t(user["language"], "btn_back_settings"),
+        callback_data="settings"
+    )])
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@router.callback_query(F.data == "blocked")
+async def show_blocked(callback: CallbackQuery, user: Optional[dict]):
+    """List blocked profiles"""
+    if not user:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+        return
+    text, markup = await render_blocked_list(user)
+    await callback.message.answer(text, reply_markup=markup)
     await callback.answer()
 
+@router.callback_query(F.data.startswith("unblock_"))
+async def handle_unblock(callback: CallbackQuery, user: Optional[dict]):
+    """Unblock a profile and refresh the list"""
+    if not user:
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
+        return
+    await unblock_user(user["id"], int(callback.data.split("_")[1]))
+    text, markup = await render_blocked_list(user)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer("✅")
+
+def settings_text(user: dict, lang: str) -> str:
+    """Settings summary for a user, rendered in lang"""
+    return t(
+        lang, "settings",
+        language=t(lang, f"language_name_{user['language']}"),
+        location=user["sub_city"] or t(lang, "not_set"),
+        stealth=t(lang, "stealth_on" if user["is_stealth"] else "stealth_off"),
+        notifications=t(lang, "notify_on" if user["notify_matches"] else "notify_off")
+    )
+
 @router.callback_query(F.data == "settings")
-async def show_settings(callback: CallbackQuery):
+async def show_settings(callback: CallbackQuery, user: Optional[dict]):
     """Show settings menu"""
-    user = await get_user(callback.from_user.id)
     if not user:
-        await callback.answer("Please register first")
+        await callback.answer(t(DEFAULT_LANGUAGE, "register_first"))
         return
     
-    if user["language"] == "am":
-        text = (
-            "⚙️ <b>ማስተካከያዎች</b>\n\n"
-            f"• ቋንቋ: {'አማርኛ' if user['language'] == 'am' else 'English'}\n"
-            f"• አካባቢ: {user['sub_city'] or 'Not set'}\n"
-            f"• ስልክ ሁነት: {'ደብቅ' if user['is_stealth'] else 'ተገልጦ'}\n"
-            f"• ማሳወቂያዎች: {'አንብ' if user['notify_matches'] else 'ጠፋ'}\n\n"
-            "ከታች ለመቀየር ይምረጡ፦"
-        )
-    else:
-        text = (
-            "⚙️ <b>Settings</b>\n\n"
-            f"• Language: {'Amharic' if user['language'] == 'am' else 'English'}\n"
-            f"• Location: {user['sub_city'] or 'Not set'}\n"
-            f"• Stealth Mode: {'On' if user['is_stealth'] else 'Off'}\n"
-            f"• Notifications: {'On' if user['notify_matches'] else 'Off'}\n\n"
-            "Select below to change:"
-        )
+    text = settings_text(user, user["language"])
     
     await callback.message.edit_text(
         text,
@@ -1101,9 +4374,8 @@ async def show_settings(callback: CallbackQuery):
     await callback.answer()
 
 @router.callback_query(F.data == "change_language")
-async def change_language(callback: CallbackQuery):
+async def change_language(callback: CallbackQuery, user: Optional[dict]):
     """Change language"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer()
         return
@@ -1111,23 +4383,16 @@ async def change_language(callback: CallbackQuery):
     new_lang = "am" if user["language"] == "en" else "en"
     await update_user(callback.from_user.id, language=new_lang)
     
-    if new_lang == "am":
-        await callback.message.edit_text(
-            "✅ ቋንቋ ወደ አማርኛ ተቀይሯል",
-            reply_markup=get_settings_keyboard(new_lang)
-        )
-    else:
-        await callback.message.edit_text(
-            "✅ Language changed to English",
-            reply_markup=get_settings_keyboard(new_lang)
-        )
+    await callback.message.edit_text(
+        t(new_lang, "language_changed"),
+        reply_markup=get_settings_keyboard(new_lang)
+    )
     
     await callback.answer()
 
 @router.callback_query(F.data == "toggle_stealth")
-async def toggle_stealth(callback: CallbackQuery):
+async def toggle_stealth(callback: CallbackQuery, user: Optional[dict]):
     """Toggle stealth mode"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer()
         return
@@ -1135,39 +4400,22 @@ async def toggle_stealth(callback: CallbackQuery):
     new_stealth = not user["is_stealth"]
     await update_user(callback.from_user.id, is_stealth=new_stealth)
     
-    if user["language"] == "am":
-        status = "ደብቅ" if new_stealth else "ተገልጦ"
-        await callback.message.edit_text(
-            f"✅ ስልክ ሁነት: {status}",
-            reply_markup=get_settings_keyboard(user["language"])
-        )
-    else:
-        status = "On" if new_stealth else "Off"
-        await callback.message.edit_text(
-            f"✅ Stealth Mode: {status}",
-            reply_markup=get_settings_keyboard(user["language"])
-        )
+    status = t(user["language"], "stealth_on" if new_stealth else "stealth_off")
+    await callback.message.edit_text(
+        t(user["language"], "stealth_toggled", status=status),
+        reply_markup=get_settings_keyboard(user["language"])
+    )
     
     await callback.answer()
 
 @router.callback_query(F.data == "update_location")
-async def update_location_start(callback: CallbackQuery, state: FSMContext):
+async def update_location_start(callback: CallbackQuery, state: FSMContext, user: Optional[dict]):
     """Start location update"""
-    user = await get_user(callback.from_user.id)
     if not user:
         await callback.answer()
         return
     
-    if user["language"] == "am":
-        text = (
-            "📍 <b>አዲስ አካባቢ አስገባ</b>\n\n"
-            "አሁን አካባቢህን ላክ ወይም ንኡስ ከተማ ምረጥ።"
-        )
-    else:
-        text = (
-            "📍 <b>Update Location</b>\n\n"
-            "Share your current location or choose sub-city."
-        )
+    text = t(user["language"], "update_location")
     
     await callback.message.edit_text(
         text,
@@ -1187,10 +4435,7 @@ async def update_location_gps(message: Message, state: FSMContext):
     )
     
     user = await get_user(message.from_user.id)
-    if user["language"] == "am":
-        await message.answer("✅ አካባቢ ተዘምኗል")
-    else:
-        await message.answer("✅ Location updated")
+    await message.answer(t(user["language"], "location_updated"))
     
     await state.clear()
     await show_settings_from_message(message, user["language"])
@@ -1201,24 +4446,7 @@ async def show_settings_from_message(message: Message, language: str):
     if not user:
         return
     
-    if language == "am":
-        text = (
-            "⚙️ <b>ማስተካከያዎች</b>\n\n"
-            f"• ቋንቋ: {'አማርኛ' if user['language'] == 'am' else 'English'}\n"
-            f"• አካባቢ: {user['sub_city'] or 'Not set'}\n"
-            f"• ስልክ ሁነት: {'ደብቅ' if user['is_stealth'] else 'ተገልጦ'}\n"
-            f"• ማሳወቂያዎች: {'አንብ' if user['notify_matches'] else 'ጠፋ'}\n\n"
-            "ከታች ለመቀየር ይምረጡ፦"
-        )
-    else:
-        text = (
-            "⚙️ <b>Settings</b>\n\n"
-            f"• Language: {'Amharic' if user['language'] == 'am' else 'English'}\n"
-            f"• Location: {user['sub_city'] or 'Not set'}\n"
-            f"• Stealth Mode: {'On' if user['is_stealth'] else 'Off'}\n"
-            f"• Notifications: {'On' if user['notify_matches'] else 'Off'}\n\n"
-            "Select below to change:"
-        )
+    text = settings_text(user, language)
     
     await message.answer(
         text,
@@ -1226,176 +4454,72 @@ async def show_settings_from_message(message: Message, language: str):
     )
 
 @router.callback_query(F.data == "help")
-async def show_help(callback: CallbackQuery):
+async def show_help(callback: CallbackQuery, user: Optional[dict]):
     """Show help menu"""
-    user = await get_user(callback.from_user.id)
     lang = user["language"] if user else "en"
     
-    if lang == "am":
-        text = (
-            "🆘 <b>እገዛ እና ደህንነት</b>\n\n"
-            "<b>ዋና ትዕዛዞች፦</b>\n"
-            "/start - ዋና ገጽ\n"
-            "/help - ይህን መልዕክት\n"
-            "/safety - ደህንነት ምክሮች\n"
-            "/report - ሰውን ሪፖርት ማድረግ\n\n"
-            "<b>ደህንነት ምክሮች፦</b>\n"
-            "1. ለመጀመሪያ ጊዜ በህዝባዊ ቦታ ተገናኝ\n"
-            "2. የራስህን መረጃ አላማጭ\n"
-            "3. አስቀድመህ ስልክ ቁጥር አትስጥ\n"
-            "4. አለመስማማት ከተገኘ ወዲያ አቁም\n"
-            "5. ጠያቂ ከሆነ ወዲያ ሪፖርት አርግ\n\n"
-            "<b>ለሪፖርት፦</b>\n"
-            "አንድን ሰው ለሪፖርት ማድረግ ከፈለጉ በመገለጫው ላይ 'ሪፖርት' የሚለውን ይጫኑ።"
-        )
-    else:
-        text = (
-            "🆘 <b>Help & Safety</b>\n\n"
-            "<b>Main Commands:</b>\n"
-            "/start - Main menu\n"
-            "/help - This message\n"
-            "/safety - Safety tips\n"
-            "/report - Report a user\n\n"
-            "<b>Safety Tips:</b>\n"
-            "1. Meet first time in public places\n"
-            "2. Don't share personal information quickly\n"
-            "3. Don't give phone number before meeting\n"
-            "4. Stop if uncomfortable\n"
-            "5. Report suspicious behavior immediately\n\n"
-            "<b>To Report:</b>\n"
-            "Click 'Report' button on any profile to report a user."
-        )
+    text = t(lang, "help")
     
     await callback.message.edit_text(
         text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(
-                text="↩️ ወደ ዋና" if lang == "am" else "↩️ Back to Main",
-                callback_data="main_menu"
-            )]
-        ])
+        reply_markup=get_help_keyboard(lang)
     )
     await callback.answer()
 
 @router.message(Command("safety"))
-async def cmd_safety(message: Message):
+async def cmd_safety(message: Message, user: Optional[dict]):
     """Safety tips command"""
-    user = await get_user(message.from_user.id)
     lang = user["language"] if user else "en"
     
-    if lang == "am":
-        text = (
-            "🛡️ <b>ደህንነት ምክሮች</b>\n\n"
-            "<b>በአዲስ አበባ ሰዎችን ሲገናኙ፦</b>\n\n"
-            "✅ <b>የሚያደርጉት፦</b>\n"
-            "• ለመጀመሪያ ጊዜ በቡና ቤት ወይም ማል ውስጥ ተገናኝ\n"
-            "• አጋር ወዳጅ ይዘው መምጣትን ይጠይቁ\n"
-            "• የተወሰነ የጊዜ ገደብ ያዘጋጁ\n"
-            "• በቀን እና በብሩህ ቦታ ተገናኝ\n\n"
-            "❌ <b>የማትደርጉት፦</b>\n"
-            "• የቤት አድራሻ አትስጡ\n"
-            "• በመጀመሪያ ቀን ብዙ ገንዘብ አትውሰዱ\n"
-            "• ወደ ሰላሳ ቦታዎች አትሂዱ\n"
-            "• ጠመንጃ ወይም መድሃኒት ተሳትፎ ካለ ወዲያ ይቅረቡ\n\n"
-            "🔔 <b>ማስታወሻ፦</b>\n"
-            "ማንኛውም ጠያቂ ባህሪ ወዲያውኑ ሪፖርት ያድርጉ።"
-        )
-    else:
-        text = (
-            "🛡️ <b>Safety Tips for Dating in Addis</b>\n\n"
-            "<b>When meeting new people in Addis Ababa:</b>\n\n"
-            "✅ <b>Do:</b>\n"
-            "• Meet first time in coffee shops or malls\n"
-            "• Ask to bring a friend along\n"
-            "• Set specific time limits\n"
-            "• Meet during daytime in well-lit areas\n\n"
-            "❌ <b>Don't:</b>\n"
-            "• Give out home address\n"
-            "• Carry large amounts of money on first date\n"
-            "• Go to remote locations\n"
-            "• Engage if drugs or weapons are involved\n\n"
-            "🔔 <b>Remember:</b>\n"
-            "Report any suspicious behavior immediately."
-        )
+    text = t(lang, "safety")
     
     await message.answer(text)
 
 @router.callback_query(F.data.startswith("report_"))
-async def report_user(callback: CallbackQuery, state: FSMContext):
+async def report_user(callback: CallbackQuery, state: FSMContext, user: Optional[dict]):
     """Report a user"""
     profile_id = int(callback.data.split("_")[1])
-    user = await get_user(callback.from_user.id)
     
     if not user:
         await callback.answer()
         return
+    if profile_id == user["id"]:
+        await callback.answer(t(user["language"], "report_self"))
+        return
     
     # Store reported user ID in state
+    await state.set_state(ReportStates.reason)
     await state.update_data(reported_id=profile_id)
     
-    if user["language"] == "am":
-        text = (
-            "⚠️ <b>ሪፖርት ማድረግ</b>\n\n"
-            "ለምን ይህን ሰው ሪፖርት ማድረግ ትፈልጋለህ?\n\n"
-            "ምርጫዎች፦\n"
-            "1. ጠቃሚ ወይም አስጸያፊ ቋንቋ\n"
-            "2. ሐሰተኛ መረጃ\n"
-            "3. ጠያቂ ባህሪ\n"
-            "4. አለመስማማት\n"
-            "5. ሌላ\n\n"
-            "ምክንያቱን ፅፍ፦"
-        )
-    else:
-        text = (
-            "⚠️ <b>Report User</b>\n\n"
-            "Why are you reporting this user?\n\n"
-            "Options:\n"
-            "1. Offensive or abusive language\n"
-            "2. False information\n"
-            "3. Suspicious behavior\n"
-            "4. Harassment\n"
-            "5. Other\n\n"
-            "Write the reason:"
-        )
+    text = t(user["language"], "report_prompt")
     
-    await callback.message.edit_text(text)
+    # The card is a photo message, so ask in a new one
+    await callback.message.answer(text)
     await callback.answer()
 
-@router.message(F.text)
-async def handle_report_reason(message: Message, state: FSMContext):
+@router.message(ReportStates.reason, F.text)
+async def handle_report_reason(message: Message, state: FSMContext, user: Optional[dict]):
     """Handle report reason"""
     data = await state.get_data()
     reported_id = data.get("reported_id")
     
-    if reported_id:
-        user = await get_user(message.from_user.id)
-        if user:
-            # Save report to database
-            conn = await get_db_connection()
-            await conn.execute("""
-                INSERT INTO reports (reporter_id, reported_id, reason)
-                VALUES ($1, $2, $3)
-            """, user["id"], reported_id, message.text)
-            await conn.close()
-            
-            # Notify admin
-            try:
-                await bot.send_message(
-                    ADMIN_ID,
-                    f"🚨 <b>New User Report</b>\n\n"
-                    f"Reporter: {user['full_name']} (ID: {user['telegram_id']})\n"
-                    f"Reported User ID: {reported_id}\n"
-                    f"Reason: {message.text[:500]}"
-                )
-            except:
-                pass
-            
-            if user["language"] == "am":
-                await message.answer("✅ ሪፖርት ቀርቧል። እናመሰግናለን።")
-            else:
-                await message.answer("✅ Report submitted. Thank you.")
+    if reported_id and user:
+        result = await submit_report(user["id"], reported_id, message.text[:1000])
         
-        await state.clear()
+        # Notify admin
+        hidden_note = "\n\n🙈 Auto-hidden, review with /admin" if result["newly_hidden"] else ""
+        await enqueue_message(
+            ADMIN_ID,
+            f"🚨 <b>New User Report</b>\n\n"
+            f"Reporter: {html.escape(user['full_name'])} (ID: {user['telegram_id']})\n"
+            f"Reported User ID: {reported_id} ({result['reporters']} reporters)\n"
+            f"Reason: {html.escape(message.text[:500])}"
+            f"{hidden_note}"
+        )
+        
+        await message.answer(t(user["language"], "report_submitted"))
+    
+    await state.clear()
 
 # ============= ADMIN COMMANDS =============
 @router.message(Command("admin"))
@@ -1404,88 +4528,390 @@ async def admin_panel(message: Message):
     if message.from_user.id != ADMIN_ID:
         return
     
-    conn = await get_db_connection()
-    stats = await conn.fetchrow("""
-        SELECT 
-            COUNT(*) as total_users,
-            COUNT(CASE WHEN is_active THEN 1 END) as active_users,
-            COUNT(CASE WHEN is_verified THEN 1 END) as verified_users,
-            COUNT(CASE WHEN is_stealth THEN 1 END) as stealth_users,
-            (SELECT COUNT(*) FROM matches) as total_matches,
-            (SELECT COUNT(*) FROM reports) as total_reports
-        FROM users
-    """)
-    await conn.close()
+    stats = await get_stat_counters()
+    series = await get_daily_series()
+    
+    metrics = get_metrics()
+    acquired = metrics.get("db_pool_acquire_total", 0)
+    avg_wait_ms = metrics.get("db_pool_wait_seconds_total", 0) / acquired * 1000 if acquired else 0
+    cache_hits = metrics.get("user_cache_local_hits_total", 0) + metrics.get("user_cache_redis_hits_total", 0)
+    cache_lookups = cache_hits + metrics.get("user_cache_misses_total", 0)
+    cache_hit_rate = cache_hits / cache_lookups * 100 if cache_lookups else 0
     
     text = (
         "👑 <b>Admin Panel - Habesha Match</b>\n\n"
         f"📊 <b>Statistics:</b>\n"
-        f"• Total Users: {stats['total_users']}\n"
-        f"• Active Users: {stats['active_users']}\n"
-        f"• Verified Users: {stats['verified_users']}\n"
-        f"• Stealth Users: {stats['stealth_users']}\n"
-        f"• Total Matches: {stats['total_matches']}\n"
-        f"• Total Reports: {stats['total_reports']}\n\n"
+        f"• Total Users: {stats.get('users', 0)}\n"
+        f"• Active Users: {stats.get('active_users', 0)}\n"
+        f"• Verified Users: {stats.get('verified_users', 0)}\n"
+        f"• Stealth Users: {stats.get('stealth_users', 0)}\n"
+        f"• Total Likes: {stats.get('likes', 0)}\n"
+        f"• Total Matches: {stats.get('matches', 0)}\n"
+        f"• Total Reports: {stats.get('reports', 0)}\n\n"
+        f"📈 <b>Last {STATS_SERIES_DAYS} days</b> (signups/likes/matches/reports):\n"
+        + "".join(
+            f"• {row['day']:%d/%m}: {row['signups']}/{row['likes']}/{row['matches']}/{row['reports']}\n"
+            for row in series
+        ) + "\n"
+        f"🗄 <b>DB Pool:</b>\n"
+        f"• Size: {metrics.get('db_pool_size', 0)}/{metrics.get('db_pool_max_size', 0)} "
+        f"(idle {metrics.get('db_pool_idle', 0)})\n"
+        f"• Avg wait: {avg_wait_ms:.1f} ms, max {metrics.get('db_pool_wait_seconds_max', 0) * 1000:.1f} ms\n"
+        f"• Saturated acquires: {int(metrics.get('db_pool_saturated_total', 0))}\n"
+        f"• Profile cache hit rate: {cache_hit_rate:.1f}% of {int(cache_lookups)}\n\n"
         "<b>Admin Commands:</b>\n"
-        "/stats - Show statistics\n"
+        "/stats [days] - Activity by sub-city\n"
         "/broadcast - Broadcast message\n"
         "/verify [id] - Verify user\n"
         "/ban [id] - Ban user"
     )
     
+    await message.answer(
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🛡 Review reports", callback_data="modq")]
+        ])
+    )
+
+@router.message(Command("stats"))
+async def admin_stats(message: Message):
+    """Per-sub-city activity over the last N days"""
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    parts = message.text.split()
+    days = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else STATS_SERIES_DAYS
+    days = max(1, min(days, 90))
+    rows = await get_sub_city_breakdown(days)
+    
+    text = f"🏙 <b>Activity by sub-city, last {days} days</b>\n(signups/likes/matches/reports)\n\n"
+    for row in rows:
+        text += (
+            f"• {row['sub_city'] or 'Unknown'}: "
+            f"{row['signups']}/{row['likes']}/{row['matches']}/{row['reports']}\n"
+        )
+    if not rows:
+        text += "No activity yet."
+    
     await message.answer(text)
 
+async def render_review_queue(cursor: Optional[Tuple[datetime, int]] = None):
+    """Text and keyboard for one page of the moderation queue"""
+    rows = await get_review_queue(cursor, MODERATION_PAGE + 1)
+    has_more = len(rows) > MODERATION_PAGE
+    rows = rows[:MODERATION_PAGE]
+    
+    if not rows:
+        return "🛡 <b>Review queue</b>\n\nNothing to review.", None
+    
+    text = "🛡 <b>Review queue</b>\n\n"
+    buttons = []
+    for row in rows:
+        status = "🙈 hidden" if row["status"] == "hidden" else "👁 visible"
+        text += (
+            f"<b>{html.escape(row['full_name'])}</b> (#{row['reported_id']}) · {status}\n"
+            f"{row['reporters']} reporters, {row['reports']} reports, last {row['last_report_at']:%d/%m %H:%M}\n"
+        )
+        for reason in row["reasons"] or []:
+            text += f"  – {html.escape(reason[:120])}\n"
+        text += "\n"
+        buttons.append([
+            InlineKeyboardButton(text=f"✅ Clear #{row['reported_id']}", callback_data=f"modok_{row['reported_id']}"),
+            InlineKeyboardButton(text=f"⛔ Ban #{row['reported_id']}", callback_data=f"modban_{row['reported_id']}")
+        ])
+    if has_more:
+        last = rows[-1]
+        buttons.append([InlineKeyboardButton(
+            text="➡️", callback_data=f"modq_{encode_cursor(last['last_report_at'], last['reported_id'])}"
+        )])
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@router.callback_query(F.data == "modq")
+@router.callback_query(F.data.startswith("modq_"))
+async def show_review_queue(callback: CallbackQuery):
+    """Paginated list of reported profiles"""
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer()
+        return
+    
+    cursor = decode_cursor(callback.data.split("_", 1)[1]) if "_" in callback.data else None
+    text, markup = await render_review_queue(cursor)
+    if cursor is None:
+        await callback.message.answer(text, reply_markup=markup)
+    else:
+        await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("modok_"), flags={"once": True})
+@router.callback_query(F.data.startswith("modban_"), flags={"once": True})
+async def handle_review_action(callback: CallbackQuery):
+    """Clear or ban a reported profile from the queue"""
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer()
+        return
+    
+    action, reported_id = callback.data.split("_")
+    ban = action == "modban"
+    await review_report(int(reported_id), ban)
+    
+    text, markup = await render_review_queue()
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer(f"⛔ Banned #{reported_id}" if ban else f"✅ Cleared #{reported_id}")
+
 # ============= WEBHOOK SETUP FOR RAILWAY =============
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiohttp import web
 
+# Set in prefork worker processes; None when running as a single process
+WORKER_ID: Optional[int] = None
+_serving_state = {"draining": False, "in_flight": 0}
+
+@web.middleware
+async def track_in_flight(request: web.Request, handler):
+    """Count webhook requests being handled so shutdown can wait for them"""
+    if request.path != WEBHOOK_PATH:
+        return await handler(request)
+    _serving_state["in_flight"] += 1
+    try:
+        return await handler(request)
+    finally:
+        _serving_state["in_flight"] -= 1
+
+async def wait_for_in_flight(timeout: float) -> bool:
+    """Wait up to timeout for in-flight webhook updates; False if some remain"""
+    deadline = time.monotonic() + timeout
+    while _serving_state["in_flight"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    return not _serving_state["in_flight"]
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Expose process metrics as JSON"""
+    return web.json_response(get_metrics())
+
+async def healthz(request: web.Request) -> web.Response:
+    """Liveness: the worker's event loop is responding"""
+    return web.json_response({"status": "ok", "worker": WORKER_ID, "pid": os.getpid()})
+
+async def readyz(request: web.Request) -> web.Response:
+    """Readiness: dependencies reachable and not draining"""
+    body = {"worker": WORKER_ID, "pid": os.getpid()}
+    if _serving_state["draining"]:
+        return web.json_response({**body, "status": "draining"}, status=503)
+    try:
+        await redis.ping()
+        async with get_db_connection() as conn:
+            await conn.fetchval("SELECT 1")
+    except Exception as e:
+        return web.json_response({**body, "status": "unavailable", "error": str(e)}, status=503)
+    return web.json_response({**body, "status": "ready"})
+
+async def configure_webhook():
+    """Register the webhook with Telegram, or remove it for polling"""
+    if BOT_MODE == "polling":
+        await bot.delete_webhook(drop_pending_updates=WEBHOOK_DROP_PENDING)
+        return
+    
+    allowed_updates = sorted(dp.resolve_used_update_types())
+    # The secret can't be read back from Telegram, so the last registered
+    # settings are remembered as a hash and compared along with getWebhookInfo
+    fingerprint = hashlib.sha256(json.dumps(
+        [WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS, allowed_updates]
+    ).encode()).hexdigest()
+    info = await bot.get_webhook_info()
+    # setWebhook is rate limited; skip it when nothing changed
+    if (
+        info.url == WEBHOOK_URL
+        and await redis.get(WEBHOOK_FINGERPRINT_KEY) == fingerprint.encode()
+        and not WEBHOOK_DROP_PENDING
+    ):
+        return
+    await bot.set_webhook(
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=allowed_updates,
+        drop_pending_updates=WEBHOOK_DROP_PENDING,
+    )
+    await redis.set(WEBHOOK_FINGERPRINT_KEY, fingerprint)
+    logger.info("Webhook set to %s", WEBHOOK_URL)
+
 async def on_startup():
     """Initialize on startup"""
-    await init_db()
-    await bot.set_webhook(f"{os.getenv('RAILWAY_STATIC_URL', '')}/webhook")
+    await init_db_pool()
+    if WORKER_ID is None:
+        # In prefork mode the supervisor already did this once
+        await init_db()
+        await configure_webhook()
+    spawn(like_quota_flusher())
+    spawn(chat_message_flusher())
+    spawn(photo_revalidator())
+    await start_outbox_workers()
 
 async def on_shutdown():
     """Cleanup on shutdown"""
+    await stop_background_tasks()
+    await flush_like_quotas()
+    await flush_chat_messages()
     await bot.session.close()
+    await close_db_pool()
     await redis.close()
 
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+def build_webhook_app() -> web.Application:
+    """aiohttp app with the webhook route and health endpoints"""
+    app = web.Application(middlewares=[track_in_flight])
+    
+    # Answer Telegram only after the handler ran, so shutdown can wait
+    # for in-flight updates and failed ones are redelivered. Requests
+    # without the secret token header are rejected with 401
+    webhook_requests_handler = SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=WEBHOOK_SECRET,
+    )
+    webhook_requests_handler.register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/", healthz)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", metrics_endpoint)
+    
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def serve_webhook(reuse_port: bool = False):
+    """Serve the webhook until SIGTERM/SIGINT, then drain"""
+    # aiohttp runs the shutdown hooks (on_shutdown closes the pool, Redis
+    # and the bot session) before it waits for requests, so the waiting is
+    # done below; whatever is left after that is cancelled right away and
+    # redelivered by Telegram
+    runner = web.AppRunner(build_webhook_app(), shutdown_timeout=0)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", PORT, reuse_port=reuse_port)
+    await site.start()
+    logger.info("Worker %s (pid %s) serving webhook on port %s", WORKER_ID, os.getpid(), PORT)
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    
+    # Fail readiness first so no new traffic is routed here, then stop
+    # listening and let in-flight updates finish within SHUTDOWN_TIMEOUT
+    # before anything is torn down
+    _serving_state["draining"] = True
+    logger.info("Worker %s draining", WORKER_ID)
+    await asyncio.sleep(DRAIN_DELAY)
+    await site.stop()
+    if not await wait_for_in_flight(SHUTDOWN_TIMEOUT):
+        logger.warning("Worker %s cancelling %s updates still in flight",
+                       WORKER_ID, _serving_state["in_flight"])
+    await runner.cleanup()
+
+# ============= PREFORK SUPERVISOR =============
+def run_worker(worker_id: int):
+    """Entry point of one prefork worker process"""
+    global WORKER_ID
+    WORKER_ID = worker_id
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve_webhook(reuse_port=True))
+
+async def prepare_deployment():
+    """Migrate and register the webhook once, before workers start"""
+    await init_db_pool()
+    try:
+        await init_db()
+        await configure_webhook()
+    finally:
+        await close_db_pool()
+        await bot.session.close()
+        await redis.close()
+
+def run_supervisor(workers_count: int):
+    """Start N workers sharing PORT via SO_REUSEPORT and keep them alive"""
+    asyncio.run(prepare_deployment())
+    
+    ctx = multiprocessing.get_context("spawn")
+    workers: Dict[int, multiprocessing.Process] = {}
+    started_at: Dict[int, float] = {}
+    crashes: Dict[int, int] = defaultdict(int)
+    restart_at: Dict[int, float] = {}
+    stopping = False
+    failed = False
+    
+    def start(worker_id: int):
+        process = ctx.Process(target=run_worker, args=(worker_id,), name=f"worker-{worker_id}")
+        process.start()
+        workers[worker_id] = process
+        started_at[worker_id] = time.monotonic()
+    
+    def handle_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in workers.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM: workers drain themselves
+    
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    
+    for worker_id in range(workers_count):
+        start(worker_id)
+    logger.info("Supervisor %s started %s workers on port %s", os.getpid(), workers_count, PORT)
+    
+    while not stopping:
+        time.sleep(1)
+        now = time.monotonic()
+        for worker_id, process in list(workers.items()):
+            if process.is_alive() or stopping:
+                continue
+            if worker_id in restart_at:
+                if now >= restart_at[worker_id]:
+                    del restart_at[worker_id]
+                    start(worker_id)
+                continue
+            
+            # Exponential backoff for a crash loop; a worker that stayed up
+            # for a while starts over at one second
+            if now - started_at[worker_id] >= WORKER_STABLE_AFTER:
+                crashes[worker_id] = 0
+            crashes[worker_id] += 1
+            if crashes[worker_id] > WORKER_MAX_RESTARTS:
+                logger.error("Worker %s crashed %s times in a row, shutting down",
+                             worker_id, WORKER_MAX_RESTARTS)
+                failed = True
+                handle_signal(signal.SIGTERM, None)
+                break
+            delay = min(2 ** (crashes[worker_id] - 1), WORKER_RESTART_BACKOFF_MAX)
+            logger.warning("Worker %s exited with %s, restarting in %ss",
+                           worker_id, process.exitcode, delay)
+            restart_at[worker_id] = now + delay
+    
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT + DRAIN_DELAY + 5
+    for process in workers.values():
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            process.kill()
+    if failed:
+        raise SystemExit(1)  # let the platform restart the replica
+
 # ============= MAIN ENTRY POINT =============
 async def main():
     """Main entry point"""
-    # Initialize database
-    await init_db()
-    
-    # Register startup/shutdown
-    dp.startup.register(on_startup)
-    dp.shutdown.register(on_shutdown)
-    
-    # Check if running on Railway (has PORT env var)
-    if PORT != 8080:  # Railway provides PORT
-        # Webhook mode for Railway
-        app = web.Application()
-        
-        webhook_path = f"/webhook/{TOKEN}"
-        webhook_requests_handler = SimpleRequestHandler(
-            dispatcher=dp,
-            bot=bot,
-        )
-        webhook_requests_handler.register(app, path=webhook_path)
-        
-        setup_application(app, dp, bot=bot)
-        
-        runner = web.AppRunner(app)
-        await runner.setup()
-        site = web.TCPSite(runner, "0.0.0.0", PORT)
-        
+    if BOT_MODE == "webhook":
         print(f"Starting webhook server on port {PORT}")
-        await site.start()
-        
-        # Keep running
-        await asyncio.Event().wait()
+        await serve_webhook()
     else:
         # Polling mode for local development
         print("Starting in polling mode...")
         await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    logging.basicConfig(level=logging.INFO)
+    if BOT_MODE == "webhook" and WEB_CONCURRENCY > 1:
+        run_supervisor(WEB_CONCURRENCY)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,224 @@
+# tests/test_index_usage.py - EXPLAIN checks that hot-path queries use their indexes
+#
+# Needs a disposable Postgres database:
+#   TEST_DATABASE_URL=postgresql://localhost/matchbot_test python -m pytest tests
+# Migrations are applied to it; seed rows live in a transaction that is
+# rolled back at the end.
+import asyncio
+import json
+import os
+import re
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+import asyncpg  # noqa: E402
+
+import bot  # noqa: E402
+
+SEED_USERS = 2000
+SEED_TELEGRAM_BASE = 990_000_000
+
+SEED_STATEMENTS = [
+    f'''
+    INSERT INTO users (telegram_id, full_name, latitude, longitude, gender, preference)
+    SELECT {SEED_TELEGRAM_BASE} + g, 'Seed ' || g,
+           8.90 + (g % 40) * 0.01, 38.70 + (g / 40) * 0.01,
+           CASE WHEN g % 2 = 0 THEN 'male' ELSE 'female' END, 'both'
+    FROM generate_series(1, {SEED_USERS}) g
+    ''',
+    f'''
+    CREATE TEMP TABLE seed_users ON COMMIT DROP AS
+    SELECT id, row_number() OVER (ORDER BY id) AS n
+    FROM users WHERE telegram_id > {SEED_TELEGRAM_BASE}
+    ''',
+    f'''
+    INSERT INTO likes (from_user_id, to_user_id)
+    SELECT a.id, b.id FROM seed_users a
+    CROSS JOIN generate_series(1, 5) k
+    JOIN seed_users b ON b.n = (a.n + k - 1) % {SEED_USERS} + 1
+    ''',
+    f'''
+    INSERT INTO matches (user1_id, user2_id, matched_at)
+    SELECT LEAST(a.id, b.id), GREATEST(a.id, b.id), NOW() - k * INTERVAL '1 hour'
+    FROM seed_users a
+    CROSS JOIN generate_series(1, 3) k
+    JOIN seed_users b ON b.n = (a.n + k - 1) % {SEED_USERS} + 1
+    ''',
+    '''
+    INSERT INTO chat_messages (match_id, sender_id, message)
+    SELECT m.id, m.user1_id, 'hello'
+    FROM matches m JOIN seed_users s ON s.id = m.user1_id
+    CROSS JOIN generate_series(1, 5)
+    ''',
+    f'''
+    INSERT INTO reports (reporter_id, reported_id, reason)
+    SELECT a.id, b.id, 'spam' FROM seed_users a
+    JOIN seed_users b ON b.n = (a.n + 10) % {SEED_USERS} + 1
+    ''',
+    f'''
+    INSERT INTO blocks (blocker_id, blocked_id)
+    SELECT a.id, b.id FROM seed_users a
+    JOIN seed_users b ON b.n = (a.n + 20) % {SEED_USERS} + 1
+    ''',
+    '''
+    INSERT INTO report_summary (reported_id, reporters, reports, status, last_report_at)
+    SELECT id, 1, 1, CASE WHEN n % 10 = 0 THEN 'open' ELSE 'cleared' END,
+           NOW() - n * INTERVAL '1 minute'
+    FROM seed_users
+    ''',
+    "ANALYZE users, likes, matches, chat_messages, reports, blocks, report_summary",
+    # Tables this small would otherwise be read sequentially, and bitmap
+    # scans make the choice between equivalent indexes cost-noise
+    "SET LOCAL enable_seqscan = off",
+    "SET LOCAL enable_bitmapscan = off",
+]
+
+# (query, probe values bound to $1, $2, ..., index the plan must use).
+# The probe is a seed user: its id, geo cell and one of its matches
+CASES = {
+    "reverse like lookup": (
+        "SELECT from_user_id FROM likes WHERE to_user_id = $1",
+        ("user_id",),
+        "idx_likes_to_from",
+    ),
+    "match page, user1 side": (
+        '''
+        SELECT id FROM matches
+        WHERE user1_id = $1 AND (matched_at, id) < (NOW(), 2147483647)
+        ORDER BY matched_at DESC, id DESC LIMIT 10
+        ''',
+        ("user_id",),
+        "idx_matches_user1_keyset",
+    ),
+    "match page, user2 side": (
+        '''
+        SELECT id FROM matches
+        WHERE user2_id = $1 AND (matched_at, id) < (NOW(), 2147483647)
+        ORDER BY matched_at DESC, id DESC LIMIT 10
+        ''',
+        ("user_id",),
+        "idx_matches_user2_keyset",
+    ),
+    "match pair lookup": (
+        "SELECT id FROM matches WHERE user1_id = $1 AND user2_id = $1 + 1",
+        ("user_id",),
+        "matches_pair_key",
+    ),
+    "chat history page": (
+        '''
+        SELECT id FROM chat_messages
+        WHERE match_id = $1 AND id < 2147483647
+        ORDER BY id DESC LIMIT 20
+        ''',
+        ("match_id",),
+        "idx_chat_messages_match_id",
+    ),
+    "browse grid cells": (
+        '''
+        SELECT id FROM users u
+        WHERE u.geo_cell = ANY(ARRAY[$1::bigint])
+          AND u.id != $2
+          AND u.is_active AND NOT u.is_stealth
+        ''',
+        ("geo_cell", "user_id"),
+        "idx_users_geo_cell",
+    ),
+    "nearby alert recipients": (
+        '''
+        SELECT id FROM users
+        WHERE geo_cell = $1 AND notify_nearby AND is_active AND id > $2
+        ORDER BY id LIMIT 100
+        ''',
+        ("geo_cell", "user_id"),
+        "idx_users_notify_nearby",
+    ),
+    "latest reports per user": (
+        '''
+        SELECT reason FROM reports
+        WHERE reported_id = $1 ORDER BY created_at DESC LIMIT 3
+        ''',
+        ("user_id",),
+        "idx_reports_reported",
+    ),
+    "who blocked me": (
+        "SELECT blocker_id FROM blocks WHERE blocked_id = $1",
+        ("user_id",),
+        "idx_blocks_blocked",
+    ),
+    "review queue": (
+        '''
+        SELECT reported_id FROM report_summary
+        WHERE status IN ('open', 'hidden')
+        ORDER BY last_report_at DESC, reported_id DESC LIMIT 5
+        ''',
+        (),
+        "idx_report_summary_queue",
+    ),
+}
+
+def _index_names(plan) -> set:
+    """Every index referenced anywhere in an EXPLAIN (FORMAT JSON) plan"""
+    names = set()
+    if isinstance(plan, dict):
+        if "Index Name" in plan:
+            names.add(plan["Index Name"])
+        for value in plan.values():
+            names |= _index_names(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            names |= _index_names(value)
+    return names
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture(scope="module")
+def seeded(loop):
+    """Migrated schema plus seed rows, inside a transaction rolled back afterwards"""
+    async def setup():
+        await bot.init_db_pool()
+        try:
+            await bot.run_migrations()
+        finally:
+            await bot.close_db_pool()
+
+        conn = await asyncpg.connect(TEST_DATABASE_URL)
+        tx = conn.transaction()
+        await tx.start()
+        for statement in SEED_STATEMENTS:
+            await conn.execute(statement)
+        probe = await conn.fetchrow('''
+            SELECT u.id AS user_id, u.geo_cell,
+                   (SELECT min(m.id) FROM matches m
+                    WHERE u.id IN (m.user1_id, m.user2_id)) AS match_id
+            FROM users u WHERE u.telegram_id = $1
+        ''', SEED_TELEGRAM_BASE + SEED_USERS // 2)
+        assert probe["match_id"] is not None
+        return conn, tx, probe
+
+    conn, tx, probe = loop.run_until_complete(setup())
+    yield conn, probe
+    loop.run_until_complete(tx.rollback())
+    loop.run_until_complete(conn.close())
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_query_uses_index(loop, seeded, case):
+    conn, probe = seeded
+    query, params, index = CASES[case]
+    placeholders = set(re.findall(r"\$(\d+)", query))
+    assert placeholders == {str(n) for n in range(1, len(params) + 1)}, case
+    args = [probe[name] for name in params]
+    plan = loop.run_until_complete(
+        conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+    )
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    assert index in _index_names(plan), f"{case}: {plan}"
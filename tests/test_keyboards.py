@@ -0,0 +1,47 @@
+# tests/test_keyboards.py - Prebuilt keyboards stay shared but never leak changes
+import pytest
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import bot
+
+
+@pytest.mark.parametrize("lang", bot.SUPPORTED_LANGUAGES)
+def test_static_keyboards_match_a_validated_build(lang):
+    expected = bot._build_static_keyboards(lang)
+    for name, markup in expected.items():
+        assert bot._keyboard(lang, name) == markup, name
+
+
+def test_interests_keyboard_checks_selected_rows():
+    keyboard = bot.get_interests_keyboard("en", [2])
+    rows = keyboard.inline_keyboard
+    checked = bot.INTEREST_CATALOG[2]
+    assert rows[list(bot.INTEREST_CATALOG).index(2)] == [
+        InlineKeyboardButton(text=f"✅ {checked.en}", callback_data="interest_2")
+    ]
+    assert sum(row[0].text.startswith("✅ ") for row in rows[:-1]) == 1
+    assert rows[-1][0].callback_data == "interests_done"
+
+
+def test_mutating_a_returned_keyboard_does_not_leak():
+    before = bot.get_main_menu_keyboard("en")
+    expected = before.model_dump()
+    before.inline_keyboard.clear()
+    bot.get_settings_keyboard("en").inline_keyboard[0][0].text = "changed"
+    bot.get_interests_keyboard("en", [2]).inline_keyboard.pop()
+    bot.get_subcity_keyboard().inline_keyboard = []
+
+    assert bot.get_main_menu_keyboard("en").model_dump() == expected
+    assert bot.get_settings_keyboard("en") == bot._build_static_keyboards("en")["settings"]
+    assert bot.get_interests_keyboard("en", [2]).inline_keyboard[-1][0].callback_data == "interests_done"
+    assert bot.get_subcity_keyboard().inline_keyboard
+
+
+def test_keyboard_serializes_like_a_validated_build():
+    expected = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="English 🇺🇸", callback_data="lang_en")],
+        [InlineKeyboardButton(text="አማርኛ 🇪🇹", callback_data="lang_am")]
+    ])
+    assert bot.get_language_keyboard().model_dump(exclude_none=True) == (
+        expected.model_dump(exclude_none=True)
+    )
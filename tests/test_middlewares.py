@@ -0,0 +1,134 @@
+# tests/test_middlewares.py - Dedup markers must not outlive a cancelled handler
+import asyncio
+from datetime import datetime
+
+import pytest
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+import bot
+
+
+class FakeRedis:
+    """The few SET NX / DELETE calls the middlewares make, kept in a dict"""
+
+    def __init__(self):
+        self.store = {}
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.store:
+            return None
+        self.store[key] = value
+        return True
+
+    async def delete(self, *keys):
+        return sum(self.store.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        return BusyLock()
+
+
+class BusyLock:
+    """A user lock that is always held by someone else"""
+
+    async def acquire(self):
+        return False
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+    async def execute(self):
+        return [await self.redis.set(*args, **kwargs) for args, kwargs in self.calls]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(bot, "redis", fake)
+    return fake
+
+
+async def _blocked_handler(event, data):
+    await asyncio.Event().wait()
+
+
+async def _ok_handler(event, data):
+    return "handled"
+
+
+async def _cancel_then_redeliver(middleware, event, data):
+    """Cancel a stuck handler, then deliver the same event again"""
+    task = asyncio.create_task(middleware(_blocked_handler, event, data))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    return await middleware(_ok_handler, event, data)
+
+
+def _callback_query(query_id: str) -> CallbackQuery:
+    user = User(id=42, is_bot=False, first_name="Test")
+    message = Message(
+        message_id=7, date=datetime.now(), chat=Chat(id=42, type="private")
+    )
+    return CallbackQuery(
+        id=query_id, from_user=user, chat_instance="1", message=message, data="like_5"
+    )
+
+
+def test_update_redelivered_after_cancel(fake_redis):
+    update = Update(update_id=1001, callback_query=_callback_query("cq-1"))
+    result = asyncio.run(
+        _cancel_then_redeliver(bot.UpdateDedupMiddleware(), update, {})
+    )
+    assert result == "handled"
+
+
+def test_update_duplicate_dropped_after_success(fake_redis):
+    middleware = bot.UpdateDedupMiddleware()
+    update = Update(update_id=1002)
+
+    async def deliver_twice():
+        return (
+            await middleware(_ok_handler, update, {}),
+            await middleware(_ok_handler, update, {}),
+        )
+
+    assert asyncio.run(deliver_twice()) == ("handled", None)
+
+
+def test_once_action_retried_after_cancel(fake_redis):
+    data = {"handler": HandlerObject(callback=_ok_handler, flags={"once": True})}
+    result = asyncio.run(
+        _cancel_then_redeliver(bot.ActionOnceMiddleware(), _callback_query("cq-2"), data)
+    )
+    assert result == "handled"
+
+
+def test_update_redelivered_after_user_lock_timeout(fake_redis, monkeypatch):
+    monkeypatch.setattr(bot, "USER_LOCK_BACKEND", "redis")
+    dedup, user_lock = bot.UpdateDedupMiddleware(), bot.UserLockMiddleware()
+    update = Update(update_id=1003, callback_query=_callback_query("cq-3"))
+    data = {"event_from_user": update.callback_query.from_user}
+
+    async def locked(event, data):
+        return await user_lock(_ok_handler, event, data)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(dedup(locked, update, data))
+    assert fake_redis.store == {}